@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+
+# Admission control in front of Ollama (settings.OLLAMA_ADMISSION). Each
+# process runs at most its share of the deployment-wide limit of Ollama
+# requests at once (across threads and the event loop); up to OLLAMA_MAX_QUEUE
+# more wait for a slot, highest priority first, for at most
+# OLLAMA_QUEUE_TIMEOUT seconds. Anything beyond is rejected at once, so clients
+# get a 429 instead of a generation that outlives their timeout.
+def process_share(max_concurrency: int, workers: int) -> int:
+    """
+    Slots of one process out of a limit shared by workers processes.
+    """
+    return max(1, max_concurrency // max(1, workers))
+
+
+OLLAMA_MAX_CONCURRENCY = process_share(
+    settings.OLLAMA_ADMISSION["MAX_CONCURRENCY"], settings.OLLAMA_ADMISSION["WORKERS"]
+)
+OLLAMA_MAX_QUEUE = settings.OLLAMA_ADMISSION["MAX_QUEUE"]
+OLLAMA_QUEUE_TIMEOUT = settings.OLLAMA_ADMISSION["QUEUE_TIMEOUT"]
+
+# Priority classes, lower is served first
+PRIORITY_INTERACTIVE = 0  # Chat, RAG answers, query embeddings, the proxy
+PRIORITY_DEFAULT = 1
+PRIORITY_BATCH = 2  # Quizzes, summary parts, document ingestion
+
+TASK_PRIORITIES = {
+    "quiz": PRIORITY_BATCH,
+    "quiz_json": PRIORITY_BATCH,
+    "flashcards_json": PRIORITY_BATCH,
+    "summarize_part": PRIORITY_BATCH,
+}
+
+
+def task_priority(task: str) -> int:
+    """
+    Priority class of a response cache task (see services.cached_generate).
+    """
+    return TASK_PRIORITIES.get(task, PRIORITY_DEFAULT)
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request cannot get an Ollama slot: the wait queue is full, it
+    was pushed out by a higher priority request, or it waited too long.
+    retry_after is a suggested delay in seconds.
+    """
+
+    def __init__(self, retry_after: int, reason: str = "queue full"):
+        super().__init__(f"Ollama is overloaded ({reason}), retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, priority: int, seq: int):
+        self.entry = (priority, seq, self)
+        self.wake = None
+        self.granted = False  # A releasing request handed its slot over
+        self.rejected = False  # Pushed out of the queue by a higher priority
+
+
+class AdmissionController:
+    """
+    A concurrency limit with a bounded priority queue, usable from threads and
+    from coroutines of any event loop.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = []  # Heap of waiter entries
+        self._seq = itertools.count()
+        self._avg_seconds = 1.0  # Moving average of slot hold times
+        self.admitted = 0
+        self.rejected = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": len(self._queue),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the current queue is likely drained.
+        """
+        queued = len(self._queue) + 1
+        return max(1, math.ceil(self._avg_seconds * queued / self.max_concurrency))
+
+    def check(self, priority: int = PRIORITY_DEFAULT):
+        """
+        Raises Overloaded if a request of this priority would be rejected now.
+        Lets streaming views answer 429 before the response has started.
+        """
+        with self._lock:
+            if self._active < self.max_concurrency or len(self._queue) < self.max_queue:
+                return
+            if self._preemptable(priority) is None:
+                self.rejected += 1
+                raise Overloaded(self.retry_after())
+
+    def _preemptable(self, priority: int):
+        """
+        Returns the newest queued entry of the lowest priority if it is lower
+        than priority, else None. Must hold the lock.
+        """
+        if self._queue:
+            worst = max(self._queue)
+            if worst[0] > priority:
+                return worst
+        return None
+
+    def _enter(self, priority: int, wake) -> _Waiter | None:
+        """
+        Takes a free slot (returns None) or queues a waiter. Must hold the lock.
+        """
+        if self._active < self.max_concurrency and not self._queue:
+            self._active += 1
+            self.admitted += 1
+            return None
+        if len(self._queue) >= self.max_queue:
+            worst = self._preemptable(priority)
+            if worst is None:
+                self.rejected += 1
+                raise Overloaded(self.retry_after())
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            worst[2].rejected = True
+            self.rejected += 1
+            worst[2].wake()
+        waiter = _Waiter(priority, next(self._seq))
+        waiter.wake = wake
+        heapq.heappush(self._queue, waiter.entry)
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """
+        Takes a waiter that gave up out of the queue. Returns True if it was
+        granted a slot in the meantime, which it then owns.
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            if not waiter.rejected:
+                self._queue.remove(waiter.entry)
+                heapq.heapify(self._queue)
+                self.rejected += 1
+            return False
+
+    def _admitted(self, waiter: _Waiter):
+        if not waiter.granted:
+            raise Overloaded(self.retry_after(), "preempted")
+
+    def acquire(self, priority: int = PRIORITY_DEFAULT):
+        """
+        Blocks until a slot is free, or raises Overloaded.
+        """
+        finished = threading.Event()
+        with self._lock:
+            waiter = self._enter(priority, finished.set)
+        if waiter is None:
+            return
+        if finished.wait(self.queue_timeout) or self._abandon(waiter):
+            return self._admitted(waiter)
+        raise Overloaded(self.retry_after(), "timed out")
+
+    async def aacquire(self, priority: int = PRIORITY_DEFAULT):
+        """
+        Async acquire; waiting does not block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def resolve():
+            if not finished.done():
+                finished.set_result(None)
+
+        waiter = None
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(resolve)
+            except RuntimeError:  # Loop closed, nobody will use the slot
+                if waiter.granted:
+                    self.release()
+
+        with self._lock:
+            # Bound before the lock is released, so before wake can be called
+            waiter = self._enter(priority, wake)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(finished), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                return
+            raise Overloaded(self.retry_after(), "timed out")
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release()
+            raise
+        self._admitted(waiter)
+
+    def release(self, seconds: float = None):
+        """
+        Frees a slot, handing it to the first waiter. seconds is how long the
+        slot was held, used for Retry-After estimates.
+        """
+        with self._lock:
+            if seconds is not None:
+                self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * seconds
+            if self._queue:
+                waiter = heapq.heappop(self._queue)[2]
+                waiter.granted = True
+                self.admitted += 1
+            else:
+                self._active -= 1
+                waiter = None
+        if waiter is not None:
+            waiter.wake()
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_DEFAULT):
+        self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = PRIORITY_DEFAULT):
+        await self.aacquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+
+ollama_admission = AdmissionController(
+    OLLAMA_MAX_CONCURRENCY, OLLAMA_MAX_QUEUE, OLLAMA_QUEUE_TIMEOUT
+)
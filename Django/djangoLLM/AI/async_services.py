@@ -0,0 +1,469 @@
+import asyncio
+import os
+import weakref
+
+import httpx
+import ollama
+from asgiref.sync import sync_to_async
+
+from .admission import (
+    PRIORITY_DEFAULT,
+    PRIORITY_INTERACTIVE,
+    ollama_admission,
+    task_priority,
+)
+from .balancer import ollama_hosts
+from .cache import (
+    embedding_cache,
+    embedding_cache_key,
+    response_cache,
+    response_cache_key,
+)
+from .chat import chat_messages, record_turn
+from .models import ChatSession, EmbeddingVersion
+from .services import (
+    OLLAMA_HOST,
+    OLLAMA_MODEL,
+    SUMMARY_CONCURRENCY,
+    GenerationResult,
+    _StreamFrames,
+    _add_generated,
+    _batches,
+    _cached_results,
+    _missing_items,
+    _quiz_prompt,
+    _replay_frames,
+    _response_keys,
+    _retrieval_prompt,
+    _summary_steps,
+    get_embedding_version,
+)
+from .singleflight import AsyncSingleFlight
+from .timing import span
+from .token_metrics import token_metrics
+from .structured import StructuredKind, StructuredResult, generate_items
+
+# Async counterparts of the LLM service functions, used by the async views.
+# Waiting on Ollama costs no thread, so one ASGI worker can hold hundreds of
+# in-flight requests; database access still goes through sync_to_async. Only
+# the I/O is done here: keys, cache handling, prompts and frames come from
+# the helpers in services.py, shared with the sync functions.
+
+# Connection pool of each event loop's Ollama clients
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "100"))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+
+# httpx async clients are bound to the event loop that created them. Under ASGI
+# there is one loop per worker process; under WSGI every request runs its own.
+_async_ollama_clients = weakref.WeakKeyDictionary()
+_async_http_clients = weakref.WeakKeyDictionary()
+
+# Identical concurrent generations and embeddings share one Ollama request
+aflights = AsyncSingleFlight()
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+def get_async_ollama_client(host: str = None) -> ollama.AsyncClient:
+    """
+    Returns the Ollama client of host (default: OLLAMA_HOST) shared by the
+    requests of the running event loop.
+    """
+    host = host or OLLAMA_HOST
+    clients = _async_ollama_clients.setdefault(asyncio.get_running_loop(), {})
+    if host not in clients:
+        clients[host] = ollama.AsyncClient(host=host, limits=_pool_limits())
+    return clients[host]
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Returns the pooled HTTP client of the running event loop, used to proxy raw
+    requests to Ollama and Hugging Face.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(limits=_pool_limits(), timeout=120)
+        _async_http_clients[loop] = client
+    return client
+
+
+async def agenerate_embedding(
+    text: str, priority: int = PRIORITY_INTERACTIVE
+) -> list[float]:
+    """
+    Async generate_embedding.
+    """
+    return (await agenerate_embeddings([text], priority=priority))[0]
+
+
+async def agenerate_embeddings(
+    texts: list[str],
+    batch_size: int = None,
+    use_cache: bool = True,
+    version: EmbeddingVersion = None,
+    priority: int = PRIORITY_DEFAULT,
+) -> list[list[float]]:
+    """
+    Async generate_embeddings: cached texts are not sent to Ollama and the
+    embeddings are returned in input order.
+    """
+    version = version or await sync_to_async(get_embedding_version)()
+    keys = [embedding_cache_key(version.cache_name, text) for text in texts]
+    found = await sync_to_async(embedding_cache.get_many)(keys) if use_cache else {}
+
+    missing = _missing_items(keys, texts, found)
+    if missing:
+
+        async def embed():
+            embeddings = []
+            for batch in _batches(list(missing.values()), batch_size):
+                async with ollama_admission.aslot(priority), ollama_hosts.alease(
+                    version.name
+                ) as host:
+                    response = await get_async_ollama_client(host.url).embed(
+                        model=version.name,
+                        input=batch,
+                        keep_alive="30m",  # Keep model loaded for 30 minutes
+                    )
+                token_metrics.record(version.name, "embed", response)
+                embeddings.extend(response["embeddings"])
+            return embeddings
+
+        with span("embed"):
+            embeddings, leader = await aflights.do(tuple(missing), embed)
+        embeddings = dict(zip(missing, embeddings))
+        if use_cache and leader:
+            await sync_to_async(embedding_cache.set_many)(
+                version.cache_name, embeddings
+            )
+        found.update(embeddings)
+
+    return [found[key] for key in keys]
+
+
+async def acached_generate(
+    task: str,
+    prompt: str,
+    model: str = None,
+    options: dict = None,
+    use_cache: bool = True,
+) -> GenerationResult:
+    """
+    Async cached_generate.
+    """
+    return (await agenerate_many(task, [prompt], model, options, use_cache))[0]
+
+
+async def agenerate_many(
+    task: str,
+    prompts: list[str],
+    model: str = None,
+    options: dict = None,
+    use_cache: bool = True,
+    concurrency: int = None,
+) -> list[GenerationResult]:
+    """
+    Async generate_many: cache misses are generated concurrently, at most
+    `concurrency` (default SUMMARY_CONCURRENCY) at a time.
+    """
+    model = model or OLLAMA_MODEL
+    keys = _response_keys(model, task, prompts, options)
+    results = await sync_to_async(_cached_results)(keys) if use_cache else {}
+    missing = _missing_items(keys, prompts, results)
+
+    semaphore = asyncio.Semaphore(concurrency or SUMMARY_CONCURRENCY)
+
+    async def generate(key, prompt):
+        async with semaphore:
+            return await _acoalesced_generate(
+                key, prompt, model, options, task_priority(task), task=task
+            )
+
+    generated = await asyncio.gather(
+        *(generate(key, prompt) for key, prompt in missing.items())
+    )
+    if missing:
+        await sync_to_async(_add_generated)(results, missing, generated, model, task)
+    return [results[key] for key in keys]
+
+
+async def _acoalesced_generate(
+    key: str,
+    prompt: str,
+    model: str,
+    options: dict = None,
+    priority: int = PRIORITY_DEFAULT,
+    response_format: dict = None,
+    task: str = "",
+) -> tuple[str, bool]:
+    """
+    Async services._coalesced_generate.
+    """
+
+    async def generate():
+        async with ollama_admission.aslot(priority), ollama_hosts.alease(model) as host:
+            response = await get_async_ollama_client(host.url).generate(
+                model=model,
+                prompt=prompt,
+                options=options,
+                format=response_format,
+                keep_alive="30m",  # Keep model loaded for 30 minutes
+            )
+        token_metrics.record(model, task, response)
+        return response["response"]
+
+    with span("generate"):
+        return await aflights.do(key, generate)
+
+
+async def astream_generate(
+    prompt: str,
+    model: str = None,
+    options: dict = None,
+    task: str = None,
+    use_cache: bool = True,
+    priority: int = None,
+):
+    """
+    Async stream_generate: yields the same frames.
+    """
+    model = model or OLLAMA_MODEL
+    key = response_cache_key(model, task or "", prompt, options)
+    if task and use_cache:
+        text = await sync_to_async(response_cache.get)(key)
+        if text is not None:
+            for frame in _replay_frames(text):
+                yield frame
+            return
+
+    if priority is None:
+        priority = task_priority(task)
+    frames, leader = aflights.stream(
+        key, lambda: _ageneration_frames(prompt, model, options, priority, task)
+    )
+    pieces = []
+    async for frame in frames:
+        if frame.get("done") and task and leader:
+            await sync_to_async(response_cache.set)(key, model, task, "".join(pieces))
+        pieces.append(frame.get("response", ""))
+        yield frame
+
+
+async def _ageneration_frames(
+    prompt: str,
+    model: str,
+    options: dict = None,
+    priority: int = PRIORITY_DEFAULT,
+    task: str = "",
+):
+    """
+    Async services._generation_frames.
+    """
+    frames = _StreamFrames(model, task)
+    with span("generate"):
+        async with ollama_admission.aslot(priority), ollama_hosts.alease(model) as host:
+            async for chunk in await get_async_ollama_client(host.url).generate(
+                model=model,
+                prompt=prompt,
+                options=options,
+                stream=True,
+                keep_alive="30m",  # Keep model loaded for 30 minutes
+            ):
+                if frame := frames.frame(chunk, chunk["response"]):
+                    yield frame
+    yield frames.done()
+
+
+async def _afinal_summary_prompt(
+    text: str, use_cache: bool, concurrency: int = None
+) -> tuple[str, str, bool]:
+    """
+    Async services._final_summary_prompt.
+    """
+    steps = _summary_steps(text)
+    results = None
+    while True:
+        try:
+            task, prompts = steps.send(results)
+        except StopIteration as last:
+            return last.value
+        results = await agenerate_many(
+            task, prompts, use_cache=use_cache, concurrency=concurrency
+        )
+
+
+async def asummarize_text(
+    text: str, use_cache: bool = True, concurrency: int = None
+) -> GenerationResult:
+    """
+    Async summarize_text.
+    """
+    task, prompt, cached = await _afinal_summary_prompt(text, use_cache, concurrency)
+    result = await acached_generate(task, prompt, use_cache=use_cache)
+    return GenerationResult(result.text, cached=cached and result.cached)
+
+
+async def astream_summary(text: str, use_cache: bool = True, concurrency: int = None):
+    """
+    Async stream_summary.
+    """
+    task, prompt, cached = await _afinal_summary_prompt(text, use_cache, concurrency)
+    async for frame in astream_generate(prompt, task=task, use_cache=use_cache):
+        if frame.get("done"):
+            frame["cached"] = cached and frame["cached"]
+        yield frame
+
+
+async def agenerate_quiz(text: str, use_cache: bool = True) -> GenerationResult:
+    """
+    Async generate_quiz.
+    """
+    return await acached_generate("quiz", _quiz_prompt(text), use_cache=use_cache)
+
+
+def astream_quiz(text: str, use_cache: bool = True):
+    """
+    Async stream_quiz.
+    """
+    return astream_generate(_quiz_prompt(text), task="quiz", use_cache=use_cache)
+
+
+async def agenerate_structured(
+    kind: StructuredKind,
+    text: str,
+    count: int,
+    topic: str = "",
+    use_cache: bool = True,
+) -> StructuredResult:
+    """
+    Async generate_structured.
+    """
+
+    async def generate(key: str, prompt: str, schema: dict) -> str:
+        reply, _ = await _acoalesced_generate(
+            key,
+            prompt,
+            OLLAMA_MODEL,
+            priority=task_priority(kind.task),
+            response_format=schema,
+            task=kind.task,
+        )
+        return reply
+
+    return await generate_items(
+        kind, text, count, generate, OLLAMA_MODEL, topic, use_cache
+    )
+
+
+async def _arag_prompt(
+    query: str,
+    user,
+    ef_search: int = None,
+    probes: int = None,
+    mode: str = None,
+) -> str:
+    query_embedding = await agenerate_embedding(query)
+    return await sync_to_async(_retrieval_prompt)(
+        query, query_embedding, user, ef_search, probes, mode
+    )
+
+
+async def ahybrid_rag_generation(
+    query: str,
+    user,
+    ef_search: int = None,
+    probes: int = None,
+    mode: str = None,
+) -> str:
+    """
+    Async hybrid_rag_generation.
+    """
+    prompt = await _arag_prompt(
+        query, user, ef_search=ef_search, probes=probes, mode=mode
+    )
+    key = response_cache_key(OLLAMA_MODEL, "rag", prompt)
+    return (
+        await _acoalesced_generate(
+            key, prompt, OLLAMA_MODEL, priority=PRIORITY_INTERACTIVE, task="rag"
+        )
+    )[0]
+
+
+async def astream_hybrid_rag_generation(
+    query: str,
+    user,
+    ef_search: int = None,
+    probes: int = None,
+    mode: str = None,
+):
+    """
+    Async stream_hybrid_rag_generation.
+    """
+    prompt = await _arag_prompt(
+        query, user, ef_search=ef_search, probes=probes, mode=mode
+    )
+    async for frame in astream_generate(
+        prompt, task="rag", use_cache=False, priority=PRIORITY_INTERACTIVE
+    ):
+        yield frame
+
+
+async def astream_chat(session: ChatSession, content: str):
+    """
+    Yields the reply to content in a chat session as stream_generate frames
+    and stores the turn once complete; the final frame carries the reply's
+    message_id. See chat.py for how the history is kept short.
+    """
+    messages = await sync_to_async(chat_messages)(session, content)
+    pieces = []
+    async for frame in _achat_frames(messages, OLLAMA_MODEL, f"chat:{session.pk}"):
+        if frame.get("done"):
+            message = await sync_to_async(record_turn)(
+                session, content, "".join(pieces)
+            )
+            frame["message_id"] = message.pk
+        else:
+            pieces.append(frame["response"])
+        yield frame
+
+
+async def achat(session: ChatSession, content: str) -> tuple[str, dict]:
+    """
+    Returns the reply to content in a chat session and astream_chat's final
+    frame.
+    """
+    pieces = []
+    async for frame in astream_chat(session, content):
+        if frame.get("done"):
+            return "".join(pieces), frame
+        pieces.append(frame["response"])
+
+
+async def _achat_frames(messages: list[dict], model: str, affinity: str = None):
+    """
+    Streams a chat reply from Ollama as stream_generate frames. Requests with
+    the same affinity go to the same host, which holds their prompt cache.
+    """
+    frames = _StreamFrames(model, "chat")
+    with span("generate"):
+        async with ollama_admission.aslot(PRIORITY_INTERACTIVE), ollama_hosts.alease(
+            model, affinity
+        ) as host:
+            async for chunk in await get_async_ollama_client(host.url).chat(
+                model=model,
+                messages=messages,
+                stream=True,
+                keep_alive="30m",  # Keep model loaded for 30 minutes
+            ):
+                if frame := frames.frame(chunk, chunk["message"]["content"]):
+                    yield frame
+    yield frames.done()
@@ -0,0 +1,215 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Ollama servers to spread requests over, comma separated (default: OLLAMA_HOST)
+OLLAMA_HOSTS = [
+    host.strip().rstrip("/")
+    for host in os.getenv(
+        "OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+    ).split(",")
+    if host.strip()
+]
+# Seconds between health checks of each host's /api/ps (0 disables them)
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+# Consecutive failed checks after which a host gets no more requests
+OLLAMA_HEALTH_FAILURES = int(os.getenv("OLLAMA_HEALTH_FAILURES", "2"))
+# Routing counts a host without the model loaded as this many extra
+# outstanding requests, the price of loading it
+OLLAMA_COLD_PENALTY = int(os.getenv("OLLAMA_COLD_PENALTY", "2"))
+
+
+def model_name(model: str) -> str:
+    """
+    Model name as /api/ps reports it ("llama3.2" -> "llama3.2:latest").
+    """
+    return model if ":" in model else f"{model}:latest"
+
+
+class OllamaHost:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0  # Requests routed here and not finished
+        self.healthy = True
+        self.failures = 0  # Consecutive failed health checks
+        self.resident = set()  # Models loaded, from the last /api/ps
+
+    def __repr__(self):
+        state = "up" if self.healthy else "down"
+        return f"<OllamaHost {self.url} {state} outstanding={self.outstanding}>"
+
+
+class HostPool:
+    """
+    Routes Ollama requests over several servers: the host with the fewest
+    outstanding requests wins, preferring hosts that already have the model
+    loaded. Hosts failing OLLAMA_HEALTH_FAILURES health checks in a row, or a
+    connection attempt, are skipped until a check succeeds again. When every
+    host is down requests are still routed over all of them.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        health_interval: float = OLLAMA_HEALTH_INTERVAL,
+        cold_penalty: int = OLLAMA_COLD_PENALTY,
+    ):
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.health_interval = health_interval
+        self.cold_penalty = cold_penalty
+        self._lock = threading.Lock()
+        self._turn = itertools.count()  # Rotates between equally good hosts
+        self._checker = None
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "url": host.url,
+                    "healthy": host.healthy,
+                    "outstanding": host.outstanding,
+                    "resident": sorted(host.resident),
+                }
+                for host in self.hosts
+            ]
+
+    def pick(self, model: str = None, affinity: str = None) -> OllamaHost:
+        """
+        Chooses a host for a request and counts it as outstanding there; the
+        caller must release() it. Prefer lease() and alease().
+
+        Requests with the same affinity key (e.g. a chat session) go to the
+        same host while it is healthy and not busier than the least loaded one
+        by more than the cold penalty, so Ollama can reuse their cached prompt.
+        """
+        self._start_health_checks()
+        model = model_name(model) if model else None
+        with self._lock:
+            hosts = [host for host in self.hosts if host.healthy] or self.hosts
+
+            def load(host):
+                cold = model is not None and model not in host.resident
+                return host.outstanding + (self.cold_penalty if cold else 0)
+
+            least = min(load(host) for host in hosts)
+            preferred = self._preferred(hosts, affinity) if affinity else None
+            if preferred and load(preferred) <= least + self.cold_penalty:
+                host = preferred
+            else:
+                best = [host for host in hosts if load(host) == least]
+                host = best[next(self._turn) % len(best)]
+            host.outstanding += 1
+        return host
+
+    @staticmethod
+    def _preferred(hosts: list[OllamaHost], affinity: str) -> OllamaHost:
+        """
+        Rendezvous hashing: a key keeps its host when other hosts come and go.
+        """
+
+        def score(host):
+            return hashlib.sha256(f"{affinity}|{host.url}".encode()).digest()
+
+        return max(hosts, key=score)
+
+    def release(self, host: OllamaHost, model: str = None, failed: bool = False):
+        with self._lock:
+            host.outstanding -= 1
+            if failed and self._checker:
+                host.healthy = False  # Until the next health check succeeds
+            elif model:
+                host.resident.add(model_name(model))  # Ollama loaded it
+
+    @contextmanager
+    def lease(self, model: str = None, affinity: str = None):
+        """
+        Yields the host to send one request for model to. A connection error
+        takes the host out of rotation.
+        """
+        host = self.pick(model, affinity)
+        try:
+            yield host
+        except (ConnectionError, httpx.TransportError):
+            self.release(host, failed=True)
+            raise
+        except BaseException:
+            self.release(host)
+            raise
+        self.release(host, model)
+
+    @asynccontextmanager
+    async def alease(self, model: str = None, affinity: str = None):
+        """
+        Async lease().
+        """
+        host = self.pick(model, affinity)
+        try:
+            yield host
+        except (ConnectionError, httpx.TransportError):
+            self.release(host, failed=True)
+            raise
+        except BaseException:
+            self.release(host)
+            raise
+        self.release(host, model)
+
+    def check_health(self):
+        """
+        Asks every host for its loaded models (/api/ps), updating which hosts
+        are in rotation.
+        """
+        for host in self.hosts:
+            try:
+                response = httpx.get(
+                    f"{host.url}/api/ps", timeout=OLLAMA_HEALTH_TIMEOUT
+                )
+                response.raise_for_status()
+                resident = {model["name"] for model in response.json()["models"]}
+            except Exception as e:
+                with self._lock:
+                    host.failures += 1
+                    if host.healthy and host.failures >= OLLAMA_HEALTH_FAILURES:
+                        logger.warning("Ollama host %s is down: %s", host.url, e)
+                        host.healthy = False
+                continue
+            with self._lock:
+                if not host.healthy:
+                    logger.info("Ollama host %s is back up", host.url)
+                host.healthy = True
+                host.failures = 0
+                host.resident = resident
+
+    def _start_health_checks(self):
+        """
+        Starts the background health check thread of this process, if there is
+        more than one host to choose from.
+        """
+        if self._checker or len(self.hosts) < 2 or self.health_interval <= 0:
+            return
+        with self._lock:
+            if self._checker:
+                return
+            self._checker = threading.Thread(
+                target=self._check_forever, name="ollama-health", daemon=True
+            )
+        self._checker.start()
+
+    def _check_forever(self):
+        while True:
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.warning("Ollama health check failed: %s", e)
+            time.sleep(self.health_interval)
+
+
+ollama_hosts = HostPool(OLLAMA_HOSTS)
@@ -0,0 +1,228 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Circuit breakers: a backend whose last BREAKER_WINDOW calls (at least
+# BREAKER_MIN_CALLS) failed at BREAKER_FAILURE_RATE or more is skipped for
+# BREAKER_COOLDOWN seconds, then a single probe call decides whether it is
+# used again. Calls slower than BREAKER_SLOW_CALL_SECONDS count as failures.
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "20"))
+# Hedge delay used until a backend has BREAKER_MIN_CALLS timed successes
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "5"))
+
+# Every breaker by name, for stats
+circuit_breakers = {}
+
+# Runs hedged calls; a losing call finishes in the background
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a backend whose circuit breaker is open.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Tracks the error rate and latency of one backend over its last calls and
+    stops calling it while it is failing. Thread-safe.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        cooldown: float = BREAKER_COOLDOWN,
+        slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+        ignored_errors: tuple = (),
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.slow_call_seconds = slow_call_seconds
+        # Errors that say nothing about the backend's health (e.g. Overloaded)
+        self.ignored_errors = ignored_errors
+        self._calls = deque(maxlen=window)  # (failed, seconds)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.successes = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.opened = 0
+        circuit_breakers[name] = self
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.cooldown
+        ):
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        logger.warning("Circuit breaker %s opened", self.name)
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through now. In the half-open state only one
+        probe call is let through at a time.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record(self, ok: bool, seconds: float):
+        failed = not ok or seconds > self.slow_call_seconds
+        with self._lock:
+            self._calls.append((failed, seconds))
+            if failed:
+                self.failures += 1
+            else:
+                self.successes += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                    logger.info("Circuit breaker %s closed", self.name)
+            elif state == self.CLOSED and self._error_rate() >= self.failure_rate:
+                self._open()
+
+    def _error_rate(self) -> float:
+        if len(self._calls) < self.min_calls:
+            return 0.0
+        return sum(failed for failed, _ in self._calls) / len(self._calls)
+
+    def p95(self) -> float | None:
+        """
+        95th percentile duration of the recent successful calls, in seconds;
+        None until there are min_calls of them.
+        """
+        with self._lock:
+            durations = sorted(seconds for failed, seconds in self._calls if not failed)
+        if len(durations) < self.min_calls:
+            return None
+        return durations[math.ceil(0.95 * len(durations)) - 1]
+
+    def call(self, fn):
+        """
+        Returns fn(), recording its outcome, or raises CircuitOpen.
+        """
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        return self._call_allowed(fn)
+
+    def _call_allowed(self, fn):
+        start = time.monotonic()
+        try:
+            result = fn()
+        except self.ignored_errors:
+            with self._lock:
+                self._probing = False
+            raise
+        except Exception:
+            self.record(False, time.monotonic() - start)
+            raise
+        self.record(True, time.monotonic() - start)
+        return result
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "error_rate": round(self._error_rate(), 3),
+                "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+                "successes": self.successes,
+                "failures": self.failures,
+                "short_circuited": self.short_circuited,
+                "opened": self.opened,
+            }
+
+
+def call_with_fallback(backends: list, hedge: bool = False):
+    """
+    Returns the first successful result of backends, a list of
+    (CircuitBreaker, fn) in order of preference; backends with an open
+    breaker are skipped.
+
+    Without hedging each backend is only tried after the previous one failed.
+    With hedging the next backend is also started once the running one takes
+    longer than its p95 latency (HEDGE_DEFAULT_DELAY until that is known),
+    and whichever answers first wins. Raises the last error if all fail.
+    """
+    pending = list(backends)
+    running = {}
+    error = None
+
+    def start_next() -> bool:
+        while pending:
+            breaker, fn = pending.pop(0)
+            if breaker.allow():
+                future = _hedge_executor.submit(breaker._call_allowed, fn)
+                running[future] = breaker
+                return True
+        return False
+
+    if not start_next():
+        raise CircuitOpen(" and ".join(breaker.name for breaker, _ in backends))
+    while running:
+        timeout = None
+        if hedge and pending:
+            delays = [breaker.p95() for breaker in running.values()]
+            timeout = min((d for d in delays if d is not None), default=None)
+            timeout = HEDGE_DEFAULT_DELAY if timeout is None else timeout
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            start_next()  # Hedge
+            continue
+        for future in done:
+            del running[future]
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        if not running and not start_next():
+            break
+    raise error
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .metrics import CACHE_LOOKUPS
+from .models import EmbeddingCacheEntry, ResponseCacheEntry
+
+# Maximum number of embeddings kept in each process's memory tier
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+# LLM responses: per-process memory tier size, lifetime in seconds, and the
+# number of rows the shared database tier is trimmed to
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "50000"))
+# The database tier is pruned once every this many writes per process
+RESPONSE_CACHE_PRUNE_EVERY = 100
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded least-recently-used cache.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text for cache keys: Unicode NFC with collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """
+    Content address of an embedding: sha256 of the model name and normalized text.
+    """
+    payload = f"{model}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: an in-process LRU backed by the
+    EmbeddingCacheEntry table, which is shared by every worker.
+    """
+
+    def __init__(self, max_size: int):
+        self.memory = LRUCache(max_size)
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+    def get_many(self, keys: list[str]) -> dict:
+        """
+        Returns {key: embedding} for every key found in either tier.
+        Database hits are promoted into the memory tier.
+        """
+        found = {}
+        for key in keys:
+            embedding = self.memory.get(key)
+            if embedding is not None:
+                found[key] = embedding
+        memory_hits = sum(1 for key in keys if key in found)
+
+        missing = {key for key in keys if key not in found}
+        if missing:
+            for entry in EmbeddingCacheEntry.objects.filter(key__in=missing):
+                embedding = [float(x) for x in entry.embedding]
+                self.memory.set(entry.key, embedding)
+                found[entry.key] = embedding
+        hits = sum(1 for key in keys if key in found)
+
+        counts = {
+            "memory_hits": memory_hits,
+            "db_hits": hits - memory_hits,
+            "misses": len(keys) - hits,
+        }
+        with self._lock:
+            for name, count in counts.items():
+                self._counters[name] += count
+        for name, count in counts.items():
+            CACHE_LOOKUPS.labels("embedding", name).inc(count)
+        return found
+
+    def set_many(self, model: str, embeddings: dict):
+        """
+        Stores {key: embedding} in both tiers.
+        """
+        for key, embedding in embeddings.items():
+            self.memory.set(key, embedding)
+        EmbeddingCacheEntry.objects.bulk_create(
+            [
+                EmbeddingCacheEntry(key=key, model=model, embedding=embedding)
+                for key, embedding in embeddings.items()
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters of this process and the memory tier size.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = sum(stats.values())
+        hits = stats["memory_hits"] + stats["db_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        stats["memory_size"] = len(self.memory)
+        return stats
+
+    def clear(self):
+        """
+        Empties the memory tier and resets the counters.
+        """
+        self.memory.clear()
+        with self._lock:
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE)
+
+
+def response_cache_key(model: str, task: str, prompt: str, options=None) -> str:
+    """
+    Content address of an LLM response: sha256 of the model, task, generation
+    options and normalized prompt.
+    """
+    payload = "\0".join(
+        [model, task, json.dumps(options or {}, sort_keys=True), normalize_text(prompt)]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier LLM response cache: an in-process LRU backed by the
+    ResponseCacheEntry table, which is shared by every worker.
+
+    Entries expire after ttl seconds in both tiers. The table is trimmed to
+    max_entries rows, dropping the oldest first.
+    """
+
+    def __init__(self, max_size: int, ttl: int, max_entries: int):
+        self.memory = LRUCache(max_size)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+        CACHE_LOOKUPS.labels("response", name).inc()
+
+    def get(self, key: str) -> str | None:
+        """
+        Returns the cached response for key, or None.
+        Database hits are promoted into the memory tier.
+        """
+        entry = self.memory.get(key)
+        if entry is not None and entry[1] > time.time():
+            self._count("memory_hits")
+            return entry[0]
+
+        now = timezone.now()
+        row = ResponseCacheEntry.objects.filter(key=key, expires_at__gt=now).first()
+        if row is None:
+            self._count("misses")
+            return None
+        self.memory.set(key, (row.response, row.expires_at.timestamp()))
+        self._count("db_hits")
+        return row.response
+
+    def set(self, key: str, model: str, task: str, response: str):
+        """
+        Stores a response in both tiers, replacing any previous one.
+        """
+        expires_at = timezone.now() + timedelta(seconds=self.ttl)
+        self.memory.set(key, (response, expires_at.timestamp()))
+        ResponseCacheEntry.objects.bulk_create(
+            [
+                ResponseCacheEntry(
+                    key=key,
+                    model=model,
+                    task=task,
+                    response=response,
+                    expires_at=expires_at,
+                )
+            ],
+            update_conflicts=True,
+            unique_fields=["key"],
+            update_fields=["response", "expires_at"],
+        )
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % RESPONSE_CACHE_PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Deletes expired rows and the oldest rows beyond max_entries.
+        """
+        ResponseCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+        overflow = ResponseCacheEntry.objects.order_by("-created_at").values("key")[
+            self.max_entries :
+        ]
+        ResponseCacheEntry.objects.filter(key__in=overflow).delete()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters of this process and the memory tier size.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = sum(stats.values())
+        hits = stats["memory_hits"] + stats["db_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        stats["memory_size"] = len(self.memory)
+        return stats
+
+    def clear(self):
+        """
+        Empties the memory tier and resets the counters.
+        """
+        self.memory.clear()
+        with self._lock:
+            self._writes = 0
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+)
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+from django.db.models import Sum
+
+from .admission import PRIORITY_BATCH
+from .cache import response_cache_key
+from .models import ChatMessage, ChatSession
+from .services import OLLAMA_MODEL, _coalesced_generate, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Chat sessions keep their history on the server. Every turn sends Ollama the
+# same prefix (system prompt with the summary of compacted messages, then the
+# messages in order) plus the new message, so Ollama reuses the prompt cache
+# of the previous turn and only processes what was added. Once the history
+# exceeds CHAT_HISTORY_TOKENS, a background thread folds the oldest messages
+# into the summary, keeping about CHAT_RECENT_TOKENS of recent ones verbatim.
+# The prefix then changes once, and turn latency stays flat however long the
+# conversation gets.
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "2000"))
+CHAT_RECENT_TOKENS = int(os.getenv("CHAT_RECENT_TOKENS", "800"))
+CHAT_SYSTEM_PROMPT = os.getenv(
+    "CHAT_SYSTEM_PROMPT",
+    "You are a helpful study assistant. Answer clearly and concisely, and "
+    "explain concepts step by step when asked.",
+)
+
+# One compaction at a time per process; they run at batch priority anyway
+_compaction_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="chat-compaction"
+)
+_compacting = set()  # Session ids scheduled or being compacted
+_compacting_lock = threading.Lock()
+
+
+def chat_messages(session: ChatSession, content: str) -> list[dict]:
+    """
+    Messages for Ollama's chat API to answer content in session.
+    """
+    system = session.system_prompt or CHAT_SYSTEM_PROMPT
+    if session.summary:
+        system += f"\n\nSummary of the conversation so far:\n{session.summary}"
+    messages = [{"role": "system", "content": system}]
+    messages += [
+        {"role": message.role, "content": message.content}
+        for message in session.messages.filter(compacted=False)
+    ]
+    messages.append({"role": ChatMessage.ROLE_USER, "content": content})
+    return messages
+
+
+def history_tokens(session: ChatSession) -> int:
+    """
+    Estimated tokens of the messages not compacted yet.
+    """
+    total = session.messages.filter(compacted=False).aggregate(Sum("tokens"))
+    return total["tokens__sum"] or 0
+
+
+def record_turn(session: ChatSession, content: str, reply: str) -> ChatMessage:
+    """
+    Stores a finished turn and returns the reply's message. Schedules
+    compaction once the history is over budget.
+    """
+    with transaction.atomic():
+        ChatMessage.objects.create(
+            session=session,
+            role=ChatMessage.ROLE_USER,
+            content=content,
+            tokens=estimate_tokens(content),
+        )
+        message = ChatMessage.objects.create(
+            session=session,
+            role=ChatMessage.ROLE_ASSISTANT,
+            content=reply,
+            tokens=estimate_tokens(reply),
+        )
+        session.save(update_fields=["updated_at"])
+    if history_tokens(session) > CHAT_HISTORY_TOKENS:
+        schedule_compaction(session.pk)
+    return message
+
+
+def schedule_compaction(session_id: int):
+    """
+    Compacts the session in a background thread unless that is already due.
+    """
+    with _compacting_lock:
+        if session_id in _compacting:
+            return
+        _compacting.add(session_id)
+    _compaction_executor.submit(_compact_in_background, session_id)
+
+
+def _compact_in_background(session_id: int):
+    try:
+        compact_session(session_id)
+    except Exception as e:
+        # The next turn over budget tries again
+        logger.warning("Compacting chat session %s failed: %s", session_id, e)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(session_id)
+        close_old_connections()
+
+
+def compact_session(session_id: int) -> bool:
+    """
+    Folds the oldest messages of a session into its summary, keeping whole
+    turns of up to CHAT_RECENT_TOKENS verbatim. Returns False if there was
+    nothing to fold or the session changed meanwhile.
+    """
+    session = ChatSession.objects.filter(pk=session_id).first()
+    if session is None:
+        return False
+    messages = list(session.messages.filter(compacted=False))
+    cut, kept = len(messages), 0
+    while cut and kept + messages[cut - 1].tokens <= CHAT_RECENT_TOKENS:
+        cut -= 1
+        kept += messages[cut].tokens
+    # The verbatim part starts with a question, not half a turn
+    while cut < len(messages) and messages[cut].role != ChatMessage.ROLE_USER:
+        cut += 1
+    old = messages[:cut]
+    if not old:
+        return False
+
+    prompt = _compaction_prompt(session.summary, old)
+    summary, _ = _coalesced_generate(
+        response_cache_key(OLLAMA_MODEL, "chat_summary", prompt),
+        prompt,
+        OLLAMA_MODEL,
+        priority=PRIORITY_BATCH,
+        task="chat_summary",
+    )
+    with transaction.atomic():
+        locked = ChatSession.objects.select_for_update().filter(pk=session_id).first()
+        if locked is None or locked.summary != session.summary:
+            return False  # Deleted, or compacted by another process
+        locked.summary = summary.strip()
+        locked.save(update_fields=["summary"])
+        ChatMessage.objects.filter(pk__in=[message.pk for message in old]).update(
+            compacted=True
+        )
+    logger.info("Compacted %s messages of chat session %s", len(old), session_id)
+    return True
+
+
+def _compaction_prompt(summary: str, messages: list[ChatMessage]) -> str:
+    transcript = "\n".join(
+        f"{message.role.capitalize()}: {message.content}" for message in messages
+    )
+    return (
+        "Update the summary of a conversation between a student and a study "
+        "assistant with the new messages below. Keep the facts, definitions, "
+        "decisions and open questions the assistant may need later; leave out "
+        "small talk. Answer with the updated summary only.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
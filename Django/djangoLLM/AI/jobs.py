@@ -0,0 +1,148 @@
+import logging
+import os
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Document, IngestionJob
+from .services import DocumentSuperseded, index_document
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed job stays invisible to other workers before it is retried
+INGESTION_VISIBILITY_TIMEOUT = int(os.getenv("INGESTION_VISIBILITY_TIMEOUT", "600"))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+INGESTION_RETRY_BACKOFF = int(os.getenv("INGESTION_RETRY_BACKOFF", "30"))  # seconds
+
+
+def enqueue_ingestion(document, data: bytes, content_type: str) -> IngestionJob:
+    """
+    Queues an uploaded file for background indexing.
+
+    Jobs still pending for an earlier upload of the document are superseded:
+    queued or retrying ones are never claimed again, and one already running
+    discards its result (see services.index_document).
+    """
+    with transaction.atomic():
+        # Also serializes concurrent uploads of the same document
+        Document.objects.filter(pk=document.pk).update(revision=F("revision") + 1)
+        document.refresh_from_db(fields=["revision"])
+        IngestionJob.objects.filter(
+            document=document,
+            status__in=[IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING],
+        ).update(
+            status=IngestionJob.STATUS_SUPERSEDED,
+            payload=b"",
+            updated_at=timezone.now(),
+        )
+        return IngestionJob.objects.create(
+            document=document,
+            revision=document.revision,
+            payload=data,
+            content_type=content_type,
+            max_attempts=INGESTION_MAX_ATTEMPTS,
+            available_at=timezone.now(),
+        )
+
+
+def claim_job(worker_id: str, visibility_timeout: int = None) -> IngestionJob | None:
+    """
+    Claims the oldest available job, or returns None if there is none.
+
+    Queued jobs whose retry time has come and running jobs whose visibility
+    timeout expired are both available. Rows are locked with SKIP LOCKED so
+    concurrent workers never claim the same job.
+    """
+    visibility_timeout = visibility_timeout or INGESTION_VISIBILITY_TIMEOUT
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            IngestionJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                status__in=[IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING],
+                available_at__lte=now,
+            )
+            .order_by("available_at")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = IngestionJob.STATUS_RUNNING
+        job.attempts += 1
+        job.available_at = now + timedelta(seconds=visibility_timeout)
+        job.locked_by = worker_id
+        job.save(
+            update_fields=[
+                "status",
+                "attempts",
+                "available_at",
+                "locked_by",
+                "updated_at",
+            ]
+        )
+        return job
+
+
+def _finish(job: IngestionJob, **fields) -> bool:
+    """
+    Updates a claimed job unless another worker has since reclaimed it.
+    """
+    return bool(
+        IngestionJob.objects.filter(
+            pk=job.pk,
+            status=IngestionJob.STATUS_RUNNING,
+            locked_by=job.locked_by,
+            attempts=job.attempts,
+        ).update(updated_at=timezone.now(), **fields)
+    )
+
+
+def run_job(job: IngestionJob) -> bool:
+    """
+    Indexes a claimed job's document. Returns True on success.
+
+    On failure the job is requeued with exponential backoff, or marked failed
+    together with its document once max_attempts is reached. A job superseded
+    by a newer upload of its document is skipped and leaves the document alone.
+    """
+    document = job.document
+    try:
+        if document.revision != job.revision:
+            raise DocumentSuperseded(document.pk)
+        if job.attempts > job.max_attempts:
+            # A worker died during the last allowed attempt
+            raise RuntimeError("Visibility timeout expired on the final attempt.")
+        chunk_count = index_document(
+            document, bytes(job.payload), job.content_type, revision=job.revision
+        )
+    except DocumentSuperseded:
+        logger.info("Skipped superseded ingestion of document %s", document.pk)
+        _finish(job, status=IngestionJob.STATUS_SUPERSEDED, payload=b"")
+        return False
+    except Exception as e:
+        logger.warning(
+            "Ingestion of document %s failed (attempt %s/%s): %s",
+            document.pk,
+            job.attempts,
+            job.max_attempts,
+            e,
+        )
+        if job.attempts < job.max_attempts:
+            backoff = INGESTION_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+            _finish(
+                job,
+                status=IngestionJob.STATUS_QUEUED,
+                available_at=timezone.now() + timedelta(seconds=backoff),
+                last_error=str(e),
+            )
+        elif _finish(job, status=IngestionJob.STATUS_FAILED, last_error=str(e)):
+            document.status = "failed"
+            document.save(update_fields=["status"])
+        return False
+
+    if _finish(job, status=IngestionJob.STATUS_DONE, payload=b"", last_error=""):
+        document.status = "indexed"
+        document.save(update_fields=["status"])
+        logger.info("Indexed document %s into %s chunks", document.pk, chunk_count)
+    return True
@@ -0,0 +1,133 @@
+import io
+import os
+import random
+import time
+from django.core.management.base import BaseCommand
+
+from AI.pdf import iter_pdf_pages
+from AI.services import iter_chunks
+
+WORDS = (
+    "cell membrane protein energy reaction enzyme theory model equation force "
+    "history market policy language structure system process function data"
+).split()
+
+
+def synthetic_pdf(pages: list[str]) -> bytes:
+    """
+    Builds a minimal PDF with one page per string, each line drawn as text.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in pages:
+        lines = [
+            line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            for line in text.split("\n")
+        ]
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(
+            f"({line}) Tj T*" for line in lines
+        )
+        stream = (stream + " ET").encode("latin-1")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids),
+        len(kids),
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(
+        b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+        % (len(objects) + 1, xref)
+    )
+    return out.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures PDF text extraction and chunking throughput in-process and with "
+        "the process pool, on a given PDF or a synthetic one"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", help="PDF to benchmark instead of synthetic")
+        parser.add_argument("--pages", type=int, default=500)
+        parser.add_argument("--lines", type=int, default=40, help="Lines per page")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            nargs="+",
+            default=[1, 2, os.cpu_count() or 1],
+            help="Process counts to compare (1 = in-process)",
+        )
+        parser.add_argument("--pages-per-task", type=int, default=None)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            with open(options["file"], "rb") as f:
+                data = f.read()
+        else:
+            rng = random.Random(options["seed"])
+            data = synthetic_pdf(
+                [
+                    "\n".join(
+                        " ".join(rng.choice(WORDS) for _ in range(12)) + "."
+                        for _ in range(options["lines"])
+                    )
+                    for _ in range(options["pages"])
+                ]
+            )
+        self.stdout.write(f"PDF size: {len(data) / 1024 / 1024:.2f} MB")
+
+        self.stdout.write(
+            f"\n{'workers':<10}{'pages':>8}{'chunks':>8}"
+            f"{'first ms':>10}{'total s':>10}{'pages/s':>10}"
+        )
+        for workers in sorted(set(options["workers"])):
+            pages = 0
+
+            def counted():
+                nonlocal pages
+                for text in iter_pdf_pages(
+                    data, workers=workers, pages_per_task=options["pages_per_task"]
+                ):
+                    pages += 1
+                    yield text
+
+            start = time.time()
+            first_chunk = None
+            chunks = 0
+            for _ in iter_chunks(counted()):
+                if first_chunk is None:
+                    # Time until embedding could start
+                    first_chunk = time.time() - start
+                chunks += 1
+            total = time.time() - start
+
+            self.stdout.write(
+                f"{workers:<10}{pages:>8}{chunks:>8}"
+                f"{(first_chunk or 0) * 1000:>10.1f}{total:>10.2f}"
+                f"{pages / total if total else 0:>10.1f}"
+            )
+
+        self.stdout.write(self.style.SUCCESS("\n✓ Benchmark complete"))
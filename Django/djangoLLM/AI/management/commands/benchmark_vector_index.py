@@ -0,0 +1,132 @@
+import random
+import time
+import uuid
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from pgvector.django import CosineDistance
+
+from AI.models import Document, TextEmbedding
+from AI.services import search_similar_chunks
+from AI.vector_index import (
+    QUANTIZATIONS,
+    VECTOR_INDEX_NAME,
+    create_vector_index,
+    drop_vector_index,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures index size, build time, latency and recall@k of the full, halfvec "
+        "and binary-quantized vector indexes on synthetic embeddings. Everything "
+        "runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--clusters", type=int, default=50)
+        parser.add_argument(
+            "--quantizations", nargs="+", choices=QUANTIZATIONS, default=QUANTIZATIONS
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        dimensions = TextEmbedding._meta.get_field("embedding").dimensions
+        k = options["k"]
+
+        # Clustered unit vectors look more like real embeddings than uniform noise
+        centers = [
+            [rng.gauss(0, 1) for _ in range(dimensions)]
+            for _ in range(options["clusters"])
+        ]
+
+        def sample():
+            center = rng.choice(centers)
+            vector = [c + rng.gauss(0, 0.6) for c in center]
+            norm = sum(v * v for v in vector) ** 0.5
+            return [v / norm for v in vector]
+
+        with transaction.atomic():
+            user = User.objects.create(username=f"vector-benchmark-{uuid.uuid4().hex}")
+            doc = Document.objects.create(
+                user=user, filename="benchmark", file_type="text/plain"
+            )
+
+            self.stdout.write(f"Inserting {options['rows']} synthetic embeddings...")
+            TextEmbedding.objects.bulk_create(
+                (
+                    TextEmbedding(
+                        document=doc, owner=user, text=f"row {i}", embedding=sample()
+                    )
+                    for i in range(options["rows"])
+                ),
+                batch_size=1000,
+            )
+            queries = [sample() for _ in range(options["queries"])]
+
+            with connection.cursor() as cursor:
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                cursor.execute(
+                    f"ANALYZE {connection.ops.quote_name(TextEmbedding._meta.db_table)}"
+                )
+            with connection.schema_editor() as schema_editor:
+                drop_vector_index(schema_editor, TextEmbedding)
+
+            # Exact nearest neighbours without any ANN index
+            truth = [
+                set(
+                    TextEmbedding.objects.filter(owner=user)
+                    .annotate(distance=CosineDistance("embedding", query))
+                    .order_by("distance")
+                    .values_list("id", flat=True)[:k]
+                )
+                for query in queries
+            ]
+
+            self.stdout.write(
+                f"\n{'index':<10}{'size MB':>10}{'build s':>10}"
+                f"{'avg ms':>10}{'recall@' + str(k):>12}"
+            )
+            for quantization in options["quantizations"]:
+                config = {**settings.VECTOR_INDEX, "QUANTIZATION": quantization}
+                with override_settings(VECTOR_INDEX=config):
+                    start = time.time()
+                    with connection.schema_editor() as schema_editor:
+                        create_vector_index(schema_editor, TextEmbedding)
+                    build_time = time.time() - start
+
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            "SELECT pg_relation_size(%s::regclass)",
+                            [connection.ops.quote_name(VECTOR_INDEX_NAME)],
+                        )
+                        (size,) = cursor.fetchone()
+
+                    hits = 0
+                    start = time.time()
+                    for query, expected in zip(queries, truth):
+                        results = search_similar_chunks(
+                            query, user=user, limit=k, max_distance=2.0
+                        )
+                        hits += len(expected & {r.id for r in results})
+                    latency = (time.time() - start) / len(queries) * 1000
+
+                    with connection.schema_editor() as schema_editor:
+                        drop_vector_index(schema_editor, TextEmbedding)
+
+                self.stdout.write(
+                    f"{quantization:<10}{size / 1024 / 1024:>10.2f}{build_time:>10.2f}"
+                    f"{latency:>10.2f}{hits / (k * len(queries)):>12.3f}"
+                )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            self.style.SUCCESS("\n✓ Benchmark complete (data rolled back)")
+        )
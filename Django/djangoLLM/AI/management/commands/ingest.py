@@ -0,0 +1,268 @@
+import mimetypes
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from AI.admission import PRIORITY_BATCH
+from AI.models import Document, TextEmbedding
+from AI.services import (
+    EMBEDDING_BATCH_SIZE,
+    SUPPORTED_DOCUMENT_TYPES,
+    chunk_hash,
+    generate_embeddings,
+    get_embedding_version,
+    iter_document_chunks,
+)
+
+
+def iter_source_files(path: str):
+    """
+    Yields (name, content_type, data) for every supported file in a directory
+    tree or zip archive, in name order. Other files are skipped.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in sorted(archive.infolist(), key=lambda info: info.filename):
+                content_type = mimetypes.guess_type(info.filename)[0]
+                if not info.is_dir() and content_type in SUPPORTED_DOCUMENT_TYPES:
+                    yield info.filename, content_type, archive.read(info)
+        return
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            content_type = mimetypes.guess_type(filename)[0]
+            if content_type in SUPPORTED_DOCUMENT_TYPES:
+                file_path = os.path.join(root, filename)
+                with open(file_path, "rb") as f:
+                    yield os.path.relpath(file_path, path), content_type, f.read()
+
+
+def parse_file(name: str, content_type: str, data: bytes):
+    """
+    Extracts and chunks one file. Runs in a parser process.
+    Returns (name, content_type, chunks, seconds).
+    """
+    start = time.time()
+    # The parser pool already spreads files over processes
+    chunks = list(iter_document_chunks(data, content_type, pdf_workers=1))
+    return name, content_type, chunks, time.time() - start
+
+
+def bounded_submit(executor, fn, items, window: int):
+    """
+    Submits fn(*item) for each item, keeping at most `window` tasks pending,
+    and yields (item, future) pairs as the tasks complete.
+    """
+    pending = {}
+
+    def completed():
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+
+    for item in items:
+        if len(pending) >= window:
+            yield from completed()
+        pending[executor.submit(fn, *item)] = item
+    while pending:
+        yield from completed()
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-ingests every PDF and text file of a directory or zip archive for a "
+        "user: files are parsed in a process pool, embedded through Ollama with "
+        "bounded concurrency and bulk-inserted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Directory or .zip archive to ingest")
+        parser.add_argument(
+            "--user", required=True, help="Username owning the documents"
+        )
+        parser.add_argument(
+            "--parse-workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Parser processes (1 parses in-process; default: CPU count)",
+        )
+        parser.add_argument(
+            "--embed-concurrency",
+            type=int,
+            default=4,
+            help="Documents embedded in parallel (default: 4)",
+        )
+        parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+        parser.add_argument(
+            "--insert-batch",
+            type=int,
+            default=50,
+            help="Documents written per transaction (default: 50)",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist.")
+        try:
+            self.user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']!r} does not exist.")
+        self.version = get_embedding_version()
+        self.batch_size = options["batch_size"]
+        self.stage_seconds = {"parse": 0.0, "embed": 0.0, "insert": 0.0}
+        self.failed = []
+        docs = chunks = 0
+
+        workers = options["parse_workers"]
+        sources = iter_source_files(path)
+        start = time.time()
+        if workers <= 1:
+            parsers = ThreadPoolExecutor(max_workers=1)
+        else:
+            # spawn rather than fork: the embedding threads hold DB connections
+            parsers = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        concurrency = options["embed_concurrency"]
+        with parsers, ThreadPoolExecutor(max_workers=concurrency) as embedders:
+            parsed = self.parsed_files(
+                bounded_submit(parsers, parse_file, sources, workers * 2)
+            )
+            pending = []
+            for (name, _, _), future in bounded_submit(
+                embedders, self.embed_file, parsed, concurrency * 2
+            ):
+                try:
+                    *embedded, seconds = future.result()
+                except Exception as e:
+                    self.failed.append((name, e))
+                    continue
+                self.stage_seconds["embed"] += seconds
+                pending.append(embedded)
+                if len(pending) >= options["insert_batch"]:
+                    docs, chunks = self.insert(pending, docs, chunks)
+                    pending = []
+            if pending:
+                docs, chunks = self.insert(pending, docs, chunks)
+        elapsed = time.time() - start
+
+        for name, error in self.failed:
+            self.stdout.write(self.style.WARNING(f"  Skipped {name}: {error}"))
+        self.stdout.write(
+            f"\n{docs} documents, {chunks} chunks in {elapsed:.1f}s: "
+            f"{docs / elapsed if elapsed else 0:.1f} docs/s, "
+            f"{chunks / elapsed if elapsed else 0:.1f} chunks/s"
+        )
+        # Parse and embed run in parallel, so their summed time can exceed the total
+        for stage, seconds in self.stage_seconds.items():
+            self.stdout.write(f"  {stage:<8}{seconds:>8.1f}s")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ Ingested {docs} documents ({len(self.failed)} failed)"
+            )
+        )
+
+    def parsed_files(self, futures):
+        """
+        Yields the parse results of successfully parsed files.
+        """
+        for (name, _, _), future in futures:
+            try:
+                name, content_type, chunks, seconds = future.result()
+            except Exception as e:
+                self.failed.append((name, e))
+                continue
+            self.stage_seconds["parse"] += seconds
+            if not chunks:
+                self.failed.append((name, "no text found"))
+                continue
+            yield name, content_type, chunks
+
+    def embed_file(self, name, content_type, chunks):
+        """
+        Embeds the distinct chunks of a parsed file. Runs in an embedding thread.
+        Returns (name, content_type, chunks, {hash: embedding}, seconds).
+        """
+        start = time.time()
+        try:
+            texts = {chunk_hash(chunk.text): chunk.text for chunk in chunks}
+            embeddings = generate_embeddings(
+                list(texts.values()),
+                batch_size=self.batch_size,
+                version=self.version,
+                priority=PRIORITY_BATCH,
+            )
+        finally:
+            connection.close()
+        embeddings = dict(zip(texts, embeddings))
+        return name, content_type, chunks, embeddings, time.time() - start
+
+    def insert(self, files, docs: int, chunks: int):
+        """
+        Bulk-inserts the Document and TextEmbedding rows of embedded files.
+        Returns the updated document and chunk counts.
+        """
+        start = time.time()
+        with transaction.atomic():
+            # Same cutover guard as index_document
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "LOCK TABLE %s IN ROW EXCLUSIVE MODE"
+                    % connection.ops.quote_name(TextEmbedding._meta.db_table)
+                )
+            if not get_embedding_version().matches(self.version):
+                raise CommandError("The embedding model changed during ingestion.")
+
+            documents = Document.objects.bulk_create(
+                [
+                    Document(
+                        user=self.user,
+                        filename=os.path.basename(name)[:255],
+                        file_type=content_type,
+                        status="indexed",
+                    )
+                    for name, content_type, _, _ in files
+                ]
+            )
+            rows = []
+            for document, (_, _, file_chunks, embeddings) in zip(documents, files):
+                for chunk in file_chunks:
+                    digest = chunk_hash(chunk.text)
+                    rows.append(
+                        TextEmbedding(
+                            document=document,
+                            owner_id=self.user.pk,
+                            text=chunk.text,
+                            content_hash=digest,
+                            embedding=embeddings[digest],
+                            embedding_model=self.version.name,
+                            embedding_version=self.version.version,
+                            chunk_index=chunk.chunk_index,
+                            page_number=chunk.page_number,
+                            char_start=chunk.char_start,
+                            char_end=chunk.char_end,
+                        )
+                    )
+            TextEmbedding.objects.bulk_create(rows, batch_size=500)
+
+        self.stage_seconds["insert"] += time.time() - start
+        docs += len(documents)
+        chunks += len(rows)
+        self.stdout.write(f"  {docs} documents, {chunks} chunks")
+        return docs, chunks
@@ -0,0 +1,93 @@
+import logging
+import os
+import socket
+import threading
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from AI.jobs import INGESTION_VISIBILITY_TIMEOUT, claim_job, run_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Processes queued document ingestion jobs from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=int(os.getenv("INGESTION_WORKER_CONCURRENCY", "2")),
+            help="Number of jobs processed in parallel (default: 2)",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait when the queue is empty (default: 2)",
+        )
+        parser.add_argument(
+            "--visibility-timeout",
+            type=int,
+            default=INGESTION_VISIBILITY_TIMEOUT,
+            help="Seconds a claimed job stays hidden from other workers",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling",
+        )
+
+    def handle(self, *args, **options):
+        worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        stop = threading.Event()
+        processed = {"ok": 0, "failed": 0}
+        lock = threading.Lock()
+
+        def work(slot):
+            worker_id = f"{worker_name}:{slot}"
+            try:
+                while not stop.is_set():
+                    close_old_connections()
+                    job = claim_job(worker_id, options["visibility_timeout"])
+                    if job is None:
+                        if options["once"]:
+                            return
+                        stop.wait(options["poll_interval"])
+                        continue
+                    ok = run_job(job)
+                    with lock:
+                        processed["ok" if ok else "failed"] += 1
+            except Exception:
+                logger.error("Ingestion worker %s crashed", worker_id, exc_info=True)
+                raise
+            finally:
+                connection.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ingestion worker {worker_name} started "
+                f"(concurrency={options['concurrency']})"
+            )
+        )
+        threads = [
+            threading.Thread(target=work, args=(slot,), daemon=True)
+            for slot in range(options["concurrency"])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the jobs in progress...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ Processed {processed['ok']} jobs ({processed['failed']} failed)"
+            )
+        )
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from AI.models import EmbeddingVersion, TextEmbedding
+from AI.vector_index import (
+    create_vector_index,
+    drop_vector_index,
+    get_vector_index_settings,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the ANN index on TextEmbedding.embedding using the type and "
+        "parameters in settings.VECTOR_INDEX"
+    )
+
+    def handle(self, *args, **options):
+        config = get_vector_index_settings()
+        self.stdout.write(f"Rebuilding {config['TYPE']} index on TextEmbedding...")
+
+        start = time.time()
+        with transaction.atomic(), connection.schema_editor() as schema_editor:
+            drop_vector_index(schema_editor, TextEmbedding)
+            create_vector_index(
+                schema_editor,
+                TextEmbedding,
+                dimensions=EmbeddingVersion.objects.active().dimensions,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ Vector index rebuilt in {time.time() - start:.1f}s "
+                f"({TextEmbedding.objects.count()} rows)"
+            )
+        )
@@ -0,0 +1,349 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from AI.admission import PRIORITY_BATCH
+from AI.models import EmbeddingVersion, TextEmbedding
+from AI.services import generate_embeddings
+from AI.vector_index import VECTOR_INDEX_NAME, build_vector_index
+
+# Columns filled for the new model while search keeps reading the live ones
+SHADOW_COLUMNS = {
+    "embedding": "embedding_shadow",
+    "embedding_model": "embedding_model_shadow",
+    "embedding_version": "embedding_version_shadow",
+}
+SHADOW_INDEX_NAME = f"{VECTOR_INDEX_NAME}_shadow"
+# Partial index over the rows still to re-embed; it shrinks as the run progresses
+TODO_INDEX_NAME = "ai_textemb_reembed_todo"
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embeds every chunk with a new embedding model into shadow columns in "
+        "throttled batches while search keeps serving the current vectors, then "
+        "switches to the new model atomically. Interrupted runs resume. A model "
+        "with a different embedding size also needs a migration changing the "
+        "dimensions of TextEmbedding.embedding, so its cutover is refused unless "
+        "--allow-dimension-change is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", help="Ollama embedding model to switch to")
+        parser.add_argument(
+            "--model-version",
+            default="",
+            help="Version label stored with each row (e.g. the model digest)",
+        )
+        parser.add_argument(
+            "--dimensions",
+            type=int,
+            help="Embedding size of the new model (default: probed from Ollama)",
+        )
+        parser.add_argument("--batch-size", type=int, default=64)
+        parser.add_argument(
+            "--max-rate",
+            type=float,
+            default=0,
+            help="Maximum rows re-embedded per second (default: unthrottled)",
+        )
+        parser.add_argument(
+            "--no-cutover",
+            action="store_true",
+            help="Fill the shadow columns and build their index, but keep serving "
+            "the current model",
+        )
+        parser.add_argument(
+            "--abort",
+            action="store_true",
+            help="Drop the shadow columns of an unfinished run",
+        )
+        parser.add_argument(
+            "--allow-dimension-change",
+            action="store_true",
+            help="Cut over even though TextEmbedding.embedding declares another "
+            "size; deploy the migration changing it together with the switch",
+        )
+
+    def handle(self, *args, **options):
+        self.table = connection.ops.quote_name(TextEmbedding._meta.db_table)
+        self.embedding_field = TextEmbedding._meta.get_field("embedding")
+        if options["abort"]:
+            self.abort()
+            return
+        if not options["model"]:
+            raise CommandError("--model is required.")
+
+        active = EmbeddingVersion.objects.active()
+        target = self.start(active, options)
+        declared = self.embedding_field.dimensions
+        if (
+            declared != target.dimensions
+            and not options["no_cutover"]
+            and not options["allow_dimension_change"]
+        ):
+            # Renaming the shadow column in would leave the table out of step
+            # with the model field and the migrations
+            raise CommandError(
+                f"{target.cache_name} has {target.dimensions} dimensions but "
+                f"TextEmbedding.embedding declares {declared}. A migration "
+                f"changing it to {target.dimensions} is required; prepare with "
+                "--no-cutover, then cut over with --allow-dimension-change "
+                "when deploying that migration."
+            )
+        self.fill(target, options["batch_size"], options["max_rate"])
+        self.build_index(target)
+        if options["no_cutover"]:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"✓ Shadow embeddings for {target.cache_name} are ready; run "
+                    "again without --no-cutover to switch"
+                )
+            )
+            return
+
+        start = time.time()
+        self.cutover(active, target)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✓ Switched from {active.cache_name} to {target.cache_name} "
+                f"(cutover took {time.time() - start:.2f}s)"
+            )
+        )
+        if declared != target.dimensions:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"TextEmbedding.embedding is declared with {declared} "
+                    f"dimensions; update it to {target.dimensions} in AI/models.py"
+                )
+            )
+
+    def execute_sql(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def start(self, active, options) -> EmbeddingVersion:
+        """
+        Returns the version being built, creating it and its shadow columns
+        unless an earlier run for the same model is being resumed.
+        """
+        name, version = options["model"], options["model_version"]
+        building = EmbeddingVersion.objects.filter(
+            status=EmbeddingVersion.STATUS_BUILDING
+        ).first()
+        if building is not None:
+            if (building.name, building.version) != (name, version):
+                raise CommandError(
+                    f"Re-embedding into {building.cache_name} is unfinished; "
+                    "finish it or run with --abort first."
+                )
+            self.stdout.write(f"Resuming re-embedding into {building.cache_name}")
+            return building
+        if (active.name, active.version) == (name, version):
+            raise CommandError(f"{active.cache_name} is already the active model.")
+
+        target = EmbeddingVersion(
+            name=name, version=version, dimensions=options["dimensions"]
+        )
+        if not target.dimensions:
+            probe = generate_embeddings(["probe"], use_cache=False, version=target)
+            target.dimensions = len(probe[0])
+        # Nullable columns without defaults are added without rewriting the table
+        self.execute_sql(
+            f"ALTER TABLE {self.table} "
+            f"ADD COLUMN IF NOT EXISTS embedding_shadow vector({target.dimensions}), "
+            "ADD COLUMN IF NOT EXISTS embedding_model_shadow varchar(100), "
+            "ADD COLUMN IF NOT EXISTS embedding_version_shadow varchar(64)"
+        )
+        self.execute_sql(
+            f"CREATE INDEX {self.concurrently()} IF NOT EXISTS {TODO_INDEX_NAME} "
+            f"ON {self.table} (id) WHERE embedding_shadow IS NULL"
+        )
+        target.save()
+        self.stdout.write(
+            f"Re-embedding {active.cache_name} -> {target.cache_name} "
+            f"({target.dimensions} dimensions)"
+        )
+        return target
+
+    def concurrently(self) -> str:
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        return "" if connection.in_atomic_block else "CONCURRENTLY"
+
+    def embed_batch(self, target, batch_size) -> int:
+        """
+        Re-embeds the next batch of rows without a shadow embedding.
+        Returns the number of rows in the batch.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id, text FROM {self.table} "
+                "WHERE embedding_shadow IS NULL ORDER BY id LIMIT %s",
+                [batch_size],
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            return 0
+        embeddings = generate_embeddings(
+            [text for _, text in rows],
+            batch_size=batch_size,
+            version=target,
+            priority=PRIORITY_BATCH,
+        )
+        for embedding in embeddings:
+            if len(embedding) != target.dimensions:
+                raise CommandError(
+                    f"{target.name} returned {len(embedding)} dimensions, "
+                    f"expected {target.dimensions}."
+                )
+        # Rows deleted meanwhile simply don't match
+        self.execute_sql(
+            f"UPDATE {self.table} AS t SET "
+            "embedding_shadow = data.embedding::vector, "
+            "embedding_model_shadow = %s, embedding_version_shadow = %s "
+            "FROM unnest(%s::bigint[], %s::text[]) AS data(id, embedding) "
+            "WHERE t.id = data.id",
+            [
+                target.name,
+                target.version,
+                [row_id for row_id, _ in rows],
+                [self.embedding_field.get_prep_value(e) for e in embeddings],
+            ],
+        )
+        return len(rows)
+
+    def fill(self, target, batch_size, max_rate):
+        """
+        Re-embeds every row in batches, sleeping as needed to stay under
+        max_rate rows per second, and reports progress with an ETA.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM {self.table} WHERE embedding_shadow IS NULL"
+            )
+            (total,) = cursor.fetchone()
+        self.stdout.write(f"{total} rows to re-embed")
+
+        done = 0
+        start = last_report = time.time()
+        while True:
+            written = self.embed_batch(target, batch_size)
+            if not written:
+                break
+            done += written
+            elapsed = time.time() - start
+            if max_rate and done / max_rate > elapsed:
+                time.sleep(done / max_rate - elapsed)
+                elapsed = time.time() - start
+
+            if time.time() - last_report >= 5 or done >= total:
+                last_report = time.time()
+                rate = done / elapsed if elapsed else 0
+                # New uploads during the run can push done past the initial total
+                remaining = max(total - done, 0)
+                eta = remaining / rate if rate else 0
+                self.stdout.write(
+                    f"  {done}/{total} rows ({min(done / total, 1):.1%}) "
+                    f"{rate:.1f} rows/s, ETA {eta:.0f}s"
+                    if total
+                    else f"  {done} rows"
+                )
+
+        elapsed = time.time() - start
+        self.stdout.write(
+            self.style.SUCCESS(f"✓ Re-embedded {done} rows in {elapsed:.1f}s")
+        )
+
+    def build_index(self, target):
+        """
+        Builds the ANN index on the shadow column ahead of the cutover so the
+        switch does not have to wait for it.
+        """
+        self.stdout.write("Building the vector index on the shadow column...")
+        start = time.time()
+        # An interrupted concurrent build leaves an invalid index behind
+        self.execute_sql(f"DROP INDEX IF EXISTS {SHADOW_INDEX_NAME}")
+        index = build_vector_index(
+            target.dimensions, column="embedding_shadow", name=SHADOW_INDEX_NAME
+        )
+        concurrently = not connection.in_atomic_block
+        with connection.schema_editor(atomic=False) as schema_editor:
+            schema_editor.add_index(TextEmbedding, index, concurrently=concurrently)
+        self.stdout.write(
+            self.style.SUCCESS(f"✓ Index built in {time.time() - start:.1f}s")
+        )
+
+    def cutover(self, active, target):
+        """
+        Swaps the shadow columns in within one transaction. Writes are blocked
+        while the last rows uploaded during the run are embedded; reads only
+        wait for the final metadata-only renames.
+        """
+        with transaction.atomic():
+            self.execute_sql(f"LOCK TABLE {self.table} IN SHARE ROW EXCLUSIVE MODE")
+            while self.embed_batch(target, 500):
+                pass
+
+            self.execute_sql(f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME}")
+            self.execute_sql(f"DROP INDEX IF EXISTS {TODO_INDEX_NAME}")
+            for column, shadow in SHADOW_COLUMNS.items():
+                self.execute_sql(
+                    f"ALTER TABLE {self.table} RENAME COLUMN {column} TO {column}_old"
+                )
+                self.execute_sql(
+                    f"ALTER TABLE {self.table} RENAME COLUMN {shadow} TO {column}"
+                )
+            self.execute_sql(
+                f"ALTER INDEX {SHADOW_INDEX_NAME} RENAME TO {VECTOR_INDEX_NAME}"
+            )
+            # Dropping columns only marks them deleted in the catalog
+            self.execute_sql(
+                f"ALTER TABLE {self.table} "
+                + ", ".join(f"DROP COLUMN {column}_old" for column in SHADOW_COLUMNS)
+            )
+
+            # Saving also records a settings-defined model that was never stored
+            active.status = EmbeddingVersion.STATUS_RETIRED
+            active.save()
+            target.status = EmbeddingVersion.STATUS_ACTIVE
+            target.activated_at = timezone.now()
+            target.save(update_fields=["status", "activated_at"])
+
+        # Restore NOT NULL without holding an exclusive lock during the scan:
+        # a NOT VALID check is validated under a weaker lock, then lets
+        # SET NOT NULL skip its own scan.
+        for column in SHADOW_COLUMNS:
+            constraint = f"ai_textemb_{column}_not_null"
+            self.execute_sql(
+                f"ALTER TABLE {self.table} ADD CONSTRAINT {constraint} "
+                f"CHECK ({column} IS NOT NULL) NOT VALID"
+            )
+            self.execute_sql(
+                f"ALTER TABLE {self.table} VALIDATE CONSTRAINT {constraint}"
+            )
+            self.execute_sql(
+                f"ALTER TABLE {self.table} ALTER COLUMN {column} SET NOT NULL"
+            )
+            self.execute_sql(f"ALTER TABLE {self.table} DROP CONSTRAINT {constraint}")
+        self.execute_sql(f"ANALYZE {self.table}")
+
+    def abort(self):
+        building = EmbeddingVersion.objects.filter(
+            status=EmbeddingVersion.STATUS_BUILDING
+        ).first()
+        if building is None:
+            raise CommandError("No re-embedding is in progress.")
+        self.execute_sql(f"DROP INDEX IF EXISTS {SHADOW_INDEX_NAME}")
+        self.execute_sql(f"DROP INDEX IF EXISTS {TODO_INDEX_NAME}")
+        self.execute_sql(
+            f"ALTER TABLE {self.table} "
+            + ", ".join(
+                f"DROP COLUMN IF EXISTS {shadow}" for shadow in SHADOW_COLUMNS.values()
+            )
+        )
+        building.delete()
+        self.stdout.write(
+            self.style.SUCCESS(f"✓ Aborted re-embedding into {building.cache_name}")
+        )
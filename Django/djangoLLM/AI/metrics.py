@@ -0,0 +1,245 @@
+import hmac
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.urls import Resolver404, resolve
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from .admission import ollama_admission
+from .balancer import ollama_hosts
+from .breaker import circuit_breakers
+
+# Prometheus metrics, served at /metrics. With PROMETHEUS_MULTIPROC_DIR set
+# (before the workers start, see entrypoint.sh and gunicorn.conf.py) every
+# gunicorn worker writes its samples to files there and a scrape served by any
+# worker adds them all up; without it only the serving process is reported.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+_SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_BYTES_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# Requests, labelled by URL name. Latency of streamed responses is the time
+# until the response starts.
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Request latency",
+    ["view", "method", "status"],
+    buckets=_SECONDS_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests being served",
+    ["view"],
+    multiprocess_mode="livesum",
+)
+REQUEST_BYTES = Histogram(
+    "http_request_size_bytes", "Request body size", ["view"], buckets=_BYTES_BUCKETS
+)
+RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes",
+    "Response body size, streamed responses excluded",
+    ["view"],
+    buckets=_BYTES_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries per request",
+    ["view"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+# LLM backends
+OLLAMA_SECONDS = Histogram(
+    "ollama_request_duration_seconds",
+    "Ollama's total_duration of a request",
+    ["model", "task"],
+    buckets=_SECONDS_BUCKETS,
+)
+OLLAMA_TOKENS = Counter(
+    "ollama_tokens",
+    "Tokens processed, phase prompt or output",
+    ["model", "task", "phase"],
+)
+OLLAMA_PHASE_SECONDS = Counter(
+    "ollama_phase_seconds",
+    "Time spent per phase: load, prefill or decode",
+    ["model", "task", "phase"],
+)
+OLLAMA_COLD_LOADS = Counter(
+    "ollama_cold_loads", "Requests that loaded the model", ["model", "task"]
+)
+HUGGINGFACE_SECONDS = Histogram(
+    "huggingface_request_duration_seconds",
+    "Hugging Face Inference API latency",
+    ["model", "outcome"],
+    buckets=_SECONDS_BUCKETS,
+)
+ADMISSION_ACTIVE = Gauge(
+    "ollama_admission_active", "Ollama slots in use", multiprocess_mode="livesum"
+)
+ADMISSION_QUEUED = Gauge(
+    "ollama_admission_queued",
+    "Requests waiting for a slot",
+    multiprocess_mode="livesum",
+)
+HOST_OUTSTANDING = Gauge(
+    "ollama_host_outstanding",
+    "Requests routed to an Ollama host",
+    ["host"],
+    multiprocess_mode="livesum",
+)
+HOST_HEALTHY = Gauge(
+    "ollama_host_healthy",
+    "1 if every worker considers the host healthy",
+    ["host"],
+    multiprocess_mode="livemin",
+)
+BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "0 closed, 1 half open, 2 open (worst worker)",
+    ["backend"],
+    multiprocess_mode="livemax",
+)
+_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+# Caches; result is memory_hits, db_hits or misses as in their stats()
+CACHE_LOOKUPS = Counter("cache_lookups", "Cache lookups", ["cache", "result"])
+
+# Queries of the current request, shared with its sync_to_async threads
+_request_queries = ContextVar("request_queries", default=None)
+
+
+def observe_huggingface(model: str, seconds: float, ok: bool):
+    HUGGINGFACE_SECONDS.labels(model, "ok" if ok else "error").observe(seconds)
+
+
+def sample_backends():
+    """
+    Copies this process's admission, host and circuit breaker state into the
+    gauges. Done after every request and before every scrape.
+    """
+    admission = ollama_admission.stats()
+    ADMISSION_ACTIVE.set(admission["active"])
+    ADMISSION_QUEUED.set(admission["queued"])
+    for host in ollama_hosts.stats():
+        HOST_OUTSTANDING.labels(host["url"]).set(host["outstanding"])
+        HOST_HEALTHY.labels(host["url"]).set(int(host["healthy"]))
+    for name, breaker in list(circuit_breakers.items()):
+        BREAKER_STATE.labels(name).set(_BREAKER_STATES[breaker.state])
+
+
+def _count_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(sender=None, connection=connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter)
+
+
+def _view_name(request) -> str:
+    """
+    URL name of the request's view (its dotted path if unnamed), a label of
+    bounded cardinality unlike the path.
+    """
+    try:
+        return resolve(request.path_info).view_name
+    except Resolver404:
+        return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Records latency, in-flight requests, payload sizes and database queries of
+    every request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        _install_query_counter()  # Opened before this module was imported
+        view, queries, start = self._start(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            self._finish(request, response, view, queries, start)
+        return response
+
+    async def _acall(self, request):
+        view, queries, start = self._start(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            self._finish(request, response, view, queries, start)
+        return response
+
+    def _start(self, request) -> tuple:
+        view = _view_name(request)
+        queries = [0]
+        _request_queries.set(queries)
+        REQUESTS_IN_FLIGHT.labels(view).inc()
+        return view, queries, time.perf_counter()
+
+    def _finish(self, request, response, view: str, queries: list, start: float):
+        elapsed = time.perf_counter() - start
+        REQUESTS_IN_FLIGHT.labels(view).dec()
+        _request_queries.set(None)
+        status = f"{response.status_code // 100}xx" if response is not None else "5xx"
+        REQUEST_SECONDS.labels(view, request.method, status).observe(elapsed)
+        REQUEST_BYTES.labels(view).observe(
+            int(request.headers.get("Content-Length") or 0)
+        )
+        if response is not None and not response.streaming:
+            RESPONSE_BYTES.labels(view).observe(len(response.content))
+        REQUEST_QUERIES.labels(view).observe(queries[0])
+        sample_backends()
+
+
+def metrics_view(request):
+    """
+    Prometheus text exposition of all workers' metrics.
+    """
+    if METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        return HttpResponseForbidden()
+    sample_backends()
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
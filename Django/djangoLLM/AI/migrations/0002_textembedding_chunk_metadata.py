@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="textembedding",
+            name="char_end",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="textembedding",
+            name="char_start",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="textembedding",
+            name="chunk_index",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="textembedding",
+            name="page_number",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from AI.vector_index import create_vector_index, drop_vector_index
+
+
+def create_index(apps, schema_editor):
+    create_vector_index(schema_editor, apps.get_model("AI", "TextEmbedding"))
+
+
+def drop_index(apps, schema_editor):
+    drop_vector_index(schema_editor, apps.get_model("AI", "TextEmbedding"))
+
+
+class Migration(migrations.Migration):
+    # The index type (HNSW or IVFFlat) is read from settings.VECTOR_INDEX, so it
+    # is created outside the model state. Use `manage.py rebuild_vector_index`
+    # after changing it.
+
+    dependencies = [
+        ("AI", "0002_textembedding_chunk_metadata"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:41
+
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0003_textembedding_ann_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingCacheEntry",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("model", models.CharField(max_length=100)),
+                ("embedding", pgvector.django.vector.VectorField(dimensions=768)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_owner(apps, schema_editor):
+    Document = apps.get_model("AI", "Document")
+    TextEmbedding = apps.get_model("AI", "TextEmbedding")
+    TextEmbedding.objects.filter(owner__isnull=True).update(
+        owner_id=Subquery(
+            Document.objects.filter(pk=OuterRef("document_id")).values("user_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0004_embeddingcacheentry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="textembedding",
+            name="owner",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="text_embeddings",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="textembedding",
+            index=models.Index(
+                fields=["owner", "document"], name="ai_textemb_owner_doc_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_owner, migrations.RunPython.noop),
+    ]
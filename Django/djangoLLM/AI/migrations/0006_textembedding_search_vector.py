@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:44
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0005_textembedding_owner"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="textembedding",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.SearchVector(
+                    "text", config="english"
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="textembedding",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="ai_textemb_search_gin"
+            ),
+        ),
+    ]
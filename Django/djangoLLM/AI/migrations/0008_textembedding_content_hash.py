@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:54
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    TextEmbedding = apps.get_model("AI", "TextEmbedding")
+    # Same digest as services.chunk_hash(): sha256 hex of the UTF-8 text
+    schema_editor.execute(
+        f"UPDATE {schema_editor.quote_name(TextEmbedding._meta.db_table)} "
+        "SET content_hash = encode(sha256(convert_to(text, 'UTF8')), 'hex') "
+        "WHERE content_hash = ''"
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0007_ingestionjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="textembedding",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
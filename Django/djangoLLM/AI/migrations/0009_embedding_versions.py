@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:57
+
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+def backfill_embedding_model(apps, schema_editor):
+    TextEmbedding = apps.get_model("AI", "TextEmbedding")
+    # Every existing row was embedded with the previously hardcoded model
+    TextEmbedding.objects.filter(embedding_model="").update(
+        embedding_model="nomic-embed-text"
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0008_textembedding_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="textembedding",
+            name="embedding_model",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+        migrations.AddField(
+            model_name="textembedding",
+            name="embedding_version",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.RunPython(backfill_embedding_model, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="embeddingcacheentry",
+            name="embedding",
+            field=pgvector.django.vector.VectorField(),
+        ),
+        migrations.CreateModel(
+            name="EmbeddingVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                ("version", models.CharField(blank=True, max_length=64)),
+                ("dimensions", models.PositiveIntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("building", "Building"),
+                            ("active", "Active"),
+                            ("retired", "Retired"),
+                        ],
+                        default="building",
+                        max_length=20,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("activated_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("status__in", ["building", "active"])),
+                        fields=("status",),
+                        name="ai_embedding_version_one_per_status",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-16 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0009_embedding_versions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResponseCacheEntry",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("model", models.CharField(max_length=100)),
+                ("task", models.CharField(max_length=50)),
+                ("response", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
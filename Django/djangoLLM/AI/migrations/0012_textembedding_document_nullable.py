@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0011_chat_sessions"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="textembedding",
+            name="document",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="embeddings",
+                to="AI.document",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("AI", "0012_textembedding_document_nullable"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="revision",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ingestionjob",
+            name="revision",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="ingestionjob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                    ("superseded", "Superseded"),
+                ],
+                default="queued",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,7 +1,13 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from pgvector.django import VectorField
 
+# Text search configuration used for lexical retrieval
+SEARCH_CONFIG = "english"
+
 
 class Note(models.Model):
     title = models.CharField(max_length=100)
@@ -27,23 +33,267 @@ class Document(models.Model):
         ],
         default="processing",
     )
+    # Bumped by every upload queued for indexing; see jobs.enqueue_ingestion
+    revision = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.filename} ({self.get_status_display()})"
 
 
+class IngestionJob(models.Model):
+    """
+    A queued document upload waiting to be parsed, chunked and embedded by
+    `manage.py ingestion_worker`.
+
+    A claimed job stays invisible until available_at (its visibility timeout);
+    if the worker dies it becomes claimable again. Failed attempts are retried
+    with backoff until max_attempts. A newer upload of the same document
+    supersedes the job, which is then never claimed or committed again.
+    """
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_SUPERSEDED = "superseded"
+
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, related_name="ingestion_jobs"
+    )
+    revision = models.PositiveIntegerField(default=0)  # Document.revision queued
+    payload = models.BinaryField()  # Raw uploaded file, cleared once done
+    content_type = models.CharField(max_length=100)
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            (STATUS_QUEUED, "Queued"),
+            (STATUS_RUNNING, "Running"),
+            (STATUS_DONE, "Done"),
+            (STATUS_FAILED, "Failed"),
+            (STATUS_SUPERSEDED, "Superseded"),
+        ],
+        default=STATUS_QUEUED,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    available_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "available_at"], name="ai_ingestjob_claim_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Ingestion of {self.document.filename} ({self.status})"
+
+
+class EmbeddingVersionManager(models.Manager):
+    def active(self) -> "EmbeddingVersion":
+        """
+        Returns the active embedding model, or an unsaved one built from
+        settings.EMBEDDING_MODEL if none was ever activated.
+        """
+        version = self.filter(status=EmbeddingVersion.STATUS_ACTIVE).first()
+        if version is None:
+            config = settings.EMBEDDING_MODEL
+            version = self.model(
+                name=config["NAME"],
+                version=config["VERSION"],
+                dimensions=config["DIMENSIONS"],
+                status=EmbeddingVersion.STATUS_ACTIVE,
+            )
+        return version
+
+
+class EmbeddingVersion(models.Model):
+    """
+    An embedding model the corpus has been (or is being) embedded with.
+
+    Exactly one version is active and used for queries and new rows. While
+    `manage.py reembed` fills the shadow columns for a new model, that version
+    is building; the cutover activates it and retires the previous one.
+    """
+
+    STATUS_BUILDING = "building"
+    STATUS_ACTIVE = "active"
+    STATUS_RETIRED = "retired"
+
+    name = models.CharField(max_length=100)  # Ollama model name
+    version = models.CharField(max_length=64, blank=True)
+    dimensions = models.PositiveIntegerField()
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            (STATUS_BUILDING, "Building"),
+            (STATUS_ACTIVE, "Active"),
+            (STATUS_RETIRED, "Retired"),
+        ],
+        default=STATUS_BUILDING,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    objects = EmbeddingVersionManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["status"],
+                condition=models.Q(status__in=["building", "active"]),
+                name="ai_embedding_version_one_per_status",
+            ),
+        ]
+
+    @property
+    def cache_name(self) -> str:
+        """
+        Model identifier used in embedding cache keys.
+        """
+        return f"{self.name}@{self.version}" if self.version else self.name
+
+    def matches(self, other: "EmbeddingVersion") -> bool:
+        return (self.name, self.version) == (other.name, other.version)
+
+    def __str__(self):
+        return f"{self.cache_name} ({self.status})"
+
+
 class TextEmbedding(models.Model):
+    # None for texts embedded on their own (the create-embedding endpoint)
     document = models.ForeignKey(
-        Document, on_delete=models.CASCADE, related_name="embeddings"
+        Document,
+        on_delete=models.CASCADE,
+        related_name="embeddings",
+        null=True,
+        blank=True,
+    )
+    # Denormalized document.user so per-user searches don't join Document.
+    # Indexed through the composite index in Meta.
+    owner = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="text_embeddings",
+        null=True,
+        blank=True,
+        db_index=False,
     )
     text = models.TextField()
+    # sha256 of text; re-indexing only embeds chunks whose hash is new
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # Lexical retrieval: tsvector kept in sync with text by Postgres
+    search_vector = models.GeneratedField(
+        expression=SearchVector("text", config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
     embedding = VectorField(
         dimensions=768
     )  # nomic-embed-text typically produces 768-dimensional embeddings
+    # Model that produced the embedding; see EmbeddingVersion
+    embedding_model = models.CharField(max_length=100, blank=True, default="")
+    embedding_version = models.CharField(max_length=64, blank=True, default="")
+    # Position of the chunk inside its source document
+    chunk_index = models.PositiveIntegerField(default=0)
+    page_number = models.PositiveIntegerField(null=True, blank=True)  # 1-based
+    char_start = models.PositiveIntegerField(null=True, blank=True)
+    char_end = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["owner", "document"], name="ai_textemb_owner_doc_idx"),
+            GinIndex(fields=["search_vector"], name="ai_textemb_search_gin"),
+        ]
+
+    def __str__(self):
+        source = self.document.filename if self.document else "text"
+        return f"Embedding for {source}: {self.text[:30]}..."
+
+
+class EmbeddingCacheEntry(models.Model):
+    """
+    Persistent tier of the embedding cache, keyed by sha256(model + normalized text).
+    """
+
+    key = models.CharField(max_length=64, primary_key=True)
+    model = models.CharField(max_length=100)
+    embedding = VectorField()  # Any dimensions, so several models can be cached
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.model}:{self.key[:12]}"
+
+
+class ResponseCacheEntry(models.Model):
+    """
+    Persistent tier of the LLM response cache, keyed by
+    sha256(model + task + options + normalized prompt).
+    """
+
+    key = models.CharField(max_length=64, primary_key=True)
+    model = models.CharField(max_length=100)
+    task = models.CharField(max_length=50)
+    response = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.task}:{self.model}:{self.key[:12]}"
+
+
+class ChatSession(models.Model):
+    """
+    A conversation with the model. Messages beyond the history budget are
+    folded into summary by background compaction (see chat.py), so each turn
+    sends the system prompt, the summary and the recent messages only.
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="chat_sessions"
+    )
+    title = models.CharField(max_length=200, blank=True)
+    system_prompt = models.TextField(blank=True)
+    summary = models.TextField(blank=True)  # Of the compacted messages
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.title or self.pk}"
+
+
+class ChatMessage(models.Model):
+    ROLE_USER = "user"
+    ROLE_ASSISTANT = "assistant"
+
+    session = models.ForeignKey(
+        ChatSession, on_delete=models.CASCADE, related_name="messages"
+    )
+    role = models.CharField(
+        max_length=20,
+        choices=[(ROLE_USER, "User"), (ROLE_ASSISTANT, "Assistant")],
+    )
+    content = models.TextField()
+    tokens = models.PositiveIntegerField(default=0)  # Estimated
+    # Folded into session.summary and no longer sent to the model
+    compacted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["session", "compacted"], name="ai_chatmsg_history_idx"
+            ),
+        ]
 
     def __str__(self):
-        return f"Embedding for {self.document.filename}: {self.text[:30]}..."
+        return f"{self.role}: {self.content[:30]}..."
 
 
 class StudyTime(models.Model):
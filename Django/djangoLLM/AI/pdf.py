@@ -0,0 +1,70 @@
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+# Page extraction runs in this many processes for large PDFs (1 disables the pool)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "1"))
+# PDFs with fewer pages are always parsed in-process; the pool costs ~100ms to start
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "100"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+
+# Each pool process parses the PDF once and keeps the reader for all its tasks
+_worker_reader = None
+
+
+def _init_worker(data: bytes):
+    global _worker_reader
+    _worker_reader = PyPDF2.PdfReader(io.BytesIO(data))
+
+
+def _extract_page_range(start: int, end: int) -> list[str]:
+    return [_worker_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_pdf_pages(pdf_file, workers: int = None, pages_per_task: int = None):
+    """
+    Yields the text of each page of a PDF file, in page order, as soon as it is
+    extracted so callers can chunk and embed while later pages are still parsed.
+
+    With workers > 1 and at least PDF_PARALLEL_MIN_PAGES pages, page ranges are
+    extracted in a pool of worker processes, which sidesteps the GIL. Pages are
+    still yielded in order as each range completes.
+
+    Args:
+        pdf_file: Path, file-like object or bytes of the PDF
+        workers: Number of processes (default PDF_EXTRACT_WORKERS)
+        pages_per_task: Pages handed to a process at a time (default PDF_PAGES_PER_TASK)
+    """
+    if isinstance(pdf_file, (bytes, bytearray)):
+        pdf_file = io.BytesIO(pdf_file)
+    workers = workers or PDF_EXTRACT_WORKERS
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+
+    reader = PyPDF2.PdfReader(pdf_file)
+    page_count = len(reader.pages)
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as f:
+            data = f.read()
+    else:
+        pdf_file.seek(0)
+        data = pdf_file.read()
+
+    starts = range(0, page_count, pages_per_task)
+    ends = [min(start + pages_per_task, page_count) for start in starts]
+    # spawn rather than fork: callers such as the ingestion worker are threaded
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(starts)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(data,),
+    ) as executor:
+        for texts in executor.map(_extract_page_range, starts, ends):
+            yield from texts
@@ -1,6 +1,6 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Note, TextEmbedding, StudyTime, Document
+from .models import ChatMessage, ChatSession, Note, TextEmbedding, StudyTime, Document
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -25,8 +25,24 @@ class NoteSerializer(serializers.ModelSerializer):
 class TextEmbeddingSerializer(serializers.ModelSerializer):
     class Meta:
         model = TextEmbedding
-        fields = ["id", "text", "embedding", "created_at"]
-        read_only_fields = ["embedding", "created_at"]
+        fields = [
+            "id",
+            "text",
+            "embedding",
+            "chunk_index",
+            "page_number",
+            "char_start",
+            "char_end",
+            "created_at",
+        ]
+        read_only_fields = [
+            "embedding",
+            "chunk_index",
+            "page_number",
+            "char_start",
+            "char_end",
+            "created_at",
+        ]
 
 
 class StudyTimeSerializer(serializers.ModelSerializer):
@@ -41,3 +57,23 @@ class DocumentSerializer(serializers.ModelSerializer):
         model = Document
         fields = ["id", "user", "filename", "file_type", "upload_date", "status"]
         extra_kwargs = {"user": {"read_only": True}}
+
+
+class ChatMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatMessage
+        fields = ["id", "role", "content", "compacted", "created_at"]
+
+
+class ChatSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatSession
+        fields = ["id", "title", "system_prompt", "summary", "created_at", "updated_at"]
+        read_only_fields = ["summary", "created_at", "updated_at"]
+
+
+class ChatSessionDetailSerializer(ChatSessionSerializer):
+    messages = ChatMessageSerializer(many=True, read_only=True)
+
+    class Meta(ChatSessionSerializer.Meta):
+        fields = ChatSessionSerializer.Meta.fields + ["messages"]
@@ -1,10 +1,54 @@
+import hashlib
+import io
+import logging
 import ollama
 import os
-from .models import TextEmbedding  # Import TextEmbedding model
+import re
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from .models import (  # Import TextEmbedding model
+    SEARCH_CONFIG,
+    EmbeddingVersion,
+    TextEmbedding,
+)
+from .vector_index import (
+    apply_search_params,
+    coarse_distance_sql,
+    get_vector_index_settings,
+)
+from .cache import (
+    embedding_cache,
+    embedding_cache_key,
+    response_cache,
+    response_cache_key,
+)
+from .pdf import iter_pdf_pages
+from .admission import (
+    PRIORITY_BATCH,
+    PRIORITY_DEFAULT,
+    PRIORITY_INTERACTIVE,
+    Overloaded,
+    ollama_admission,
+    task_priority,
+)
+from .balancer import ollama_hosts
+from .breaker import CircuitBreaker, call_with_fallback
+from .singleflight import SingleFlight
+from .metrics import observe_huggingface
+from .token_metrics import token_metrics
+from .timing import in_request_context, span
+from .structured import StructuredKind, StructuredResult, generate_items
 from pgvector.django import (
     CosineDistance,
 )  # Import CosineDistance for vector similarity
 
+logger = logging.getLogger(__name__)
 
 OLLAMA_HOST = os.getenv(
     "OLLAMA_HOST", "http://127.0.0.1:11434"
@@ -13,50 +57,149 @@ OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:latest")
 OLLAMA_VISION_MODEL = os.getenv("OLLAMA_VISION_MODEL", "llama3.2-vision:latest")
 HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
 HF_VISION_MODEL = "Qwen/Qwen2-VL-2B-Instruct"
+# Seconds before a Hugging Face Inference API call is abandoned
+HF_TIMEOUT = float(os.getenv("HF_TIMEOUT", "30"))
+# Also start the other vision backend when the preferred one is slower than usual
+VISION_HEDGING = os.getenv("VISION_HEDGING", "false").lower() in ("1", "true", "yes")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
 
-# Shared Ollama client instance for connection reuse
-_ollama_client = None
+# Retrieval: "hybrid" fuses full-text and vector rankings, "vector" is cosine only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RRF_K = 60  # Reciprocal rank fusion constant
 
+# Shared Ollama client instances (one per host) for connection reuse
+_ollama_clients = {}
 
-def get_ollama_client():
+# Identical concurrent generations and embeddings share one Ollama request
+flights = SingleFlight()
+
+
+def get_ollama_client(host: str = None):
     """
-    Returns a shared Ollama client instance.
+    Returns the shared Ollama client instance of host (default: OLLAMA_HOST).
+    Requests should pick their host through balancer.ollama_hosts.
     """
-    global _ollama_client
-    if _ollama_client is None:
+    host = host or OLLAMA_HOST
+    if host not in _ollama_clients:
         try:
-            _ollama_client = ollama.Client(host=OLLAMA_HOST)
+            _ollama_clients[host] = ollama.Client(host=host)
             # Test connection lightly
             # _ollama_client.list() # Optional: heavy call, maybe skip for now or use a lighter check if possible
         except Exception as e:
-            print(f"Failed to initialize Ollama client at {OLLAMA_HOST}: {e}")
+            logger.warning("Failed to initialize Ollama client at %s: %s", host, e)
             raise e
-    return _ollama_client
+    return _ollama_clients[host]
 
 
-def generate_embedding(text: str) -> list[float]:
+def get_embedding_version() -> EmbeddingVersion:
+    """
+    Returns the active embedding model (settings.EMBEDDING_MODEL until
+    `manage.py reembed` activates another one). Read on every call so all
+    workers switch together at cutover.
+    """
+    return EmbeddingVersion.objects.active()
+
+
+def generate_embedding(text: str, priority: int = PRIORITY_INTERACTIVE) -> list[float]:
     """
     Generates a vector embedding for the given text using Ollama.
-    Assumes 'nomic-embed-text' model is available in Ollama.
+    Uses the active embedding model, which must be available in Ollama.
     """
-    client = get_ollama_client()
-    response = client.embeddings(
-        model="nomic-embed-text",
-        prompt=text,
-        keep_alive="30m",  # Keep model loaded for 30 minutes
-    )
-    return response["embedding"]
+    return generate_embeddings([text], priority=priority)[0]
+
+
+def generate_embeddings(
+    texts: list[str],
+    batch_size: int = None,
+    use_cache: bool = True,
+    version: EmbeddingVersion = None,
+    priority: int = PRIORITY_DEFAULT,
+) -> list[list[float]]:
+    """
+    Generates vector embeddings for many texts using Ollama's batch embed endpoint.
+    Texts are sent batch_size at a time; embeddings are returned in input order.
+
+    Texts already in the embedding cache (memory or database tier) are not sent
+    to Ollama, and new embeddings are added to the cache. Concurrent calls
+    missing the same texts share one set of Ollama requests.
+
+    version selects the embedding model (default: the active one); priority
+    is the admission class of the Ollama requests (see admission.py).
+    """
+    version = version or get_embedding_version()
+    if not use_cache:
+        return _embed_batches(texts, batch_size, version.name, priority)
+
+    keys = [embedding_cache_key(version.cache_name, text) for text in texts]
+    found = embedding_cache.get_many(keys)
+
+    # Embed each distinct missing text once
+    missing = _missing_items(keys, texts, found)
+    if missing:
+        with span("embed"):
+            embeddings, leader = flights.do(
+                tuple(missing),
+                lambda: _embed_batches(
+                    list(missing.values()), batch_size, version.name, priority
+                ),
+            )
+        embeddings = dict(zip(missing, embeddings))
+        if leader:
+            embedding_cache.set_many(version.cache_name, embeddings)
+        found.update(embeddings)
+
+    return [found[key] for key in keys]
+
+
+def _embed_batches(
+    texts: list[str],
+    batch_size: int = None,
+    model: str = None,
+    priority: int = PRIORITY_DEFAULT,
+) -> list[list[float]]:
+    """
+    Calls Ollama's embed endpoint for texts, batch_size texts per request. Each
+    request waits for its own admission slot.
+    """
+    model = model or get_embedding_version().name
+    embeddings = []
+    for batch in _batches(texts, batch_size):
+        with ollama_admission.slot(priority), ollama_hosts.lease(model) as host:
+            response = get_ollama_client(host.url).embed(
+                model=model,
+                input=batch,
+                keep_alive="30m",  # Keep model loaded for 30 minutes
+            )
+        token_metrics.record(model, "embed", response)
+        embeddings.extend(response["embeddings"])
+    return embeddings
+
+
+def _batches(texts: list[str], batch_size: int = None) -> list[list[str]]:
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    return [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+
+
+def _missing_items(keys: list[str], items: list, found: dict) -> dict:
+    """
+    The distinct items whose key is not in found, by key, in input order.
+    """
+    missing = {}
+    for key, item in zip(keys, items):
+        if key not in found:
+            missing.setdefault(key, item)
+    return missing
 
 
 def get_ollama_host() -> str:
     """
-    Returns the configured Ollama host.
+    Returns the configured Ollama host. With several OLLAMA_HOSTS, route
+    requests through balancer.ollama_hosts instead.
     """
     return OLLAMA_HOST
 
 
-import PyPDF2
-
 # import whisper # Import whisper
 from moviepy import VideoFileClip  # Import moviepy
 from PIL import Image  # Import PIL for image processing
@@ -96,15 +239,329 @@ _whisper_model = None
 #     return _whisper_model
 
 
-def extract_text_from_pdf(pdf_file) -> str:
+def extract_pages_from_pdf(pdf_file, workers: int = None) -> list[str]:
+    """
+    Extracts the text of each page of a PDF file, in page order.
+    """
+    with span("pdf_parse"):
+        return list(iter_pdf_pages(pdf_file, workers=workers))
+
+
+def extract_text_from_pdf(pdf_file, workers: int = None) -> str:
     """
     Extracts text from a PDF file.
     """
-    reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
-    for page_num in range(len(reader.pages)):
-        text += reader.pages[page_num].extract_text()
-    return text
+    with span("pdf_parse"):
+        return "".join(iter_pdf_pages(pdf_file, workers=workers))
+
+
+# Chunking limits for document ingestion, measured in estimated tokens.
+# nomic-embed-text is served with a 2048 token context by default, so chunks stay
+# well below it and retrieval returns focused passages.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_WORD_RE = re.compile(r"\S+")
+
+
+@dataclass
+class TextChunk:
+    """
+    A passage of a document ready to be embedded.
+    Offsets are character positions inside the text of the chunk's page.
+    """
+
+    text: str
+    page_number: int | None
+    char_start: int
+    char_end: int
+    chunk_index: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the token count of a text (words and punctuation marks).
+    """
+    return len(_TOKEN_RE.findall(text))
+
+
+def _sentence_spans(text: str, max_tokens: int):
+    """
+    Yields (start, end, tokens) for each sentence in the text, with surrounding
+    whitespace trimmed. Sentences longer than max_tokens are split on word
+    boundaries.
+    """
+    boundaries = [m.span() for m in _SENTENCE_BOUNDARY_RE.finditer(text)]
+    starts = [0] + [end for _, end in boundaries]
+    ends = [start for start, _ in boundaries] + [len(text)]
+
+    for start, end in zip(starts, ends):
+        sentence = text[start:end]
+        stripped = sentence.strip()
+        if not stripped:
+            continue
+        start += len(sentence) - len(sentence.lstrip())
+        end = start + len(stripped)
+
+        tokens = estimate_tokens(stripped)
+        if tokens <= max_tokens:
+            yield start, end, tokens
+            continue
+
+        # Oversized sentence: fall back to packing whole words
+        piece_start = piece_end = None
+        piece_tokens = 0
+        for word in _WORD_RE.finditer(text, start, end):
+            word_tokens = estimate_tokens(word.group())
+            if piece_start is not None and piece_tokens + word_tokens > max_tokens:
+                yield piece_start, piece_end, piece_tokens
+                piece_start, piece_tokens = None, 0
+            if piece_start is None:
+                piece_start = word.start()
+            piece_end = word.end()
+            piece_tokens += word_tokens
+        if piece_start is not None:
+            yield piece_start, piece_end, piece_tokens
+
+
+def iter_chunks(
+    pages,
+    max_tokens: int = None,
+    overlap_tokens: int = None,
+    first_page_number: int | None = 1,
+):
+    """
+    Splits page texts into overlapping chunks for embedding, yielding each chunk
+    as soon as it is complete. pages may be a generator such as iter_pdf_pages().
+
+    Chunks are built from whole sentences and never span two pages. Consecutive
+    chunks of a page share up to overlap_tokens worth of trailing sentences.
+
+    Args:
+        pages: Iterable of the text of each page, in order
+        max_tokens: Maximum estimated tokens per chunk (default CHUNK_MAX_TOKENS)
+        overlap_tokens: Tokens repeated between chunks (default CHUNK_OVERLAP_TOKENS)
+        first_page_number: Number of the first page, or None for unpaginated text
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("overlap_tokens must be between 0 and max_tokens.")
+
+    chunk_index = 0
+
+    def emit(page_text, page_number, spans):
+        start, end = spans[0][0], spans[-1][1]
+        return TextChunk(
+            text=page_text[start:end],
+            page_number=page_number,
+            char_start=start,
+            char_end=end,
+            chunk_index=chunk_index,
+        )
+
+    for offset, page_text in enumerate(pages):
+        page_number = None if first_page_number is None else first_page_number + offset
+        current = []
+        current_tokens = 0
+        for piece in _sentence_spans(page_text, max_tokens):
+            if current and current_tokens + piece[2] > max_tokens:
+                yield emit(page_text, page_number, current)
+                chunk_index += 1
+                # Carry trailing sentences over into the next chunk
+                kept = []
+                kept_tokens = 0
+                for prev in reversed(current):
+                    if kept_tokens + prev[2] > overlap_tokens:
+                        break
+                    kept.insert(0, prev)
+                    kept_tokens += prev[2]
+                while kept and kept_tokens + piece[2] > max_tokens:
+                    kept_tokens -= kept.pop(0)[2]
+                current, current_tokens = kept, kept_tokens
+            current.append(piece)
+            current_tokens += piece[2]
+        if current:
+            yield emit(page_text, page_number, current)
+            chunk_index += 1
+
+
+def chunk_pages(
+    pages,
+    max_tokens: int = None,
+    overlap_tokens: int = None,
+    first_page_number: int | None = 1,
+) -> list[TextChunk]:
+    """
+    Splits page texts into overlapping chunks for embedding. See iter_chunks().
+    """
+    return list(iter_chunks(pages, max_tokens, overlap_tokens, first_page_number))
+
+
+def chunk_text(text: str, max_tokens: int = None, overlap_tokens: int = None):
+    """
+    Splits unpaginated text (e.g. a plain text upload) into chunks.
+    """
+    return chunk_pages(
+        [text],
+        max_tokens=max_tokens,
+        overlap_tokens=overlap_tokens,
+        first_page_number=None,
+    )
+
+
+SUPPORTED_DOCUMENT_TYPES = ("application/pdf", "text/plain")
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Content hash stored with each chunk: sha256 hex digest of its UTF-8 text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_document_chunks(data: bytes, content_type: str, pdf_workers: int = None):
+    """
+    Yields the chunks of an uploaded file of one of SUPPORTED_DOCUMENT_TYPES.
+    PDF pages are chunked as they are extracted.
+    """
+    if content_type == "application/pdf":
+        return iter_chunks(iter_pdf_pages(io.BytesIO(data), workers=pdf_workers))
+    if content_type == "text/plain":
+        return iter(chunk_text(data.decode("utf-8")))
+    raise ValueError(f"Unsupported file type: {content_type}")
+
+
+class DocumentSuperseded(Exception):
+    """
+    Raised when a newer upload of a document was queued while an older one was
+    being indexed.
+    """
+
+
+def index_document(
+    document, data: bytes, content_type: str, revision: int = None
+) -> int:
+    """
+    Extracts, chunks and embeds an uploaded file into TextEmbedding rows for the
+    document. Returns the number of chunks.
+
+    revision is the Document.revision the file was queued as; if the document
+    has moved past it by the time the rows would be written, nothing is written
+    and DocumentSuperseded is raised, so a slow older upload never overwrites
+    a newer one.
+
+    When the document is already indexed (e.g. an edited file replacing it), the
+    new chunks are diffed against the stored ones by content hash: unchanged
+    chunks keep their row and embedding and only have their position updated,
+    new chunks are embedded and inserted, and vanished ones are deleted in bulk.
+    """
+    # Pages are chunked and embedded while later pages are still being parsed
+    chunk_stream = iter_document_chunks(data, content_type)
+
+    version = get_embedding_version()
+    current = {"embedding_model": version.name, "embedding_version": version.version}
+    # Stored rows each match one new chunk with the same hash; rows embedded by
+    # another model are never reused
+    reusable = Counter(
+        document.embeddings.filter(**current).values_list("content_hash", flat=True)
+    )
+    chunks = []
+    new_embeddings = {}
+    while batch := list(islice(chunk_stream, EMBEDDING_BATCH_SIZE)):
+        chunks.extend(batch)
+        todo = {}
+        for chunk in batch:
+            digest = chunk_hash(chunk.text)
+            if reusable[digest] > 0:
+                reusable[digest] -= 1
+            elif digest not in new_embeddings:
+                todo[digest] = chunk.text
+        if todo:
+            embeddings = generate_embeddings(
+                list(todo.values()), version=version, priority=PRIORITY_BATCH
+            )
+            new_embeddings.update(zip(todo, embeddings))
+
+    position_fields = ["chunk_index", "page_number", "char_start", "char_end"]
+    with transaction.atomic():
+        # Serialize concurrent re-indexing of the same document
+        locked = (
+            type(document)
+            .objects.select_for_update()
+            .filter(pk=document.pk)
+            .values_list("revision", flat=True)
+            .first()
+        )
+        if revision is not None and locked != revision:
+            raise DocumentSuperseded(document.pk)
+        # Waits for a `manage.py reembed` cutover in progress, so the check below
+        # sees the model that will be active when these rows are committed
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "LOCK TABLE %s IN ROW EXCLUSIVE MODE"
+                % connection.ops.quote_name(TextEmbedding._meta.db_table)
+            )
+        if not get_embedding_version().matches(version):
+            raise RuntimeError("The embedding model changed during indexing.")
+
+        stored = {}
+        for row in document.embeddings.only(
+            "id", "content_hash", *current, *position_fields
+        ):
+            if all(getattr(row, field) == value for field, value in current.items()):
+                stored.setdefault(row.content_hash, []).append(row)
+            else:
+                stored.setdefault(None, []).append(row)
+
+        moved = []
+        created = []
+        for chunk in chunks:
+            digest = chunk_hash(chunk.text)
+            if stored.get(digest):
+                row = stored[digest].pop()
+                position = [getattr(chunk, field) for field in position_fields]
+                if [getattr(row, field) for field in position_fields] != position:
+                    for field, value in zip(position_fields, position):
+                        setattr(row, field, value)
+                    moved.append(row)
+                continue
+            if digest not in new_embeddings:
+                # The row was removed by a concurrent re-index; embed it now
+                new_embeddings[digest] = generate_embeddings(
+                    [chunk.text], version=version, priority=PRIORITY_BATCH
+                )[0]
+            created.append(
+                TextEmbedding(
+                    document=document,
+                    owner_id=document.user_id,
+                    text=chunk.text,
+                    content_hash=digest,
+                    embedding=new_embeddings[digest],
+                    **current,
+                    chunk_index=chunk.chunk_index,
+                    page_number=chunk.page_number,
+                    char_start=chunk.char_start,
+                    char_end=chunk.char_end,
+                )
+            )
+
+        stale = [row.pk for rows in stored.values() for row in rows]
+        TextEmbedding.objects.filter(pk__in=stale).delete()
+        TextEmbedding.objects.bulk_update(moved, position_fields, batch_size=500)
+        # One embedding row per chunk so retrieval returns focused passages
+        TextEmbedding.objects.bulk_create(created, batch_size=500)
+
+    logger.info(
+        "Indexed document %s: %s chunks, %s embedded, %s removed",
+        document.pk,
+        len(chunks),
+        len(created),
+        len(stale),
+    )
+    return len(chunks)
 
 
 def transcribe_audio(audio_file_path: str) -> str:
@@ -122,85 +579,701 @@ def extract_audio_from_video(video_file_path: str) -> str:
     Extracts audio from a video file and saves it to a temporary MP3 file.
     Returns the path to the temporary audio file.
     """
-    clip = VideoFileClip(video_file_path)
-    temp_audio_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-    temp_audio_path = temp_audio_file.name
-    clip.audio.write_audiofile(temp_audio_path)
-    clip.close()
+    with span("audio_extract"):
+        clip = VideoFileClip(video_file_path)
+        temp_audio_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
+        temp_audio_path = temp_audio_file.name
+        clip.audio.write_audiofile(temp_audio_path)
+        clip.close()
     return temp_audio_path
 
 
-def summarize_text(text: str) -> str:
+# Texts longer than this many estimated tokens are summarized map-reduce style,
+# so no prompt exceeds the model's context window (num_ctx)
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "1500"))
+# Parallel Ollama requests while summarizing the parts of a long text
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+
+
+@dataclass
+class GenerationResult:
     """
-    Summarizes the given text using the Llama 3.2 model via Ollama.
+    Text generated by Ollama; cached is True when it came from the response cache.
+    """
+
+    text: str
+    cached: bool = False
+
+
+def cached_generate(
+    task: str,
+    prompt: str,
+    model: str = None,
+    options: dict = None,
+    use_cache: bool = True,
+) -> GenerationResult:
+    """
+    Generates a response for the prompt, or returns the one cached for the same
+    model, task, options and normalized prompt.
+
+    use_cache=False bypasses the lookup; the fresh response still replaces the
+    cached one.
+    """
+    return generate_many(task, [prompt], model, options, use_cache)[0]
+
+
+def generate_many(
+    task: str,
+    prompts: list[str],
+    model: str = None,
+    options: dict = None,
+    use_cache: bool = True,
+    concurrency: int = None,
+) -> list[GenerationResult]:
+    """
+    Like cached_generate for several prompts; results are returned in input order.
+    Cache misses are generated by up to `concurrency` parallel Ollama requests
+    (default SUMMARY_CONCURRENCY), while the cache is only used from the
+    calling thread. A miss already being generated for another caller is
+    awaited instead of generated again.
     """
-    client = get_ollama_client()
-    prompt = f"Summarize the following text concisely: {text}"
-    response = client.generate(
-        model=OLLAMA_MODEL,
-        prompt=prompt,
-        keep_alive="30m",  # Keep model loaded for 30 minutes
+    model = model or OLLAMA_MODEL
+    keys = _response_keys(model, task, prompts, options)
+    results = _cached_results(keys) if use_cache else {}
+    missing = _missing_items(keys, prompts, results)
+
+    def generate(item):
+        key, prompt = item
+        return _coalesced_generate(
+            key, prompt, model, options, task_priority(task), task=task
+        )
+
+    generated = []
+    if len(missing) == 1:
+        generated = [generate(*missing.items())]
+    elif missing:
+        with ThreadPoolExecutor(
+            max_workers=min(concurrency or SUMMARY_CONCURRENCY, len(missing))
+        ) as executor:
+            generated = list(
+                executor.map(in_request_context(generate), missing.items())
+            )
+    _add_generated(results, missing, generated, model, task)
+    return [results[key] for key in keys]
+
+
+def _response_keys(
+    model: str, task: str, prompts: list[str], options: dict = None
+) -> list[str]:
+    return [response_cache_key(model, task, prompt, options) for prompt in prompts]
+
+
+def _cached_results(keys: list[str]) -> dict:
+    """
+    GenerationResults of the responses cached for keys, by key.
+    """
+    results = {}
+    for key in dict.fromkeys(keys):
+        text = response_cache.get(key)
+        if text is not None:
+            results[key] = GenerationResult(text, cached=True)
+    return results
+
+
+def _add_generated(
+    results: dict, missing: dict, generated: list, model: str, task: str
+):
+    """
+    Adds the (text, leader) pairs generated for the missing prompts to results
+    and caches the responses this caller generated itself.
+    """
+    for key, (text, leader) in zip(missing, generated):
+        if leader:
+            response_cache.set(key, model, task, text)
+        results[key] = GenerationResult(text)
+
+
+def _coalesced_generate(
+    key: str,
+    prompt: str,
+    model: str,
+    options: dict = None,
+    priority: int = PRIORITY_DEFAULT,
+    response_format: dict = None,
+    task: str = "",
+) -> tuple[str, bool]:
+    """
+    Generates the response to prompt, sharing the Ollama request with concurrent
+    calls for the same key. Returns the text and whether this call made the
+    request. Raises admission.Overloaded if no Ollama slot is available.
+
+    response_format is passed as Ollama's format: "json" or a JSON schema.
+    task labels the request's token metrics.
+    """
+
+    def generate():
+        with ollama_admission.slot(priority), ollama_hosts.lease(model) as host:
+            response = get_ollama_client(host.url).generate(
+                model=model,
+                prompt=prompt,
+                options=options,
+                format=response_format,
+                keep_alive="30m",  # Keep model loaded for 30 minutes
+            )
+        token_metrics.record(model, task, response)
+        return response["response"]
+
+    with span("generate"):
+        return flights.do(key, generate)
+
+
+# Counters Ollama reports in the last frame of a generation (durations in ns)
+OLLAMA_METRIC_FIELDS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
+
+def stream_generate(
+    prompt: str,
+    model: str = None,
+    options: dict = None,
+    task: str = None,
+    use_cache: bool = True,
+    priority: int = None,
+):
+    """
+    Yields the response to the prompt while Ollama generates it: a
+    {"response": text} frame per token, then a {"done": True, "cached": bool}
+    frame carrying Ollama's OLLAMA_METRIC_FIELDS.
+
+    With a task the response cache is used as in cached_generate: a cached
+    response is replayed in a single frame, and a completed one is stored.
+    Without a task nothing is cached.
+
+    Concurrent streams of the same prompt share one Ollama generation; a
+    stream joining one already under way first receives the frames it missed.
+    The generation holds an admission slot of the given priority (default: the
+    task's) while it runs.
+    """
+    model = model or OLLAMA_MODEL
+    key = response_cache_key(model, task or "", prompt, options)
+    if task and use_cache:
+        text = response_cache.get(key)
+        if text is not None:
+            yield from _replay_frames(text)
+            return
+
+    if priority is None:
+        priority = task_priority(task)
+    frames, leader = flights.stream(
+        key, lambda: _generation_frames(prompt, model, options, priority, task)
     )
-    return response["response"]
+    pieces = []
+    for frame in frames:
+        if frame.get("done") and task and leader:
+            response_cache.set(key, model, task, "".join(pieces))
+        pieces.append(frame.get("response", ""))
+        yield frame
+
+
+def _generation_frames(
+    prompt: str,
+    model: str,
+    options: dict = None,
+    priority: int = PRIORITY_DEFAULT,
+    task: str = "",
+):
+    """
+    Streams a generation from Ollama as stream_generate frames, uncached.
+    """
+    frames = _StreamFrames(model, task)
+    with span("generate"), ollama_admission.slot(priority), ollama_hosts.lease(
+        model
+    ) as host:
+        for chunk in get_ollama_client(host.url).generate(
+            model=model,
+            prompt=prompt,
+            options=options,
+            stream=True,
+            keep_alive="30m",  # Keep model loaded for 30 minutes
+        ):
+            if frame := frames.frame(chunk, chunk["response"]):
+                yield frame
+    yield frames.done()
+
+
+class _StreamFrames:
+    """
+    Shapes the chunks of an Ollama stream into stream_generate frames, and
+    records the token counters its last chunk carries.
+    """
+
+    def __init__(self, model: str, task: str = ""):
+        self.model = model
+        self.task = task
+        self.metrics = {}
+
+    def frame(self, chunk, text: str) -> dict | None:
+        """
+        The frame of chunk, whose new text is text; None if it adds none.
+        """
+        if chunk.get("done"):
+            self.metrics = {field: chunk.get(field) for field in OLLAMA_METRIC_FIELDS}
+            token_metrics.record(self.model, self.task, self.metrics)
+        return {"response": text} if text else None
 
+    def done(self) -> dict:
+        """
+        The final frame, sent once the stream has ended.
+        """
+        return {"done": True, "cached": False, **self.metrics}
 
-def generate_quiz(text: str) -> str:
+
+def _replay_frames(text: str) -> list[dict]:
+    """
+    The frames replaying a cached response.
+    """
+    return [{"response": text}, {"done": True, "cached": True}]
+
+
+def summarize_text(
+    text: str, use_cache: bool = True, concurrency: int = None
+) -> GenerationResult:
+    """
+    Summarizes the given text using the Llama 3.2 model via Ollama.
+
+    Texts longer than SUMMARY_CHUNK_TOKENS are split into parts that are
+    summarized in parallel; the partial summaries are then combined in groups
+    that fit the same budget, level by level, until one summary remains. The
+    result is cached only if every generation was.
+    """
+    task, prompt, cached = _final_summary_prompt(text, use_cache, concurrency)
+    result = cached_generate(task, prompt, use_cache=use_cache)
+    return GenerationResult(result.text, cached=cached and result.cached)
+
+
+def stream_summary(text: str, use_cache: bool = True, concurrency: int = None):
+    """
+    Like summarize_text, but streams the final summary. See stream_generate.
+    """
+    task, prompt, cached = _final_summary_prompt(text, use_cache, concurrency)
+    for frame in stream_generate(prompt, task=task, use_cache=use_cache):
+        if frame.get("done"):
+            frame["cached"] = cached and frame["cached"]
+        yield frame
+
+
+def _final_summary_prompt(
+    text: str, use_cache: bool, concurrency: int = None
+) -> tuple[str, str, bool]:
+    """
+    Summarizes the parts of a long text and reduces the partial summaries until
+    they fit one prompt; see _summary_steps.
+    """
+    steps = _summary_steps(text)
+    results = None
+    while True:
+        try:
+            task, prompts = steps.send(results)
+        except StopIteration as last:
+            return last.value
+        results = generate_many(
+            task, prompts, use_cache=use_cache, concurrency=concurrency
+        )
+
+
+def _summary_steps(text: str):
+    """
+    Map-reduce plan of summarizing text. Yields (task, prompts) for each level
+    of generations and expects their GenerationResults to be sent back.
+    Returns (task, prompt, cached) for the last generation, cached being
+    whether every earlier one came from the cache.
+    """
+    if estimate_tokens(text) <= SUMMARY_CHUNK_TOKENS:
+        return "summarize", _summary_prompt(text), True
+
+    results = yield "summarize_part", _summary_part_prompts(text)
+    cached = all(result.cached for result in results)
+    while True:
+        prompts = _summary_reduce_prompts([result.text for result in results])
+        if len(prompts) == 1:
+            return "summarize_reduce", prompts[0], cached
+        results = yield "summarize_reduce", prompts
+        cached = cached and all(result.cached for result in results)
+
+
+def _summary_prompt(text: str) -> str:
+    return f"Summarize the following text concisely: {text}"
+
+
+def _summary_part_prompts(text: str) -> list[str]:
+    """
+    Splits a long text into parts of SUMMARY_CHUNK_TOKENS and returns the
+    prompt summarizing each part.
+    """
+    parts = chunk_text(text, max_tokens=SUMMARY_CHUNK_TOKENS, overlap_tokens=0)
+    return [
+        f"Summarize the following part of a longer text concisely: {part.text}"
+        for part in parts
+    ]
+
+
+def _summary_reduce_prompts(summaries: list[str]) -> list[str]:
+    """
+    Returns the prompts combining consecutive partial summaries, one per group.
+    """
+    return [
+        "Combine the following summaries of consecutive parts of a text "
+        "into one concise summary:\n\n" + "\n\n".join(group)
+        for group in _group_summaries(summaries, SUMMARY_CHUNK_TOKENS)
+    ]
+
+
+def _group_summaries(summaries: list[str], max_tokens: int) -> list[list[str]]:
+    """
+    Packs consecutive summaries into groups of at most max_tokens estimated
+    tokens. Every group but a lone last one holds at least two summaries, so
+    each reduce level at least halves their number.
+    """
+    groups = []
+    group_tokens = 0
+    for summary in summaries:
+        tokens = estimate_tokens(summary)
+        if groups and (len(groups[-1]) < 2 or group_tokens + tokens <= max_tokens):
+            groups[-1].append(summary)
+            group_tokens += tokens
+        else:
+            groups.append([summary])
+            group_tokens = tokens
+    return groups
+
+
+def _quiz_prompt(text: str) -> str:
+    return f"Generate 3-5 multiple choice quiz questions (each with 4 options and the correct answer) from the following text: {text}"
+
+
+def generate_quiz(text: str, use_cache: bool = True) -> GenerationResult:
     """
     Generates quiz questions from the given text using the Llama 3.2 model via Ollama.
     """
-    client = get_ollama_client()
-    prompt = f"Generate 3-5 multiple choice quiz questions (each with 4 options and the correct answer) from the following text: {text}"
-    response = client.generate(
-        model=OLLAMA_MODEL,
-        prompt=prompt,
-        keep_alive="30m",  # Keep model loaded for 30 minutes
+    return cached_generate("quiz", _quiz_prompt(text), use_cache=use_cache)
+
+
+def stream_quiz(text: str, use_cache: bool = True):
+    """
+    Like generate_quiz, but streams the questions. See stream_generate.
+    """
+    return stream_generate(_quiz_prompt(text), task="quiz", use_cache=use_cache)
+
+
+def generate_structured(
+    kind: StructuredKind,
+    text: str,
+    count: int,
+    topic: str = "",
+    use_cache: bool = True,
+) -> StructuredResult:
+    """
+    Generates count validated quiz questions or flashcards; see
+    structured.generate_items. The cache and Ollama are used from the calling
+    thread.
+    """
+
+    def generate(key: str, prompt: str, schema: dict) -> str:
+        return _coalesced_generate(
+            key,
+            prompt,
+            OLLAMA_MODEL,
+            priority=task_priority(kind.task),
+            response_format=schema,
+            task=kind.task,
+        )[0]
+
+    return async_to_sync(generate_items)(
+        kind, text, count, sync_to_async(generate), OLLAMA_MODEL, topic, use_cache
     )
-    return response["response"]
 
 
-def hybrid_rag_generation(query: str, user) -> str:
+def search_similar_chunks(
+    query_embedding: list[float],
+    user=None,
+    limit: int = 5,
+    max_distance: float = 0.5,
+    ef_search: int = None,
+    probes: int = None,
+) -> list[TextEmbedding]:
     """
-    Generates a response using a hybrid RAG and fine-tuning approach with Llama 3.2 via Ollama.
+    Returns the stored chunks closest to the query embedding by cosine distance.
+
+    With a user, only that user's chunks are searched (anonymous users only see
+    chunks without an owner); user=None searches every chunk.
+
+    The query runs in its own transaction so the ANN search parameters
+    (hnsw.ef_search / ivfflat.probes) can be tuned per query with SET LOCAL.
+
+    With a quantized index (VECTOR_INDEX['QUANTIZATION']), candidates are first
+    fetched by their halfvec or binary distance and then re-ranked exactly.
+    """
+    queryset = TextEmbedding.objects.all()
+    if user is not None:
+        if user.is_authenticated:
+            queryset = queryset.filter(owner=user)
+        else:
+            queryset = queryset.filter(owner__isnull=True)
+
+    window = limit
+    if get_vector_index_settings()["QUANTIZATION"] != "none":
+        dimensions = get_embedding_version().dimensions
+        coarse_sql, rerank_factor = coarse_distance_sql(dimensions)
+        window = limit * rerank_factor
+        vector = TextEmbedding._meta.get_field("embedding").get_prep_value(
+            query_embedding
+        )
+        candidate_ids = (
+            queryset.annotate(coarse_distance=RawSQL(coarse_sql, [vector]))
+            .order_by("coarse_distance")
+            .values("id")[:window]
+        )
+        queryset = TextEmbedding.objects.filter(id__in=candidate_ids)
+
+    with transaction.atomic():
+        apply_search_params(
+            ef_search=ef_search, probes=probes, limit=window, filtered=user is not None
+        )
+        results = list(
+            queryset.annotate(distance=CosineDistance("embedding", query_embedding))
+            .filter(distance__lt=max_distance)
+            .order_by("distance")[:limit]
+        )
+    # Iterative scans in relaxed order may return rows slightly out of order
+    results.sort(key=lambda res: res.distance)
+    return results
+
+
+def hybrid_search_chunks(
+    query_text: str,
+    query_embedding: list[float],
+    user=None,
+    limit: int = 5,
+    candidates: int = None,
+    max_distance: float = 0.5,
+    ef_search: int = None,
+    probes: int = None,
+) -> list[TextEmbedding]:
+    """
+    Returns chunks ranked by reciprocal rank fusion of a full-text search and a
+    vector search, both run in a single SQL query.
+
+    Each branch contributes its top `candidates` rows; a chunk scores
+    1 / (RRF_K + rank) for every branch it appears in. Results carry `score`,
+    `distance`, `vector_rank` and `lexical_rank` (None when a branch missed it).
+    User scoping, search parameters and quantized re-ranking behave as in
+    search_similar_chunks.
+    """
+    candidates = max(candidates or RETRIEVAL_CANDIDATES, limit)
+    table = connection.ops.quote_name(TextEmbedding._meta.db_table)
+    vector = TextEmbedding._meta.get_field("embedding").get_prep_value(query_embedding)
+    coarse_sql, rerank_factor = coarse_distance_sql(get_embedding_version().dimensions)
+
+    owner_sql, owner_params = "", []
+    if user is not None:
+        if user.is_authenticated:
+            owner_sql, owner_params = "AND owner_id = %s", [user.pk]
+        else:
+            owner_sql = "AND owner_id IS NULL"
+
+    sql = f"""
+        WITH vector_hits AS (
+            SELECT id, embedding <=> %s::vector AS distance
+            FROM (
+                SELECT id, embedding
+                FROM {table}
+                WHERE TRUE {owner_sql}
+                ORDER BY {coarse_sql}
+                LIMIT %s
+            ) AS coarse
+            ORDER BY distance
+            LIMIT %s
+        ),
+        vector_ranked AS (
+            SELECT id, distance, ROW_NUMBER() OVER (ORDER BY distance) AS vector_rank
+            FROM vector_hits
+            WHERE distance < %s
+        ),
+        lexical_ranked AS (
+            SELECT id, ROW_NUMBER() OVER (
+                ORDER BY ts_rank_cd(search_vector, query) DESC
+            ) AS lexical_rank
+            FROM {table}, websearch_to_tsquery(%s::regconfig, %s) AS query
+            WHERE search_vector @@ query {owner_sql}
+            ORDER BY ts_rank_cd(search_vector, query) DESC
+            LIMIT %s
+        ),
+        fused AS (
+            SELECT
+                COALESCE(v.id, l.id) AS id,
+                v.distance,
+                v.vector_rank,
+                l.lexical_rank,
+                COALESCE(1.0 / (%s + v.vector_rank), 0)
+                    + COALESCE(1.0 / (%s + l.lexical_rank), 0) AS score
+            FROM vector_ranked v FULL OUTER JOIN lexical_ranked l ON v.id = l.id
+        )
+        SELECT t.*, f.distance, f.vector_rank, f.lexical_rank, f.score
+        FROM fused f JOIN {table} t ON t.id = f.id
+        ORDER BY f.score DESC, f.distance
+        LIMIT %s
     """
-    client = get_ollama_client()
+    params = [
+        vector,
+        *owner_params,
+        vector,
+        candidates * rerank_factor,
+        candidates,
+        max_distance,
+        SEARCH_CONFIG,
+        query_text,
+        *owner_params,
+        candidates,
+        RRF_K,
+        RRF_K,
+        limit,
+    ]
 
+    with transaction.atomic():
+        apply_search_params(
+            ef_search=ef_search,
+            probes=probes,
+            limit=candidates * rerank_factor,
+            filtered=user is not None,
+        )
+        return list(TextEmbedding.objects.raw(sql, params))
+
+
+def retrieve_chunks(
+    query_text: str,
+    query_embedding: list[float],
+    user=None,
+    limit: int = 5,
+    mode: str = None,
+    **search_params,
+) -> list[TextEmbedding]:
+    """
+    Retrieves chunks for a query with the given mode: "hybrid" (full-text + vector
+    with rank fusion) or "vector" (cosine distance only). Defaults to RETRIEVAL_MODE.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode == "hybrid":
+        with span("retrieval"):
+            return hybrid_search_chunks(
+                query_text, query_embedding, user=user, limit=limit, **search_params
+            )
+    if mode == "vector":
+        with span("retrieval"):
+            return search_similar_chunks(
+                query_embedding, user=user, limit=limit, **search_params
+            )
+    raise ValueError(f"Unknown retrieval mode {mode!r}; use 'hybrid' or 'vector'.")
+
+
+def _rag_prompt(
+    query: str,
+    user,
+    ef_search: int = None,
+    probes: int = None,
+    mode: str = None,
+) -> str:
+    """
+    Builds the hybrid RAG prompt: the query with the user's most relevant chunks.
+    """
     # 1. Generate embedding for the query
     query_embedding = generate_embedding(query)
+    return _retrieval_prompt(query, query_embedding, user, ef_search, probes, mode)
+
 
+def _retrieval_prompt(
+    query: str,
+    query_embedding: list[float],
+    user,
+    ef_search: int = None,
+    probes: int = None,
+    mode: str = None,
+) -> str:
+    """
+    The RAG prompt of a query whose embedding is known.
+    """
     # 2. Search for relevant documents (notes) by the user
-    # Note: This assumes TextEmbedding is associated with a user or content related to a user
-    # For now, we'll search all embeddings, but ideally, this would be scoped to the user's content.
-    # To scope by user, you would need to add a ForeignKey to User in TextEmbedding model.
-    results = (
-        TextEmbedding.objects.order_by(CosineDistance("embedding", query_embedding))
-        .annotate(distance=CosineDistance("embedding", query_embedding))
-        .filter(distance__lt=0.5)[:3]
+    results = retrieve_chunks(
+        query,
+        query_embedding,
+        user=user,
+        limit=3,
+        mode=mode,
+        ef_search=ef_search,
+        probes=probes,
     )  # Get top 3 relevant results
+    with span("prompt"):
+        return _format_rag_prompt(query, results)
 
+
+def _format_rag_prompt(query: str, results: list[TextEmbedding]) -> str:
     context = ""
     if results:
         context = "Relevant information:\n"
         for i, res in enumerate(results):
-            context += f"Document {i+1}: {res.text}\n"
+            source = f" (page {res.page_number})" if res.page_number else ""
+            context += f"Document {i+1}{source}: {res.text}\n"
 
     # 3. Construct prompt for Llama 3.2 model
     if context:
-        prompt = (
+        return (
             f"Based on the following relevant information and your knowledge, answer the user's question. "
             f"If the information is not sufficient, state that you don't have enough information.\n\n"
             f"{context}\n"
             f"User's question: {query}"
         )
-    else:
-        prompt = f"Answer the following question based on your knowledge: {query}"
-
-    # 4. Generate response using Llama 3.2
-    response = client.generate(
-        model=OLLAMA_MODEL,
-        prompt=prompt,
-        keep_alive="30m",  # Keep model loaded for 30 minutes
+    return f"Answer the following question based on your knowledge: {query}"
+
+
+def hybrid_rag_generation(
+    query: str,
+    user,
+    ef_search: int = None,
+    probes: int = None,
+    mode: str = None,
+) -> str:
+    """
+    Generates a response using a hybrid RAG and fine-tuning approach with Llama 3.2 via Ollama.
+    """
+    prompt = _rag_prompt(query, user, ef_search=ef_search, probes=probes, mode=mode)
+
+    # 4. Generate response using Llama 3.2, shared with identical queries in flight
+    key = response_cache_key(OLLAMA_MODEL, "rag", prompt)
+    return _coalesced_generate(
+        key, prompt, OLLAMA_MODEL, priority=PRIORITY_INTERACTIVE, task="rag"
+    )[0]
+
+
+def stream_hybrid_rag_generation(
+    query: str,
+    user,
+    ef_search: int = None,
+    probes: int = None,
+    mode: str = None,
+):
+    """
+    Like hybrid_rag_generation, but streams the answer. See stream_generate.
+    """
+    prompt = _rag_prompt(query, user, ef_search=ef_search, probes=probes, mode=mode)
+    # Not cached, like hybrid_rag_generation
+    yield from stream_generate(
+        prompt, task="rag", use_cache=False, priority=PRIORITY_INTERACTIVE
     )
-    return response["response"]
 
 
 def classify_image(image_path: str, max_dimension: int = 768) -> str:
@@ -212,8 +1285,6 @@ def classify_image(image_path: str, max_dimension: int = 768) -> str:
         image_path: Path to the image file
         max_dimension: Maximum width/height (default 768px for optimal speed/quality balance)
     """
-    client = get_ollama_client()
-
     # Check if file exists
     if not os.path.exists(image_path):
         return "Error: Image file not found."
@@ -223,53 +1294,54 @@ def classify_image(image_path: str, max_dimension: int = 768) -> str:
 
     try:
         # Optimize image size for faster processing
-        img = Image.open(image_path)
-        width, height = img.size
-
-        # Only resize if image is larger than max_dimension
-        if width > max_dimension or height > max_dimension:
-            # Calculate new size maintaining aspect ratio
-            if width > height:
-                new_width = max_dimension
-                new_height = int((max_dimension / width) * height)
-            else:
-                new_height = max_dimension
-                new_width = int((max_dimension / height) * width)
+        with span("image_resize"):
+            img = Image.open(image_path)
+            width, height = img.size
 
-            # Resize image
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # Only resize if image is larger than max_dimension
+            if width > max_dimension or height > max_dimension:
+                # Calculate new size maintaining aspect ratio
+                if width > height:
+                    new_width = max_dimension
+                    new_height = int((max_dimension / width) * height)
+                else:
+                    new_height = max_dimension
+                    new_width = int((max_dimension / height) * width)
 
-            # Save to temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-            img.save(temp_file.name, "JPEG", quality=85)
-            optimized_path = temp_file.name
+                # Resize image
+                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
-        # Prefer Hugging Face if API key is set; otherwise use Ollama with Llama 3.2 Vision
+                # Save to temporary file
+                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
+                img.save(temp_file.name, "JPEG", quality=85)
+                optimized_path = temp_file.name
+
+        # Prefer Hugging Face if API key is set; otherwise use Ollama with Llama 3.2 Vision.
+        # Backends whose circuit breaker is open are skipped; with VISION_HEDGING
+        # a slow Hugging Face call races Ollama.
+        backends = []
         if HUGGINGFACE_API_KEY:
-            try:
-                print(
-                    f"[AI] Using Hugging Face for image classification: {HF_VISION_MODEL}"
-                )
-                return classify_image_hf(optimized_path)
-            except Exception as hf_err:
-                print(
-                    f"[AI] HF Classification failed, falling back to Ollama: {hf_err}"
-                )
-        # Ollama fallback: Llama 3.2 Vision
-        try:
-            prompt = "Classify this image into ONE of these categories: Math, Physics, ComputerScience, Chemistry, Biology, Assignment, ExamPaper, Notes, or Other. Provide only the category name."
-            response = client.generate(
-                model=OLLAMA_VISION_MODEL,
-                prompt=prompt,
-                images=[optimized_path],
-                keep_alive="30m",
+            logger.debug(
+                "Using Hugging Face for image classification: %s", HF_VISION_MODEL
             )
-            return response.get("response", "").strip()
+            backends.append(
+                (hf_vision_breaker, lambda: classify_image_hf(optimized_path))
+            )
+        backends.append(
+            (ollama_vision_breaker, lambda: _classify_image_ollama(optimized_path))
+        )
+        try:
+            with span("vision"):
+                return call_with_fallback(backends, hedge=VISION_HEDGING).strip()
+        except Overloaded:
+            raise
         except Exception as ollama_err:
             if not HUGGINGFACE_API_KEY:
                 return f"Ollama vision failed: {str(ollama_err)}. Set HUGGINGFACE_API_KEY for HF fallback or ensure {OLLAMA_VISION_MODEL} is available."
-            return f"Both HF and Ollama vision failed. Ollama: {str(ollama_err)}"
+            return f"Both HF and Ollama vision failed: {str(ollama_err)}"
 
+    except Overloaded:
+        raise
     except Exception as e:
         return f"Error in image classification pipeline: {str(e)}"
     finally:
@@ -278,6 +1350,30 @@ def classify_image(image_path: str, max_dimension: int = 768) -> str:
             os.remove(temp_file.name)
 
 
+IMAGE_CLASSIFICATION_PROMPT = "Classify this image into ONE of these categories: Math, Physics, ComputerScience, Chemistry, Biology, Assignment, ExamPaper, Notes, or Other. Provide only the category name."
+
+# Health of each vision backend. Ollama being overloaded is not a fault of its own.
+hf_vision_breaker = CircuitBreaker("huggingface_vision")
+ollama_vision_breaker = CircuitBreaker("ollama_vision", ignored_errors=(Overloaded,))
+
+
+def _classify_image_ollama(image_path: str) -> str:
+    """
+    Classifies an image with OLLAMA_VISION_MODEL.
+    """
+    with ollama_admission.slot(PRIORITY_DEFAULT), ollama_hosts.lease(
+        OLLAMA_VISION_MODEL
+    ) as host:
+        response = get_ollama_client(host.url).generate(
+            model=OLLAMA_VISION_MODEL,
+            prompt=IMAGE_CLASSIFICATION_PROMPT,
+            images=[image_path],
+            keep_alive="30m",
+        )
+    token_metrics.record(OLLAMA_VISION_MODEL, "classify_image", response)
+    return response.get("response", "")
+
+
 import requests
 import base64
 
@@ -289,6 +1385,16 @@ def huggingface_analyze_image(image_path: str, prompt: str) -> str:
     if not HUGGINGFACE_API_KEY:
         return "Error: HUGGINGFACE_API_KEY not set."
 
+    try:
+        return _huggingface_generate(image_path, prompt)
+    except Exception as e:
+        return f"Error with HF API: {str(e)}"
+
+
+def _huggingface_generate(image_path: str, prompt: str) -> str:
+    """
+    Calls the Hugging Face Inference API, raising on errors and after HF_TIMEOUT.
+    """
     # Read and encode image
     with open(image_path, "rb") as f:
         img_str = base64.b64encode(f.read()).decode("utf-8")
@@ -306,21 +1412,25 @@ def huggingface_analyze_image(image_path: str, prompt: str) -> str:
         "parameters": {"max_new_tokens": 1000, "temperature": 0.2},
     }
 
+    start = time.monotonic()
     try:
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = requests.post(
+            api_url, headers=headers, json=payload, timeout=HF_TIMEOUT
+        )
         response.raise_for_status()
-        result = response.json()
+    except Exception:
+        observe_huggingface(HF_VISION_MODEL, time.monotonic() - start, ok=False)
+        raise
+    observe_huggingface(HF_VISION_MODEL, time.monotonic() - start, ok=True)
+    result = response.json()
 
-        if isinstance(result, list) and len(result) > 0:
-            return result[0].get("generated_text", str(result))
-        return result.get("generated_text", result.get("answer", str(result)))
-    except Exception as e:
-        return f"Error with HF API: {str(e)}"
+    if isinstance(result, list) and len(result) > 0:
+        return result[0].get("generated_text", str(result))
+    return result.get("generated_text", result.get("answer", str(result)))
 
 
 def classify_image_hf(image_path: str) -> str:
     """
-    Classifies an image using Hugging Face.
+    Classifies an image using Hugging Face. Raises if the API call fails.
     """
-    prompt = "Classify this image into ONE of these categories: Math, Physics, ComputerScience, Chemistry, Biology, Assignment, ExamPaper, Notes, or Other. Provide only the category name."
-    return huggingface_analyze_image(image_path, prompt)
+    return _huggingface_generate(image_path, IMAGE_CLASSIFICATION_PROMPT)
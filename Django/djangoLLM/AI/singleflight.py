@@ -0,0 +1,274 @@
+import asyncio
+import threading
+from contextvars import copy_context
+
+# Request coalescing: identical concurrent calls (same key, e.g. the response
+# cache key of a prompt) share one in-flight Ollama request instead of each
+# starting their own. Only calls that overlap in time are merged; once a call
+# finishes its key is free again and later callers go through the cache.
+# A shared stream is cancelled once all of its subscribers have stopped
+# reading, which releases its admission slot and stops the Ollama generation.
+
+
+class _Call:
+    def __init__(self):
+        self.finished = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class _Broadcast:
+    """
+    Frames of one in-flight stream. Every subscriber replays the frames
+    produced so far and then follows the live ones, so it can join mid-way.
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.done = False
+        self.error = None
+        self.changed = threading.Condition()
+        self.subscribers = 0
+
+    def publish(self, frame):
+        with self.changed:
+            self.frames.append(frame)
+            self.changed.notify_all()
+
+    def close(self, error: BaseException = None):
+        with self.changed:
+            self.error = error
+            self.done = True
+            self.changed.notify_all()
+
+    def subscribe(self):
+        """
+        Counts a subscriber until its iterator is finished or closed.
+        """
+        with self.changed:
+            self.subscribers += 1
+        return self._follow()
+
+    def _follow(self):
+        seen = 0
+        try:
+            while True:
+                with self.changed:
+                    self.changed.wait_for(lambda: self.done or seen < len(self.frames))
+                    frames = self.frames[seen:]
+                    done = self.done
+                seen += len(frames)
+                for frame in frames:
+                    yield dict(frame)  # Subscribers may edit their frames
+                if done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            with self.changed:
+                self.subscribers -= 1
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls made from threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._streams)
+
+    def do(self, key, fn) -> tuple:
+        """
+        Returns (fn(), leader). The first caller for key runs fn; callers
+        arriving while it runs wait and get its result (or exception) with
+        leader=False.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.finished.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.finished.set()
+        return call.value, True
+
+    def stream(self, key, source) -> tuple:
+        """
+        Returns (frames, leader). The first caller for key starts iterating
+        source() in a background thread, so the stream completes for the other
+        subscribers even if the caller stops reading; callers arriving while
+        it runs get the frames from the start with leader=False. Once no
+        subscriber is left, the next frame stops the stream and source() is
+        closed.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+            # Under the lock, so an abandoned stream is never joined
+            frames = broadcast.subscribe()
+        if leader:
+            # In the leader's context, so e.g. its request timings see the stream
+            threading.Thread(
+                target=copy_context().run,
+                args=(self._produce, key, broadcast, source),
+                daemon=True,
+            ).start()
+        return frames, leader
+
+    def _produce(self, key, broadcast: _Broadcast, source):
+        error = None
+        frames = iter(source())
+        try:
+            for frame in frames:
+                broadcast.publish(frame)
+                if self._abandon(key, broadcast):
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            if hasattr(frames, "close"):
+                frames.close()  # E.g. ends the Ollama request and frees its slot
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            broadcast.close(error)
+
+    def _abandon(self, key, broadcast: _Broadcast) -> bool:
+        """
+        Returns True and frees key if every subscriber of the stream has left.
+        """
+        with self._lock:
+            if broadcast.subscribers:
+                return False
+            del self._streams[key]  # Later callers start a new stream
+            return True
+
+
+class _AsyncBroadcast:
+    """
+    _Broadcast for coroutines of one event loop.
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.task = None
+        self.subscribers = 0
+        self.abandoned = False
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def publish(self, frame):
+        self.frames.append(frame)
+        self._notify()
+
+    def close(self, error: BaseException = None):
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def subscribe(self):
+        self.subscribers += 1
+        return self._follow()
+
+    async def _follow(self):
+        seen = 0
+        try:
+            while True:
+                while seen < len(self.frames):
+                    yield dict(self.frames[seen])
+                    seen += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self.changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                # Nobody reads on: cancelling the producer closes source()
+                self.abandoned = True
+                self.task.cancel()
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces identical concurrent calls made from coroutines. Calls are only
+    shared within one event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    async def do(self, key, fn) -> tuple:
+        """
+        Returns (await fn(), leader); see SingleFlight.do. A caller that is
+        cancelled does not cancel the call for the others.
+        """
+        key = (asyncio.get_running_loop(), key)
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task), leader
+
+    def stream(self, key, source) -> tuple:
+        """
+        Returns (frames, leader), frames being an async iterator; see
+        SingleFlight.stream. source() is iterated by a task of the running loop,
+        which is cancelled as soon as the last subscriber leaves.
+        """
+        key = (asyncio.get_running_loop(), key)
+        broadcast = self._streams.get(key)
+        leader = broadcast is None or broadcast.abandoned
+        if leader:
+            broadcast = self._streams[key] = _AsyncBroadcast()
+            broadcast.task = asyncio.ensure_future(
+                self._produce(key, broadcast, source)
+            )
+        return broadcast.subscribe(), leader
+
+    async def _produce(self, key, broadcast: _AsyncBroadcast, source):
+        error = None
+        frames = source()
+        try:
+            async for frame in frames:
+                broadcast.publish(frame)
+        except Exception as e:
+            error = e
+        finally:
+            if hasattr(frames, "aclose"):
+                await frames.aclose()
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            broadcast.close(error)
@@ -0,0 +1,276 @@
+import json
+import os
+import re
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    ValidationError,
+    field_validator,
+    model_validator,
+)
+
+from .cache import normalize_text, response_cache, response_cache_key
+
+# Structured quiz and flashcard generation: Ollama is asked for JSON matching a
+# schema (its `format` parameter), every item is validated with pydantic, and
+# only the missing or invalid items are generated again.
+
+MAX_STRUCTURED_ITEMS = 20
+# Extra generations asking only for the items missing from a structured reply
+STRUCTURED_RETRIES = int(os.getenv("STRUCTURED_RETRIES", "1"))
+
+_ANSWER_LETTER_RE = re.compile(r"^\(?([A-Da-d])[).:]?(?:\s+(.*))?$")
+
+
+class QuizQuestion(BaseModel):
+    """
+    A multiple choice question, serialized with the frontend's field names.
+    """
+
+    model_config = ConfigDict(populate_by_name=True, str_strip_whitespace=True)
+
+    question: str = Field(min_length=1)
+    options: list[str] = Field(min_length=4, max_length=4)
+    correct_answer: str = Field(alias="correctAnswer", min_length=1)
+    explanation: str = ""
+
+    @field_validator("options")
+    @classmethod
+    def options_are_distinct(cls, options: list[str]) -> list[str]:
+        options = [option.strip() for option in options]
+        if not all(options):
+            raise ValueError("options must not be empty")
+        if len({option.lower() for option in options}) != len(options):
+            raise ValueError("options must be distinct")
+        return options
+
+    @model_validator(mode="after")
+    def answer_is_an_option(self) -> "QuizQuestion":
+        """
+        The answer must be one of the options. Common slips are repaired: other
+        case or spacing, or the option's letter ("B", "b) text").
+        """
+        by_text = {option.lower(): option for option in self.options}
+        answer = by_text.get(self.correct_answer.lower())
+        match = _ANSWER_LETTER_RE.match(self.correct_answer)
+        if answer is None and match:
+            option = self.options["abcd".index(match.group(1).lower())]
+            if not match.group(2) or match.group(2).lower() == option.lower():
+                answer = option
+        if answer is None:
+            raise ValueError("correctAnswer must be one of the options")
+        self.correct_answer = answer
+        return self
+
+    def identity(self) -> str:
+        return normalize_text(self.question).lower()
+
+
+class Flashcard(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    front: str = Field(min_length=1)
+    back: str = Field(min_length=1)
+
+    def identity(self) -> str:
+        return normalize_text(self.front).lower()
+
+
+@dataclass
+class StructuredKind:
+    """
+    What is generated: the item model, the JSON key holding the items and how
+    to ask for them.
+    """
+
+    name: str
+    item_model: type[BaseModel]
+    key: str
+    instructions: str
+
+    @property
+    def task(self) -> str:
+        """
+        Response cache task (and token metrics label) of its generations.
+        """
+        return f"{self.name}_json"
+
+    def schema(self, count: int) -> dict:
+        """
+        JSON schema for Ollama's format parameter: {key: [count items]}.
+        """
+        return {
+            "type": "object",
+            "properties": {
+                self.key: {
+                    "type": "array",
+                    "items": self.item_model.model_json_schema(by_alias=True),
+                    "minItems": count,
+                    "maxItems": count,
+                }
+            },
+            "required": [self.key],
+        }
+
+    def prompt(self, text: str, topic: str, count: int, avoid: list = ()) -> str:
+        prompt = (
+            f"Generate exactly {count} {self.instructions}\n\n"
+            f"Topic: {topic or 'See content.'}\n"
+            f"Content: {text}\n\n"
+            f'Respond with a JSON object whose "{self.key}" array holds the items.'
+        )
+        if avoid:
+            existing = "\n".join(f"- {item.identity()}" for item in avoid)
+            prompt += f"\nDo not repeat any of these:\n{existing}"
+        return prompt
+
+
+QUIZ = StructuredKind(
+    "quiz",
+    QuizQuestion,
+    "questions",
+    "multiple choice quiz questions based on the following topic and content. "
+    'Each question has "question", "options" (4 distinct strings), '
+    '"correctAnswer" (exactly one of the options) and "explanation".',
+)
+FLASHCARDS = StructuredKind(
+    "flashcards",
+    Flashcard,
+    "flashcards",
+    "flashcards based on the following topic and content. "
+    'Each flashcard has a "front" (a term or question) and a "back" (the answer).',
+)
+
+
+@dataclass
+class StructuredResult:
+    """
+    Validated items; complete is False if fewer than requested could be made.
+    generations counts the Ollama generations it took (0 when cached).
+    """
+
+    items: list = field(default_factory=list)
+    cached: bool = False
+    complete: bool = True
+    generations: int = 0
+
+    def as_json(self) -> list[dict]:
+        return [item.model_dump(by_alias=True) for item in self.items]
+
+
+def parse_items(text: str, key: str) -> list:
+    """
+    Returns the raw items of a model reply. A reply cut short or broken part
+    way yields the items before the damage.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return _salvage_items(text)
+    if isinstance(data, dict):
+        data = data.get(
+            key, next((v for v in data.values() if isinstance(v, list)), [])
+        )
+    return data if isinstance(data, list) else []
+
+
+def _salvage_items(text: str) -> list:
+    start = text.find("[")
+    if start == -1:
+        return []
+    decoder = json.JSONDecoder()
+    items = []
+    position = start + 1
+    while True:
+        while position < len(text) and text[position] in ", \t\r\n":
+            position += 1
+        if position >= len(text) or text[position] == "]":
+            return items
+        try:
+            item, position = decoder.raw_decode(text, position)
+        except ValueError:
+            return items
+        items.append(item)
+
+
+def validate_items(raw_items: list, kind: StructuredKind, seen: set = None) -> list:
+    """
+    Returns the raw items that validate as kind.item_model, dropping invalid
+    ones and duplicates of each other or of the identities in seen.
+    """
+    seen = set() if seen is None else seen
+    items = []
+    for raw in raw_items:
+        try:
+            item = kind.item_model.model_validate(raw)
+        except ValidationError:
+            continue
+        if item.identity() in seen:
+            continue
+        seen.add(item.identity())
+        items.append(item)
+    return items
+
+
+def load_cached_items(text: str, kind: StructuredKind) -> list:
+    """
+    Items stored by dump_items.
+    """
+    return [kind.item_model.model_validate(raw) for raw in json.loads(text)]
+
+
+def dump_items(items: list) -> str:
+    return json.dumps([item.model_dump(by_alias=True) for item in items])
+
+
+async def generate_items(
+    kind: StructuredKind,
+    text: str,
+    count: int,
+    generate,
+    model: str,
+    topic: str = "",
+    use_cache: bool = True,
+) -> StructuredResult:
+    """
+    Generates count validated items of kind. Ollama must answer in kind's JSON
+    schema; invalid or duplicate items are dropped and up to
+    STRUCTURED_RETRIES further generations ask for just the missing ones.
+    Complete results are cached.
+
+    generate(key, prompt, schema) is an async callable returning the reply of
+    model to prompt, in the JSON schema, sharing requests by key; see
+    services.generate_structured and async_services.agenerate_structured.
+    """
+    prompt = kind.prompt(text, topic, count)
+    key = response_cache_key(model, kind.task, prompt)
+    if use_cache:
+        cached = await sync_to_async(response_cache.get)(key)
+        if cached is not None:
+            return StructuredResult(load_cached_items(cached, kind), cached=True)
+
+    result = StructuredResult()
+    seen = set()
+    for attempt in range(STRUCTURED_RETRIES + 1):
+        missing = count - len(result.items)
+        if not missing:
+            break
+        if attempt:
+            prompt = kind.prompt(text, topic, missing, avoid=result.items)
+        reply = await generate(
+            response_cache_key(model, kind.task, prompt), prompt, kind.schema(missing)
+        )
+        result.generations += 1
+        result.items += validate_items(parse_items(reply, kind.key), kind, seen)[
+            :missing
+        ]
+    result.complete = len(result.items) == count
+    if result.complete:
+        await sync_to_async(response_cache.set)(
+            key, model, kind.task, dump_items(result.items)
+        )
+    return result
@@ -1,4 +1,88 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from asgiref.sync import async_to_sync
+from prometheus_client import REGISTRY
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from pgvector.django import IvfflatIndex
+from rest_framework.test import APIClient
+
+from .admission import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AdmissionController,
+    Overloaded,
+    process_share,
+)
+from .async_services import get_async_ollama_client
+from .balancer import OLLAMA_HEALTH_FAILURES, HostPool
+from .breaker import CircuitBreaker, CircuitOpen, call_with_fallback
+from .chat import compact_session
+from .cache import LRUCache, embedding_cache, response_cache
+from .management.commands.benchmark_pdf_extraction import synthetic_pdf
+from .jobs import _finish, claim_job, run_job
+from .models import (
+    ChatMessage,
+    ChatSession,
+    Document,
+    EmbeddingCacheEntry,
+    EmbeddingVersion,
+    IngestionJob,
+    ResponseCacheEntry,
+    TextEmbedding,
+)
+from .pdf import iter_pdf_pages
+from .services import (
+    _group_summaries,
+    cached_generate,
+    chunk_hash,
+    chunk_pages,
+    chunk_text,
+    estimate_tokens,
+    generate_embedding,
+    generate_embeddings,
+    generate_structured,
+    index_document,
+    iter_chunks,
+    retrieve_chunks,
+    search_similar_chunks,
+    summarize_text,
+)
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .structured import (
+    FLASHCARDS,
+    QUIZ,
+    QuizQuestion,
+    parse_items,
+    validate_items,
+)
+from .token_metrics import TokenMetrics
+from .views import _record_proxy_frame
+from .vector_index import (
+    VECTOR_INDEX_NAME,
+    build_vector_index,
+    create_vector_index,
+    drop_vector_index,
+)
 
 
 # Create your tests here.
@@ -24,3 +108,1682 @@ class BackendSanityTests(TestCase):
             # If admin is not enabled or renamed, this might fail,
             # but for a standard django setup it should pass.
             pass
+
+
+class ChunkingTests(SimpleTestCase):
+    def test_chunks_respect_token_limit_and_overlap(self):
+        sentences = [f"Sentence number {i} talks about vectors." for i in range(40)]
+        chunks = chunk_text(" ".join(sentences), max_tokens=30, overlap_tokens=8)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk.text), 30)
+            self.assertTrue(chunk.text.endswith("."))
+            self.assertIsNone(chunk.page_number)
+        # The last sentence of a chunk is repeated at the start of the next one
+        self.assertTrue(chunks[1].text.startswith(chunks[0].text.split(". ")[-1]))
+        self.assertEqual([c.chunk_index for c in chunks], list(range(len(chunks))))
+
+    def test_chunks_never_span_pages(self):
+        pages = ["First page. It is short.", "", "Third page text."]
+        chunks = chunk_pages(pages, max_tokens=100, overlap_tokens=10)
+
+        self.assertEqual([c.page_number for c in chunks], [1, 3])
+        self.assertEqual(chunks[0].text, pages[0])
+        self.assertEqual(
+            pages[2][chunks[1].char_start : chunks[1].char_end], "Third page text."
+        )
+
+    def test_oversized_sentence_is_split_on_words(self):
+        text = " ".join(["word"] * 25)
+        chunks = chunk_text(text, max_tokens=10, overlap_tokens=0)
+
+        self.assertEqual([estimate_tokens(c.text) for c in chunks], [10, 10, 5])
+        self.assertEqual(
+            text[chunks[1].char_start : chunks[1].char_end], chunks[1].text
+        )
+
+    def test_invalid_overlap_is_rejected(self):
+        with self.assertRaises(ValueError):
+            chunk_text("Some text.", max_tokens=10, overlap_tokens=10)
+
+
+class PdfExtractionTests(TestCase):
+    def setUp(self):
+        self.pages = [
+            f"Page {n} covers topic {n}.\nIt has a second line." for n in range(1, 7)
+        ]
+        self.data = synthetic_pdf(self.pages)
+
+    def test_pages_are_yielded_in_order(self):
+        pages = iter_pdf_pages(self.data)
+
+        self.assertIn("Page 1 covers topic 1.", next(pages))
+        self.assertEqual(len(list(pages)), 5)
+
+    @patch("AI.pdf.PDF_PARALLEL_MIN_PAGES", 2)
+    def test_process_pool_matches_in_process_extraction(self):
+        serial = list(iter_pdf_pages(self.data, workers=1))
+        parallel = list(iter_pdf_pages(self.data, workers=2, pages_per_task=4))
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(
+            [c.page_number for c in iter_chunks(parallel)], [1, 2, 3, 4, 5, 6]
+        )
+
+    @patch("AI.services.EMBEDDING_BATCH_SIZE", 2)
+    @patch("AI.services.generate_embeddings")
+    def test_pdf_is_embedded_while_pages_stream_in(self, mock_embeddings):
+        mock_embeddings.side_effect = lambda texts, **kw: [[0.1] * 768 for _ in texts]
+        user = User.objects.create_user(username="reader", password="pass")
+        doc = Document.objects.create(
+            user=user, filename="book.pdf", file_type="application/pdf"
+        )
+
+        self.assertEqual(index_document(doc, self.data, "application/pdf"), 6)
+
+        self.assertEqual(mock_embeddings.call_count, 3)
+        self.assertEqual(
+            list(
+                doc.embeddings.values_list("page_number", flat=True).order_by(
+                    "chunk_index"
+                )
+            ),
+            [1, 2, 3, 4, 5, 6],
+        )
+
+
+class DocumentIngestionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="student", password="pass")
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def upload(self, text):
+        upload = SimpleUploadedFile("notes.txt", text.encode(), "text/plain")
+        return self.api.post(reverse("document-list-create"), {"file": upload})
+
+    @patch("AI.services.generate_embeddings")
+    def test_text_upload_is_queued_then_stored_as_chunks(self, mock_embeddings):
+        mock_embeddings.side_effect = lambda texts, **kw: [[0.1] * 768 for _ in texts]
+        text = " ".join(f"Topic {i} is explained here." for i in range(300))
+
+        response = self.upload(text)
+
+        self.assertEqual(response.status_code, 202)
+        doc = Document.objects.get(pk=response.data["id"])
+        self.assertEqual(doc.status, "processing")
+        mock_embeddings.assert_not_called()
+
+        job = claim_job("test-worker")
+        self.assertTrue(run_job(job))
+
+        doc.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual(doc.status, "indexed")
+        self.assertEqual((job.status, bytes(job.payload)), ("done", b""))
+        rows = list(doc.embeddings.order_by("chunk_index"))
+        self.assertGreater(len(rows), 1)
+        self.assertTrue(all(row.owner_id == self.user.id for row in rows))
+        mock_embeddings.assert_called_once()
+        for row in rows:
+            self.assertEqual(text[row.char_start : row.char_end], row.text)
+
+    def test_unsupported_upload_is_rejected(self):
+        upload = SimpleUploadedFile("image.png", b"png", "image/png")
+        response = self.api.post(reverse("document-list-create"), {"file": upload})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IngestionJob.objects.exists())
+
+    @patch("AI.services.CHUNK_OVERLAP_TOKENS", 0)
+    @patch("AI.services.CHUNK_MAX_TOKENS", 12)
+    @patch("AI.services.generate_embeddings")
+    def test_replaced_document_only_embeds_changed_chunks(self, mock_embeddings):
+        mock_embeddings.side_effect = lambda texts, **kw: [[0.1] * 768 for _ in texts]
+        sentences = [f"Topic {i} is explained here." for i in range(10)]
+        response = self.upload(" ".join(sentences))
+        run_job(claim_job("test-worker"))
+        doc = Document.objects.get(pk=response.data["id"])
+        before = {row.text: row.pk for row in doc.embeddings.all()}
+        self.assertEqual(len(before), 5)
+        mock_embeddings.reset_mock()
+
+        # Edit one sentence and drop the last chunk
+        sentences[4] = "Topic 4 was rewritten entirely."
+        upload = SimpleUploadedFile(
+            "notes-v2.txt", " ".join(sentences[:8]).encode(), "text/plain"
+        )
+        response = self.api.put(
+            reverse("document-replace", args=[doc.pk]), {"file": upload}
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(run_job(claim_job("test-worker")))
+
+        mock_embeddings.assert_called_once()
+        self.assertEqual(
+            mock_embeddings.call_args.args[0],
+            ["Topic 4 was rewritten entirely. Topic 5 is explained here."],
+        )
+        doc.refresh_from_db()
+        self.assertEqual((doc.filename, doc.status), ("notes-v2.txt", "indexed"))
+        rows = list(doc.embeddings.order_by("chunk_index"))
+        self.assertEqual([row.chunk_index for row in rows], [0, 1, 2, 3])
+        self.assertEqual(rows[0].pk, before[rows[0].text])
+        self.assertEqual(rows[3].pk, before[rows[3].text])
+        self.assertNotIn(rows[2].text, before)
+        self.assertTrue(all(row.content_hash == chunk_hash(row.text) for row in rows))
+
+    @patch("AI.services.generate_embeddings", side_effect=RuntimeError("down"))
+    def test_failed_jobs_are_retried_then_marked_failed(self, mock_embeddings):
+        doc = Document.objects.get(pk=self.upload("Some notes.").data["id"])
+
+        for attempt in range(1, 4):
+            job = claim_job("test-worker")
+            self.assertEqual(job.attempts, attempt)
+            self.assertFalse(run_job(job))
+            job.refresh_from_db()
+            self.assertEqual(job.last_error, "down")
+            # Skip the retry backoff
+            IngestionJob.objects.update(available_at=timezone.now())
+
+        doc.refresh_from_db()
+        self.assertEqual((job.status, doc.status), ("failed", "failed"))
+        self.assertIsNone(claim_job("test-worker"))
+
+    @patch("AI.services.generate_embeddings")
+    def test_older_upload_never_overwrites_a_newer_one(self, mock_embeddings):
+        doc = Document.objects.get(pk=self.upload("First draft.").data["id"])
+        first = claim_job("slow-worker")
+
+        def replace_while_embedding(texts, **kw):
+            # The first job is still embedding when the edited file comes in
+            # and is indexed by another worker
+            if texts == ["First draft."]:
+                upload = SimpleUploadedFile("v2.txt", b"Final text.", "text/plain")
+                self.api.put(
+                    reverse("document-replace", args=[doc.pk]), {"file": upload}
+                )
+                first.refresh_from_db()
+                self.assertEqual(first.status, "superseded")
+                self.assertTrue(run_job(claim_job("fast-worker")))
+            return [[0.1] * 768 for _ in texts]
+
+        mock_embeddings.side_effect = replace_while_embedding
+        self.assertFalse(run_job(first))
+
+        doc.refresh_from_db()
+        self.assertEqual(doc.status, "indexed")
+        self.assertEqual(
+            list(doc.embeddings.values_list("text", flat=True)), ["Final text."]
+        )
+        self.assertEqual(
+            sorted(IngestionJob.objects.values_list("status", flat=True)),
+            ["done", "superseded"],
+        )
+
+    @patch("AI.services.generate_embeddings", side_effect=RuntimeError("down"))
+    def test_retrying_jobs_are_superseded_by_a_new_upload(self, mock_embeddings):
+        doc = Document.objects.get(pk=self.upload("Some notes.").data["id"])
+        self.assertFalse(run_job(claim_job("test-worker")))
+        upload = SimpleUploadedFile("v2.txt", b"New notes.", "text/plain")
+        self.api.put(reverse("document-replace", args=[doc.pk]), {"file": upload})
+        IngestionJob.objects.update(available_at=timezone.now())
+
+        job = claim_job("test-worker")
+        self.assertEqual(bytes(job.payload), b"New notes.")
+        self.assertIsNone(claim_job("test-worker"))
+
+    def test_expired_claims_become_visible_again(self):
+        self.upload("Some notes.")
+
+        job = claim_job("crashed-worker", visibility_timeout=60)
+        self.assertIsNone(claim_job("other-worker"))
+
+        IngestionJob.objects.update(available_at=timezone.now())
+        reclaimed = claim_job("other-worker")
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (job.pk, 2))
+        # The crashed worker can no longer complete the job
+        self.assertFalse(_finish(job, status=IngestionJob.STATUS_DONE))
+
+
+class BulkIngestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="librarian", password="pass")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.files = {
+            "week1.txt": b"Cells are the unit of life. Membranes protect them.",
+            "sub/week2.pdf": synthetic_pdf(
+                ["Enzymes speed up reactions.", "Page two."]
+            ),
+            "cover.png": b"not a document",
+        }
+
+    def write_tree(self):
+        for name, data in self.files.items():
+            path = os.path.join(self.tmp.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        return self.tmp.name
+
+    def write_zip(self):
+        path = os.path.join(self.tmp.name, "course.zip")
+        with zipfile.ZipFile(path, "w") as archive:
+            for name, data in self.files.items():
+                archive.writestr(name, data)
+        return path
+
+    @patch("AI.management.commands.ingest.generate_embeddings")
+    def test_directory_and_zip_are_bulk_ingested(self, mock_embeddings):
+        mock_embeddings.side_effect = lambda texts, **kw: [[0.1] * 768 for _ in texts]
+
+        for source in (self.write_tree(), self.write_zip()):
+            out = StringIO()
+            call_command(
+                "ingest",
+                source,
+                "--user",
+                "librarian",
+                "--parse-workers",
+                "1",
+                "--insert-batch",
+                "1",
+                stdout=out,
+            )
+            self.assertIn("2 documents, 3 chunks", out.getvalue())
+            self.assertIn("docs/s", out.getvalue())
+
+        docs = Document.objects.filter(user=self.user)
+        self.assertEqual(docs.count(), 4)
+        self.assertEqual(set(docs.values_list("status", flat=True)), {"indexed"})
+        rows = TextEmbedding.objects.filter(owner=self.user)
+        self.assertEqual(rows.count(), 6)
+        self.assertEqual(
+            sorted(
+                rows.exclude(page_number=None).values_list("page_number", flat=True)
+            ),
+            [1, 1, 2, 2],
+        )
+
+
+class EmbeddingServiceTests(TestCase):
+    def setUp(self):
+        embedding_cache.clear()
+
+    @patch("AI.services.get_ollama_client")
+    def test_generate_embeddings_batches_requests(self, mock_client):
+        mock_client.return_value.embed.side_effect = lambda model, input, **kw: {
+            "embeddings": [axis_vector(len(text)) for text in input]
+        }
+        texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+        embeddings = generate_embeddings(texts, batch_size=2)
+
+        self.assertEqual(embeddings, [axis_vector(len(text)) for text in texts])
+        self.assertEqual(mock_client.return_value.embed.call_count, 3)
+
+    @patch("AI.services.get_ollama_client")
+    def test_cached_embeddings_skip_ollama(self, mock_client):
+        embed = mock_client.return_value.embed
+        embed.side_effect = lambda model, input, **kw: {
+            "embeddings": [axis_vector(len(text)) for text in input]
+        }
+
+        first = generate_embeddings(["one", "three", "one"])
+        self.assertEqual(embed.call_args.kwargs["input"], ["one", "three"])
+        self.assertEqual(embedding_cache.stats()["misses"], 3)
+
+        # Memory tier, with whitespace differences normalized away
+        self.assertEqual(generate_embedding("  one\n"), first[0])
+        self.assertEqual(embed.call_count, 1)
+
+        # Database tier survives a cold process cache
+        embedding_cache.memory.clear()
+        self.assertEqual(generate_embedding("three"), first[1])
+        self.assertEqual(embed.call_count, 1)
+
+        stats = embedding_cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["db_hits"]), (1, 1))
+        self.assertEqual(EmbeddingCacheEntry.objects.count(), 2)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.user = User.objects.create_user(username="teacher", password="pass")
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_repeated_summaries_are_served_from_cache(self, mock_client):
+        generate = mock_client.return_value.generate = AsyncMock(
+            return_value={"response": "A short summary."}
+        )
+
+        first = self.api.post(reverse("summarize-text"), {"text": "The handout."})
+        second = self.api.post(reverse("summarize-text"), {"text": " The  handout.\n"})
+
+        self.assertEqual(first.data, {"summary": "A short summary.", "cached": False})
+        self.assertEqual(second.data, {"summary": "A short summary.", "cached": True})
+        self.assertEqual(generate.call_count, 1)
+
+        # Database tier survives a cold process cache
+        response_cache.memory.clear()
+        self.assertTrue(summarize_text("The handout.").cached)
+        # Quizzes of the same text are a different task
+        self.api.post(reverse("generate-quiz"), {"text": "The handout."})
+        self.assertEqual(generate.call_count, 2)
+
+        bypassed = self.api.post(
+            reverse("summarize-text"), {"text": "The handout.", "no_cache": "true"}
+        )
+        self.assertFalse(bypassed.data["cached"])
+        self.assertEqual(generate.call_count, 3)
+        stats = response_cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["db_hits"]), (1, 1))
+
+    @patch("AI.services.get_ollama_client")
+    def test_expired_and_overflowing_entries_are_evicted(self, mock_client):
+        mock_client.return_value.generate.side_effect = lambda **kw: {
+            "response": kw["prompt"]
+        }
+        for i in range(3):
+            summarize_text(f"Text {i}")
+
+        with patch.object(response_cache, "max_entries", 2):
+            response_cache.prune()
+        # The oldest entry is dropped first
+        self.assertEqual(
+            sorted(ResponseCacheEntry.objects.values_list("response", flat=True)),
+            [summarize_prompt("Text 1"), summarize_prompt("Text 2")],
+        )
+
+        response_cache.memory.clear()
+        ResponseCacheEntry.objects.update(expires_at=timezone.now())
+        self.assertFalse(summarize_text("Text 1").cached)
+        response_cache.prune()
+        self.assertEqual(ResponseCacheEntry.objects.count(), 1)
+
+
+class StreamingGenerationTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.user = User.objects.create_user(username="streamer", password="pass")
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def read_ndjson(self, response):
+        return [json.loads(line) for line in read_stream(response).split(b"\n") if line]
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_summary_tokens_are_streamed_then_replayed_from_cache(self, mock_client):
+        generate = mock_client.return_value.generate = AsyncMock()
+        generate.return_value = async_frames(
+            [
+                {"response": "Short", "done": False},
+                {"response": " summary.", "done": False},
+                {"response": "", "done": True, "eval_count": 2, "eval_duration": 10},
+            ]
+        )
+
+        response = self.api.post(
+            reverse("summarize-text"), {"text": "The handout.", "stream": True}
+        )
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        frames = self.read_ndjson(response)
+        self.assertEqual(
+            [f.get("response") for f in frames[:2]], ["Short", " summary."]
+        )
+        self.assertEqual(
+            (frames[-1]["done"], frames[-1]["cached"], frames[-1]["eval_count"]),
+            (True, False, 2),
+        )
+        self.assertIn("first_frame_ms", frames[-1]["timings"])
+        self.assertTrue(generate.call_args.kwargs["stream"])
+
+        # The streamed summary was cached for blocking requests too
+        cached = self.api.post(reverse("summarize-text"), {"text": "The handout."})
+        self.assertEqual(cached.data, {"summary": "Short summary.", "cached": True})
+        self.assertEqual(generate.call_count, 1)
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_quiz_is_streamed_as_server_sent_events(self, mock_client):
+        mock_client.return_value.generate = AsyncMock(
+            return_value=async_frames(
+                [{"response": "Q1?", "done": False}, {"response": "", "done": True}]
+            )
+        )
+
+        response = self.api.post(
+            reverse("generate-quiz"), {"text": "The handout.", "stream": "sse"}
+        )
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = read_stream(response).decode().split("\n\n")
+        self.assertEqual(
+            json.loads(events[0].removeprefix("data: ")), {"response": "Q1?"}
+        )
+        self.assertTrue(json.loads(events[1].removeprefix("data: "))["done"])
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_uploaded_pdf_summary_is_streamed_from_the_event_loop(self, mock_client):
+        generate = mock_client.return_value.generate = AsyncMock(
+            return_value=async_frames(
+                [
+                    {"response": "Mitosis.", "done": False},
+                    {"response": "", "done": True},
+                ]
+            )
+        )
+        upload = SimpleUploadedFile(
+            "notes.pdf", synthetic_pdf(["Cells divide by mitosis."]), "application/pdf"
+        )
+
+        response = self.api.post(
+            reverse("upload-pdf"), {"pdf_file": upload, "stream": "true"}
+        )
+
+        # Django would buffer a sync iterator under ASGI
+        self.assertTrue(response.is_async)
+        frames = self.read_ndjson(response)
+        self.assertEqual(frames[0], {"response": "Mitosis."})
+        self.assertTrue(frames[-1]["done"])
+        self.assertIn("Cells divide by mitosis.", generate.call_args.kwargs["prompt"])
+
+
+def async_frames(frames):
+    async def iterate():
+        for frame in frames:
+            yield frame
+
+    return iterate()
+
+
+def read_stream(response):
+    async def read():
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    return async_to_sync(read)()
+
+
+class AsyncClientTests(SimpleTestCase):
+    def test_ollama_client_is_shared_within_an_event_loop(self):
+        async def clients():
+            return get_async_ollama_client(), get_async_ollama_client()
+
+        first, second = async_to_sync(clients)()
+        self.assertIs(first, second)
+        self.assertIsNot(async_to_sync(clients)()[0], first)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(flights.do, "key", work) for _ in range(3)]
+            while flights.in_flight() == 0:
+                time.sleep(0.01)
+            time.sleep(0.05)
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("answer", False)] * 2 + [("answer", True)])
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_errors_reach_every_caller(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError("down")
+
+        with self.assertRaises(ValueError):
+            flights.do("key", fail)
+        self.assertEqual(flights.do("key", lambda: 1), (1, True))
+
+    def test_stream_followers_join_mid_way(self):
+        flights = SingleFlight()
+        release = threading.Event()
+
+        def source():
+            yield {"response": "a"}
+            release.wait(5)
+            yield {"response": "b"}
+
+        frames, leader = flights.stream("key", source)
+        self.assertEqual(next(frames), {"response": "a"})
+        late, late_leader = flights.stream("key", source)
+        release.set()
+        self.assertTrue(leader)
+        self.assertFalse(late_leader)
+        self.assertEqual(list(frames), [{"response": "b"}])
+        self.assertEqual(list(late), [{"response": "a"}, {"response": "b"}])
+
+    def test_async_streams_are_shared_within_an_event_loop(self):
+        flights = AsyncSingleFlight()
+        produced = []
+
+        async def source():
+            for piece in "abc":
+                produced.append(piece)
+                yield {"response": piece}
+                await asyncio.sleep(0)
+
+        async def read(frames):
+            return [frame["response"] async for frame in frames]
+
+        async def run():
+            first, _ = flights.stream("key", source)
+            head = await anext(first)
+            second, leader = flights.stream("key", source)
+            self.assertFalse(leader)
+            return [head["response"], *await read(first)], await read(second)
+
+        first, second = async_to_sync(run)()
+        self.assertEqual(first, ["a", "b", "c"])
+        self.assertEqual(second, ["a", "b", "c"])
+        self.assertEqual(produced, ["a", "b", "c"])
+
+    def test_abandoned_streams_stop_their_source(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        closed = threading.Event()
+        produced = []
+
+        def source():
+            try:
+                for piece in "abc":
+                    produced.append(piece)
+                    yield {"response": piece}
+                    release.wait(5)
+            finally:
+                closed.set()
+
+        frames, _ = flights.stream("key", source)
+        late, _ = flights.stream("key", source)
+        self.assertEqual(next(frames), {"response": "a"})
+        frames.close()
+        self.assertEqual(next(late), {"response": "a"})
+        late.close()
+        release.set()
+
+        self.assertTrue(closed.wait(5))
+        self.assertEqual(produced, ["a", "b"])
+        self.assertEqual(flights.in_flight(), 0)
+        self.assertEqual(list(flights.stream("key", lambda: iter([{}]))[0]), [{}])
+
+    def test_abandoned_async_streams_cancel_their_source(self):
+        flights = AsyncSingleFlight()
+        closed = []
+
+        async def source():
+            try:
+                yield {"response": "a"}
+                await asyncio.Event().wait()  # A generation that never ends
+            finally:
+                closed.append(True)
+
+        async def run():
+            frames, _ = flights.stream("key", source)
+            await anext(frames)
+            await frames.aclose()
+            for _ in range(3):
+                await asyncio.sleep(0)
+            return flights.in_flight()
+
+        self.assertEqual(async_to_sync(run)(), 0)
+        self.assertEqual(closed, [True])
+
+
+class AdmissionControlTests(TestCase):
+    def test_the_limit_is_split_between_worker_processes(self):
+        self.assertEqual(process_share(6, 3), 2)
+        # Every process keeps at least one slot
+        self.assertEqual(process_share(2, 3), 1)
+        self.assertEqual(process_share(4, 0), 4)
+
+    def test_queue_is_bounded_and_served_by_priority(self):
+        admission = AdmissionController(1, 2, queue_timeout=5)
+        admission.acquire()
+        order = []
+
+        def wait(priority):
+            with admission.slot(priority):
+                order.append(priority)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            batch = executor.submit(wait, PRIORITY_BATCH)
+            while admission.stats()["queued"] < 1:
+                time.sleep(0.01)
+            executor.submit(wait, PRIORITY_BATCH)
+            while admission.stats()["queued"] < 2:
+                time.sleep(0.01)
+            # A full queue turns away equal priorities, but an interactive
+            # request pushes out the newest batch one
+            with self.assertRaises(Overloaded):
+                admission.acquire(PRIORITY_BATCH)
+            interactive = executor.submit(wait, PRIORITY_INTERACTIVE)
+            while admission.stats()["rejected"] < 2:
+                time.sleep(0.01)
+            admission.release()
+            interactive.result()
+            batch.result()
+
+        self.assertEqual(order, [PRIORITY_INTERACTIVE, PRIORITY_BATCH])
+        self.assertEqual(admission.stats()["active"], 0)
+
+    def test_waiting_coroutines_time_out(self):
+        admission = AdmissionController(1, 1, queue_timeout=0.05)
+        admission.acquire()
+
+        async def wait():
+            async with admission.aslot():
+                pass
+
+        with self.assertRaises(Overloaded):
+            async_to_sync(wait)()
+        admission.release()
+        async_to_sync(wait)()
+        self.assertEqual(admission.stats()["queued"], 0)
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_overloaded_requests_get_429_with_retry_after(self, mock_client):
+        mock_client.return_value.generate = AsyncMock()
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username="u", password="p"))
+        full = AdmissionController(1, 0, queue_timeout=1)
+        full.acquire()
+
+        with patch("AI.async_services.ollama_admission", full), patch(
+            "AI.views.ollama_admission", full
+        ):
+            response = api.post(reverse("generate-quiz"), {"text": "Cells."})
+            streamed = api.post(
+                reverse("generate-quiz"), {"text": "Cells.", "stream": "true"}
+            )
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(streamed.status_code, 429)
+        mock_client.return_value.generate.assert_not_called()
+
+
+class StubOllama(ThreadingHTTPServer):
+    """
+    A local stand-in for an Ollama server with the given models loaded.
+    """
+
+    def __init__(self, name: str, models: list[str]):
+        self.name = name
+        self.models = models
+        self.generations = 0
+        super().__init__(("127.0.0.1", 0), StubOllamaHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.reply({"models": [{"name": model} for model in self.server.models]})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.generations += 1
+        self.reply(
+            {
+                "model": request["model"],
+                "created_at": "2026-01-01T00:00:00Z",
+                "response": f"from {self.server.name}",
+                "done": True,
+            }
+        )
+
+
+class OllamaLoadBalancingTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.stubs = [
+            StubOllama("a", ["llama3.2:latest"]),
+            StubOllama("b", ["mistral:latest"]),
+        ]
+        for stub in self.stubs:
+            self.addCleanup(stub.server_close)
+            self.addCleanup(stub.shutdown)
+        with socket.socket() as unused:
+            unused.bind(("127.0.0.1", 0))
+            self.dead_url = f"http://127.0.0.1:{unused.getsockname()[1]}"
+        self.pool = HostPool(
+            [stub.url for stub in self.stubs] + [self.dead_url], health_interval=0
+        )
+
+    def test_health_checks_eject_dead_hosts_and_learn_resident_models(self):
+        for _ in range(OLLAMA_HEALTH_FAILURES):
+            self.pool.check_health()
+
+        stats = {host["url"]: host for host in self.pool.stats()}
+        self.assertFalse(stats[self.dead_url]["healthy"])
+        self.assertEqual(stats[self.stubs[1].url]["resident"], ["mistral:latest"])
+        picked = {self.pool.pick().url for _ in range(4)}
+        self.assertNotIn(self.dead_url, picked)
+
+    def test_routes_to_resident_model_then_least_outstanding(self):
+        for _ in range(OLLAMA_HEALTH_FAILURES):
+            self.pool.check_health()
+        a, b = (stub.url for stub in self.stubs)
+
+        # A cold host counts as OLLAMA_COLD_PENALTY (2) outstanding requests
+        self.assertEqual(self.pool.pick("mistral").url, b)
+        self.assertEqual(self.pool.pick("mistral").url, b)
+        self.assertEqual(self.pool.pick("llama3.2").url, a)
+        self.assertEqual(self.pool.pick("mistral").url, b)
+        self.assertEqual(self.pool.pick().url, a)
+
+    def test_service_functions_are_served_by_the_chosen_host(self):
+        for _ in range(OLLAMA_HEALTH_FAILURES):
+            self.pool.check_health()
+        with patch("AI.services.ollama_hosts", self.pool):
+            answer = cached_generate("quiz", "Cells?", model="mistral")
+
+        self.assertEqual(answer.text, "from b")
+        self.assertEqual((self.stubs[0].generations, self.stubs[1].generations), (0, 1))
+        self.assertEqual(sum(host["outstanding"] for host in self.pool.stats()), 0)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def failing(self):
+        raise ConnectionError("backend down")
+
+    def test_breaker_opens_on_errors_and_recovers_through_a_probe(self):
+        breaker = CircuitBreaker("test", window=4, min_calls=4, cooldown=0.05)
+        for _ in range(2):
+            breaker.call(lambda: "ok")
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                breaker.call(self.failing)
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.call(lambda: "ok")
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.stats()["short_circuited"], 1)
+
+    def test_fallback_skips_failed_and_open_backends(self):
+        broken = CircuitBreaker("broken", min_calls=1)
+        with self.assertRaises(ConnectionError):
+            broken.call(self.failing)
+        flaky = CircuitBreaker("flaky")
+        healthy = CircuitBreaker("healthy")
+
+        result = call_with_fallback(
+            [
+                (broken, lambda: "broken"),
+                (flaky, self.failing),
+                (healthy, lambda: "healthy"),
+            ]
+        )
+        self.assertEqual(result, "healthy")
+        self.assertEqual(flaky.failures, 1)
+        self.assertEqual(broken.stats()["short_circuited"], 1)
+
+    @patch("AI.breaker.HEDGE_DEFAULT_DELAY", 0.05)
+    def test_hedging_takes_the_first_answer(self):
+        stalled = threading.Event()
+        self.addCleanup(stalled.set)
+        primary = CircuitBreaker("primary")
+        secondary = CircuitBreaker("secondary")
+
+        def slow():
+            stalled.wait(5)
+            return "slow"
+
+        backends = [(primary, slow), (secondary, lambda: "fast")]
+        start = time.monotonic()
+        self.assertEqual(call_with_fallback(backends, hedge=True), "fast")
+        self.assertLess(time.monotonic() - start, 1)
+
+
+def quiz_question(question, answer="Mitochondria"):
+    return {
+        "question": question,
+        "options": ["Nucleus", "Mitochondria", "Ribosome", "Golgi"],
+        "correctAnswer": answer,
+        "explanation": "",
+    }
+
+
+class StructuredOutputTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(
+            User.objects.create_user(username="student", password="pass")
+        )
+
+    def test_answers_given_as_letters_or_other_case_are_repaired(self):
+        self.assertEqual(
+            QuizQuestion.model_validate(quiz_question("Q?", "b")).correct_answer,
+            "Mitochondria",
+        )
+        self.assertEqual(
+            QuizQuestion.model_validate(
+                quiz_question("Q?", " MITOCHONDRIA")
+            ).correct_answer,
+            "Mitochondria",
+        )
+        items = validate_items(
+            [quiz_question("Q?", "Cytoplasm"), quiz_question("Q?", "B) Ribosome")],
+            QUIZ,
+        )
+        self.assertEqual(items, [])
+
+    def test_items_before_a_truncated_reply_are_kept(self):
+        complete = json.dumps(
+            {"questions": [quiz_question("Q1?"), quiz_question("Q2?")]}
+        )
+        raw = parse_items(complete[:-40], "questions")
+        self.assertEqual([item["question"] for item in raw], ["Q1?"])
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_only_invalid_items_are_generated_again(self, mock_client):
+        first = {
+            "questions": [
+                quiz_question("What makes ATP?"),
+                quiz_question("What makes ATP?"),  # Duplicate
+                quiz_question("Where is DNA?", "Cytoplasm"),  # Not an option
+            ]
+        }
+        second = {"questions": [quiz_question("Where is DNA?", "A")]}
+        generate = mock_client.return_value.generate = AsyncMock(
+            side_effect=[
+                {"response": json.dumps(first)},
+                {"response": json.dumps(second)},
+            ]
+        )
+
+        response = self.api.post(
+            reverse("structured-quiz"), {"text": "Cells.", "count": 2}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(q["question"], q["correctAnswer"]) for q in response.data["questions"]],
+            [("What makes ATP?", "Mitochondria"), ("Where is DNA?", "Nucleus")],
+        )
+        self.assertEqual(
+            (response.data["complete"], response.data["generations"]), (True, 2)
+        )
+        schema = generate.call_args_list[1].kwargs["format"]
+        self.assertEqual(schema["properties"]["questions"]["maxItems"], 1)
+        self.assertIn("what makes atp?", generate.call_args_list[1].kwargs["prompt"])
+
+        cached = self.api.post(
+            reverse("structured-quiz"), {"text": "Cells.", "count": 2}, format="json"
+        )
+        self.assertEqual(cached.data["questions"], response.data["questions"])
+        self.assertTrue(cached.data["cached"])
+        self.assertEqual(generate.call_count, 2)
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_flashcards_are_typed(self, mock_client):
+        cards = {"flashcards": [{"front": "ATP", "back": "Energy currency"}, {}]}
+        mock_client.return_value.generate = AsyncMock(
+            return_value={"response": json.dumps(cards)}
+        )
+
+        with patch("AI.structured.STRUCTURED_RETRIES", 0):
+            response = self.api.post(
+                reverse("generate-flashcards"), {"text": "Cells.", "count": 2}
+            )
+
+        self.assertEqual(
+            response.data["flashcards"], [{"front": "ATP", "back": "Energy currency"}]
+        )
+        self.assertFalse(response.data["complete"])
+
+    @patch("AI.services.get_ollama_client")
+    def test_sync_generation_shares_the_retry_loop(self, mock_client):
+        replies = [
+            {"flashcards": [{"front": "ATP", "back": "Energy"}, {"front": "ATP"}]},
+            {"flashcards": [{"front": "DNA", "back": "Genes"}]},
+        ]
+        generate = mock_client.return_value.generate
+        generate.side_effect = [{"response": json.dumps(r)} for r in replies]
+
+        result = generate_structured(FLASHCARDS, "Cells.", 2)
+
+        self.assertEqual([card.front for card in result.items], ["ATP", "DNA"])
+        self.assertEqual((result.complete, result.generations), (True, 2))
+        self.assertEqual(
+            generate.call_args.kwargs["format"]["properties"]["flashcards"]["maxItems"],
+            1,
+        )
+        self.assertTrue(generate_structured(FLASHCARDS, "Cells.", 2).cached)
+
+
+def chat_reply(text):
+    return async_frames(
+        [
+            {"message": {"content": text}, "done": False},
+            {"message": {"content": ""}, "done": True, "prompt_eval_count": 1},
+        ]
+    )
+
+
+class ChatSessionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="chatter", password="pass")
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.session_id = self.api.post(
+            reverse("chat-session-list-create"), {"title": "Biology"}
+        ).data["id"]
+
+    def say(self, content, **extra):
+        return self.api.post(
+            reverse("chat-message", args=[self.session_id]),
+            {"content": content, **extra},
+        )
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_turns_extend_the_same_prompt_prefix(self, mock_client):
+        chat = mock_client.return_value.chat = AsyncMock(
+            side_effect=[chat_reply("ATP."), chat_reply("In mitochondria.")]
+        )
+
+        first = self.say("What stores energy?")
+        read_stream(self.say("Where is it made?", stream=True))
+
+        self.assertEqual(first.data["reply"], "ATP.")
+        sent = [call.kwargs["messages"] for call in chat.call_args_list]
+        self.assertEqual(sent[1][: len(sent[0])], sent[0])
+        self.assertEqual(
+            sent[1][len(sent[0]) :],
+            [
+                {"role": "assistant", "content": "ATP."},
+                {"role": "user", "content": "Where is it made?"},
+            ],
+        )
+        detail = self.api.get(reverse("chat-session-detail", args=[self.session_id]))
+        self.assertEqual(
+            [m["content"] for m in detail.data["messages"]],
+            ["What stores energy?", "ATP.", "Where is it made?", "In mitochondria."],
+        )
+
+    @patch("AI.services.get_ollama_client")
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_history_over_budget_is_compacted_in_the_background(
+        self, mock_async_client, mock_client
+    ):
+        mock_async_client.return_value.chat = AsyncMock(
+            side_effect=lambda **kwargs: chat_reply("Noted, go on.")
+        )
+        mock_client.return_value.generate.return_value = {"response": "Cells: ATP."}
+
+        with patch("AI.chat.CHAT_HISTORY_TOKENS", 20), patch(
+            "AI.chat.CHAT_RECENT_TOKENS", 12
+        ), patch("AI.chat.schedule_compaction") as schedule:
+            self.say("Cells make ATP in their mitochondria.")
+            schedule.assert_not_called()
+            self.say("Ribosomes build proteins from amino acids.")
+            schedule.assert_called_once_with(self.session_id)
+            self.assertTrue(compact_session(self.session_id))
+
+        session = ChatSession.objects.get(pk=self.session_id)
+        self.assertEqual(session.summary, "Cells: ATP.")
+        self.assertEqual(
+            list(
+                session.messages.filter(compacted=False).values_list("role", "content")
+            ),
+            [
+                ("user", "Ribosomes build proteins from amino acids."),
+                ("assistant", "Noted, go on."),
+            ],
+        )
+        summary_prompt = mock_client.return_value.generate.call_args.kwargs["prompt"]
+        self.assertIn("User: Cells make ATP", summary_prompt)
+
+        self.say("And lysosomes?")
+        messages = mock_async_client.return_value.chat.call_args.kwargs["messages"]
+        self.assertIn("Cells: ATP.", messages[0]["content"])
+        self.assertEqual(len(messages), 4)
+
+    def test_sessions_stick_to_one_host(self):
+        pool = HostPool(["http://a", "http://b", "http://c"], health_interval=0)
+        home = pool.pick(affinity="chat:1")
+        pool.release(home)
+        self.assertEqual(
+            {pool.pick(affinity="chat:1").url for _ in range(pool.cold_penalty + 1)},
+            {home.url},
+        )
+        # Busier than the others by more than the cold penalty
+        self.assertNotEqual(pool.pick(affinity="chat:1").url, home.url)
+
+    def test_other_users_sessions_are_not_found(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="o", password="p"))
+        response = other.post(
+            reverse("chat-message", args=[self.session_id]), {"content": "Hi"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class TokenMetricsTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.metrics = TokenMetrics(cold_load_seconds=1)
+
+    @patch("AI.services.get_ollama_client")
+    def test_counters_are_summed_per_model_and_task(self, mock_client):
+        mock_client.return_value.generate.side_effect = [
+            {
+                "response": "Q1?",
+                "load_duration": 3_000_000_000,  # Cold
+                "prompt_eval_count": 400,
+                "prompt_eval_duration": 500_000_000,
+                "eval_count": 50,
+                "eval_duration": 1_000_000_000,
+                "total_duration": 4_500_000_000,
+            },
+            {
+                "response": "Q2?",
+                "load_duration": 5_000_000,
+                "prompt_eval_count": 200,
+                "prompt_eval_duration": 500_000_000,
+                "eval_count": 150,
+                "eval_duration": 2_000_000_000,
+                "total_duration": 2_505_000_000,
+            },
+        ]
+        mock_client.return_value.embed.return_value = {
+            "embeddings": [[0.0] * 768],
+            "prompt_eval_count": 10,
+            "total_duration": 100_000_000,
+        }
+
+        with patch("AI.services.token_metrics", self.metrics):
+            cached_generate("quiz", "Cells 1", model="llama3.2")
+            cached_generate("quiz", "Cells 2", model="llama3.2")
+            generate_embeddings(["Cells"], use_cache=False)
+
+        stats = self.metrics.stats()
+        quiz = stats["by_task"][0]
+        self.assertEqual((quiz["model"], quiz["task"]), ("llama3.2", "quiz"))
+        self.assertEqual((quiz["prompt_tokens"], quiz["output_tokens"]), (600, 200))
+        self.assertEqual(quiz["prefill_tokens_per_second"], 600.0)
+        self.assertEqual(quiz["decode_tokens_per_second"], 66.7)
+        self.assertEqual(quiz["cold_load_rate"], 0.5)
+        embed = stats["by_task"][1]
+        self.assertEqual(embed["task"], "embed")
+        self.assertEqual(embed["prefill_tokens_per_second"], 100.0)
+        self.assertEqual(len(stats["by_model"]), 2)
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_streamed_generations_are_counted(self, mock_client):
+        mock_client.return_value.generate = AsyncMock(
+            return_value=async_frames(
+                [
+                    {"response": "Hi", "done": False},
+                    {
+                        "response": "",
+                        "done": True,
+                        "eval_count": 4,
+                        "eval_duration": 10**8,
+                    },
+                ]
+            )
+        )
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username="s", password="p"))
+
+        # Stream frames are shaped, and counted, by services._StreamFrames
+        with patch("AI.services.token_metrics", self.metrics):
+            read_stream(
+                api.post(reverse("summarize-text"), {"text": "Cells.", "stream": True})
+            )
+
+        (summary,) = self.metrics.stats()["by_task"]
+        self.assertEqual(summary["task"], "summarize")
+        self.assertEqual(summary["decode_tokens_per_second"], 40.0)
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_rag_answers_are_counted_as_their_own_task(self, mock_client):
+        mock_client.return_value.embed = AsyncMock(
+            return_value={"embeddings": [axis_vector(0)]}
+        )
+        mock_client.return_value.generate = AsyncMock(
+            side_effect=lambda **kwargs: (
+                async_frames([{"response": "", "done": True, "eval_count": 2}])
+                if kwargs.get("stream")
+                else {"response": "Answer", "eval_count": 3}
+            )
+        )
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username="r", password="p"))
+
+        with patch("AI.async_services.token_metrics", self.metrics), patch(
+            "AI.services.token_metrics", self.metrics
+        ):
+            api.post(reverse("hybrid-rag-query"), {"query": "What is RAG?"})
+            read_stream(
+                api.post(
+                    reverse("hybrid-rag-query"),
+                    {"query": "What is RAG?", "stream": True},
+                )
+            )
+
+        tasks = {row["task"]: row for row in self.metrics.stats()["by_task"]}
+        self.assertEqual(tasks["rag"]["requests"], 2)
+        self.assertEqual(tasks["rag"]["output_tokens"], 5)
+        self.assertNotIn("generate", tasks)
+
+    def test_proxied_streams_are_counted_at_their_final_frame(self):
+        lines = [
+            json.dumps({"response": 'Say "done":true', "done": False}),
+            "not json",
+            # Ollama writes compact JSON, one frame per line
+            json.dumps(
+                {"response": "", "done": True, "eval_count": 7}, separators=(",", ":")
+            ),
+        ]
+        with patch("AI.views.token_metrics", self.metrics):
+            for line in lines:
+                _record_proxy_frame("llama3.2", line)
+
+        (proxy,) = self.metrics.stats()["by_task"]
+        self.assertEqual((proxy["task"], proxy["requests"]), ("proxy", 1))
+        self.assertEqual(proxy["output_tokens"], 7)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class PrometheusMetricsTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(
+            User.objects.create_user(username="observer", password="pass")
+        )
+
+    def test_requests_are_timed_per_view_with_their_queries(self):
+        labels = {"view": "note-list", "method": "GET", "status": "2xx"}
+        before = sample("http_request_duration_seconds_count", **labels)
+        queries = sample("http_request_db_queries_sum", view="note-list")
+
+        self.api.get(reverse("note-list"))
+
+        self.assertEqual(
+            sample("http_request_duration_seconds_count", **labels), before + 1
+        )
+        self.assertGreater(
+            sample("http_request_db_queries_sum", view="note-list"), queries
+        )
+        self.assertEqual(sample("http_requests_in_flight", view="note-list"), 0)
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_async_views_count_cache_lookups_and_ollama_tokens(self, mock_client):
+        mock_client.return_value.generate = AsyncMock(
+            return_value={"response": "Q?", "eval_count": 3, "eval_duration": 10**8}
+        )
+        misses = sample("cache_lookups_total", cache="response", result="misses")
+        tokens = sample(
+            "ollama_tokens_total", model="llama3.2:latest", task="quiz", phase="output"
+        )
+        queries = sample("http_request_db_queries_sum", view="generate-quiz")
+
+        self.api.post(reverse("generate-quiz"), {"text": "Metrics."})
+
+        self.assertEqual(
+            sample("cache_lookups_total", cache="response", result="misses"),
+            misses + 1,
+        )
+        self.assertEqual(
+            sample(
+                "ollama_tokens_total",
+                model="llama3.2:latest",
+                task="quiz",
+                phase="output",
+            ),
+            tokens + 3,
+        )
+        self.assertGreater(
+            sample("http_request_db_queries_sum", view="generate-quiz"), queries
+        )
+
+    def test_metrics_endpoint_can_require_a_token(self):
+        self.assertIn(
+            b"http_request_duration_seconds", self.client.get("/metrics").content
+        )
+        with patch("AI.metrics.METRICS_TOKEN", "s3cret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 403)
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"ollama_admission_active", response.content)
+
+
+class TimingTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(
+            User.objects.create_user(username="timed", password="pass")
+        )
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_stages_are_reported_in_the_header_and_on_request(self, mock_client):
+        mock_client.return_value.generate = AsyncMock(return_value={"response": "Q?"})
+
+        response = self.api.post(reverse("generate-quiz"), {"text": "Timing."})
+        self.assertRegex(response["Server-Timing"], r"generate;dur=[\d.]+")
+        self.assertIn("total;dur=", response["Server-Timing"])
+        self.assertNotIn("timings", response.json())
+
+        response = self.api.post(
+            reverse("generate-quiz") + "?timings=true", {"text": "Timing again."}
+        )
+        timings = response.json()["timings"]
+        self.assertEqual(list(timings), ["generate", "total"])
+        self.assertGreaterEqual(timings["total"], timings["generate"])
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_streams_carry_the_stages_in_their_final_frame(self, mock_client):
+        mock_client.return_value.generate = AsyncMock(
+            return_value=async_frames(
+                [{"response": "Hi", "done": False}, {"response": "", "done": True}]
+            )
+        )
+
+        response = self.api.post(
+            reverse("summarize-text"), {"text": "Cells.", "stream": True}
+        )
+        frames = [json.loads(line) for line in read_stream(response).splitlines()]
+
+        self.assertIn("generate", frames[-1]["timings"])
+        self.assertIn("first_frame_ms", frames[-1]["timings"])
+
+    def test_each_request_logs_one_json_line(self):
+        with self.assertLogs("AI.timing", level="INFO") as logs:
+            self.api.get(reverse("note-list"))
+
+        (line,) = logs.output
+        record = json.loads(line.split(":", 2)[2])
+        self.assertEqual(
+            (record["method"], record["path"], record["status"]),
+            ("GET", reverse("note-list"), 200),
+        )
+        self.assertIn("total", record["timings_ms"])
+
+
+class LongTextSummaryTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+
+    @patch("AI.services.SUMMARY_CHUNK_TOKENS", 20)
+    @patch("AI.services.get_ollama_client")
+    def test_long_text_is_summarized_map_reduce(self, mock_client):
+        def generate(model, prompt, **kw):
+            self.assertLessEqual(estimate_tokens(prompt.split(":", 1)[1]), 20)
+            if "part of a longer text" in prompt:
+                first = re.search(r"Sentence (\d+)", prompt).group(1)
+                return {"response": f"Summary of {first}."}
+            return {"response": "Combined summary."}
+
+        generate_mock = mock_client.return_value.generate
+        generate_mock.side_effect = generate
+        # 7 tokens per sentence: 12 parts of 2 sentences
+        text = " ".join(f"Sentence {i} is about one topic." for i in range(24))
+
+        result = summarize_text(text, concurrency=3)
+
+        self.assertEqual(result.text, "Combined summary.")
+        self.assertFalse(result.cached)
+        # 12 parts, then 12 summaries of 4 tokens in groups of 5, 5 and 2, then 1
+        self.assertEqual(generate_mock.call_count, 16)
+        self.assertTrue(summarize_text(text).cached)
+        self.assertEqual(generate_mock.call_count, 16)
+
+    def test_summary_groups_always_shrink(self):
+        long = " ".join(["word"] * 30)
+        self.assertEqual(
+            [len(group) for group in _group_summaries([long] * 5, 20)], [2, 2, 1]
+        )
+
+
+def summarize_prompt(text):
+    return f"Summarize the following text concisely: {text}"
+
+
+def axis_vector(axis, weight=1.0):
+    vector = [0.0] * 768
+    vector[axis] = weight
+    return vector
+
+
+class VectorSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="searcher", password="pass")
+        self.doc = Document.objects.create(
+            user=self.user, filename="notes.txt", file_type="text/plain"
+        )
+
+    def test_ann_index_is_created(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = %s",
+                [VECTOR_INDEX_NAME],
+            )
+            (indexdef,) = cursor.fetchone()
+        self.assertIn("hnsw", indexdef)
+        self.assertIn("vector_cosine_ops", indexdef)
+
+    def test_search_orders_by_distance_and_sets_search_params(self):
+        for axis, text in enumerate(["alpha", "beta", "gamma"]):
+            TextEmbedding.objects.create(
+                document=self.doc, text=text, embedding=axis_vector(axis)
+            )
+        query = axis_vector(0)
+        query[1] = 0.9
+
+        with CaptureQueriesContext(connection) as queries:
+            results = search_similar_chunks(query, limit=5, ef_search=80, probes=3)
+
+        self.assertEqual([r.text for r in results], ["alpha", "beta"])
+        self.assertLess(results[0].distance, results[1].distance)
+        executed = [q["sql"] for q in queries.captured_queries]
+        self.assertIn("SET LOCAL hnsw.ef_search = 80", executed)
+        self.assertIn("SET LOCAL ivfflat.probes = 3", executed)
+
+    def test_invalid_search_params_are_rejected(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        for url, field in (
+            (reverse("search-embeddings"), "query_text"),
+            (reverse("hybrid-rag-query"), "query"),
+        ):
+            for params in ({"ef_search": "abc"}, {"probes": -1}, {"ef_search": 5000}):
+                response = api.post(url, {field: "cells", **params}, format="json")
+                self.assertEqual(response.status_code, 400, (url, params))
+                self.assertIn(next(iter(params)), response.json()["error"])
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_created_embeddings_are_searchable_by_their_creator(self, mock_client):
+        mock_client.return_value.embed = AsyncMock(
+            return_value={"embeddings": [axis_vector(7)]}
+        )
+        api = APIClient()
+        response = api.post(
+            reverse("create-embedding"), {"text": "Loose note"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        api.force_authenticate(self.user)
+        api.post(reverse("create-embedding"), {"text": "My note"}, format="json")
+
+        anonymous = TextEmbedding.objects.get(text="Loose note")
+        self.assertEqual((anonymous.document, anonymous.owner), (None, None))
+        self.assertEqual(TextEmbedding.objects.get(text="My note").owner, self.user)
+        self.assertEqual(
+            [r.text for r in search_similar_chunks(axis_vector(7), user=self.user)],
+            ["My note"],
+        )
+        response = APIClient().post(
+            reverse("search-embeddings"),
+            {"query_text": "note", "mode": "vector"},
+            format="json",
+        )
+        self.assertEqual([r["text"] for r in response.json()], ["Loose note"])
+
+    @patch("AI.async_services.get_async_ollama_client")
+    def test_created_embeddings_record_the_embedding_version(self, mock_client):
+        mock_client.return_value.embed = AsyncMock(
+            return_value={"embeddings": [axis_vector(3)]}
+        )
+        APIClient().post(
+            reverse("create-embedding"), {"text": "Versioned note"}, format="json"
+        )
+
+        row = TextEmbedding.objects.get(text="Versioned note")
+        active = EmbeddingVersion.objects.active()
+        self.assertEqual(
+            (row.embedding_model, row.embedding_version, row.content_hash),
+            (active.name, active.version, chunk_hash("Versioned note")),
+        )
+
+    def test_search_is_scoped_to_owner(self):
+        other = User.objects.create_user(username="other", password="pass")
+        other_doc = Document.objects.create(
+            user=other, filename="other.txt", file_type="text/plain"
+        )
+        TextEmbedding.objects.create(
+            document=self.doc, owner=self.user, text="mine", embedding=axis_vector(0)
+        )
+        TextEmbedding.objects.create(
+            document=other_doc, owner=other, text="theirs", embedding=axis_vector(0)
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            results = search_similar_chunks(axis_vector(0), user=self.user)
+
+        self.assertEqual([r.text for r in results], ["mine"])
+        executed = [q["sql"] for q in queries.captured_queries]
+        self.assertIn("SET LOCAL hnsw.iterative_scan = relaxed_order", executed)
+        self.assertCountEqual(
+            [r.text for r in search_similar_chunks(axis_vector(0), user=None)],
+            ["mine", "theirs"],
+        )
+
+    def test_hybrid_search_fuses_lexical_and_vector_hits(self):
+        rows = [
+            ("Eigenvalues of a matrix", axis_vector(0)),
+            ("Course CS101 covers recursion", axis_vector(5)),
+            ("Matrix multiplication basics", axis_vector(1)),
+        ]
+        for text, vector in rows:
+            TextEmbedding.objects.create(
+                document=self.doc, owner=self.user, text=text, embedding=vector
+            )
+
+        vector_only = retrieve_chunks(
+            "CS101 matrix", axis_vector(0), user=self.user, mode="vector"
+        )
+        hybrid = retrieve_chunks(
+            "CS101 OR matrix", axis_vector(0), user=self.user, mode="hybrid"
+        )
+
+        self.assertEqual([r.text for r in vector_only], ["Eigenvalues of a matrix"])
+        # Found by both branches, so it ranks first
+        self.assertEqual(hybrid[0].text, "Eigenvalues of a matrix")
+        self.assertEqual((hybrid[0].vector_rank, hybrid[0].lexical_rank), (1, 1))
+        lexical_only = {r.text: r for r in hybrid[1:]}
+        self.assertIn("Course CS101 covers recursion", lexical_only)
+        self.assertIsNone(lexical_only["Course CS101 covers recursion"].distance)
+
+    def test_quantized_indexes_rerank_exactly(self):
+        for axis, text in enumerate(["alpha", "beta", "gamma"]):
+            TextEmbedding.objects.create(
+                document=self.doc,
+                owner=self.user,
+                text=text,
+                embedding=axis_vector(axis),
+            )
+        query = axis_vector(0)
+        query[1] = 0.9
+        # Indexes can't be built while FK checks of the inserts are still deferred
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        for quantization in ("halfvec", "binary"):
+            config = {"QUANTIZATION": quantization, "RERANK_FACTOR": 2}
+            with self.subTest(quantization=quantization), override_settings(
+                VECTOR_INDEX=config
+            ):
+                with connection.schema_editor() as schema_editor:
+                    drop_vector_index(schema_editor, TextEmbedding)
+                    create_vector_index(schema_editor, TextEmbedding)
+
+                for mode in ("vector", "hybrid"):
+                    results = retrieve_chunks(
+                        "unmatched", query, user=self.user, limit=2, mode=mode
+                    )
+                    self.assertEqual([r.text for r in results], ["alpha", "beta"])
+                    self.assertAlmostEqual(results[0].distance, 1 - 1 / 1.345, 2)
+
+    @override_settings(VECTOR_INDEX={"TYPE": "ivfflat", "IVFFLAT_LISTS": 10})
+    def test_index_type_follows_settings(self):
+        index = build_vector_index()
+        self.assertIsInstance(index, IvfflatIndex)
+        self.assertEqual(index.lists, 10)
+
+    @override_settings(VECTOR_INDEX={"QUANTIZATION": "binary"})
+    def test_binary_index_uses_hamming_ops(self):
+        with connection.schema_editor() as schema_editor:
+            drop_vector_index(schema_editor, TextEmbedding)
+            create_vector_index(schema_editor, TextEmbedding)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = %s",
+                [VECTOR_INDEX_NAME],
+            )
+            (indexdef,) = cursor.fetchone()
+        self.assertIn("binary_quantize", indexdef)
+        self.assertIn("bit_hamming_ops", indexdef)
+
+
+class ReembedTests(TestCase):
+    def setUp(self):
+        embedding_cache.clear()
+        user = User.objects.create_user(username="reembedder", password="pass")
+        doc = Document.objects.create(
+            user=user, filename="notes.txt", file_type="text/plain"
+        )
+        for axis, text in enumerate(["alpha", "beta", "gamma"]):
+            TextEmbedding.objects.create(
+                document=doc,
+                owner=user,
+                text=text,
+                embedding=axis_vector(axis),
+                embedding_model="nomic-embed-text",
+            )
+        # ALTER TABLE can't run while FK checks of the inserts are still deferred
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    def table_columns(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT column_name, is_nullable FROM information_schema.columns "
+                "WHERE table_name = %s",
+                [TextEmbedding._meta.db_table],
+            )
+            return dict(cursor.fetchall())
+
+    @patch("AI.services.get_ollama_client")
+    def test_reembed_fills_shadow_columns_then_switches(self, mock_client):
+        axes = {"alpha": 0, "beta": 1, "gamma": 2, "probe": 3}
+        mock_client.return_value.embed.side_effect = lambda model, input, **kw: {
+            "embeddings": [
+                [1.0 if i == axes[text] else 0.0 for i in range(4)] for text in input
+            ]
+        }
+        out = StringIO()
+
+        call_command(
+            "reembed",
+            "--model",
+            "tiny-embed",
+            "--batch-size",
+            "2",
+            "--no-cutover",
+            stdout=out,
+        )
+
+        # Search keeps serving the old model until the cutover
+        self.assertEqual(EmbeddingVersion.objects.active().name, "nomic-embed-text")
+        self.assertIn("embedding_shadow", self.table_columns())
+        query = axis_vector(0)
+        query[1] = 0.9
+        self.assertEqual(
+            [r.text for r in search_similar_chunks(query)], ["alpha", "beta"]
+        )
+
+        # The model field still declares 768 dimensions
+        with self.assertRaisesMessage(CommandError, "A migration changing it"):
+            call_command("reembed", "--model", "tiny-embed", stdout=out)
+        self.assertEqual(EmbeddingVersion.objects.active().name, "nomic-embed-text")
+
+        call_command(
+            "reembed",
+            "--model",
+            "tiny-embed",
+            "--allow-dimension-change",
+            stdout=out,
+        )
+
+        self.assertIn("3/3 rows", out.getvalue())
+        self.assertIn("Resuming re-embedding into tiny-embed", out.getvalue())
+        active = EmbeddingVersion.objects.active()
+        self.assertEqual((active.name, active.dimensions), ("tiny-embed", 4))
+        self.assertTrue(
+            EmbeddingVersion.objects.filter(
+                name="nomic-embed-text", status="retired"
+            ).exists()
+        )
+        columns = self.table_columns()
+        self.assertNotIn("embedding_shadow", columns)
+        self.assertEqual(columns["embedding"], "NO")
+        for row in TextEmbedding.objects.all():
+            self.assertEqual(len(row.embedding), 4)
+            self.assertEqual(row.embedding_model, "tiny-embed")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE indexname LIKE %s",
+                [VECTOR_INDEX_NAME + "%"],
+            )
+            self.assertEqual(cursor.fetchall(), [(VECTOR_INDEX_NAME,)])
+        self.assertEqual(
+            [r.text for r in search_similar_chunks([1.0, 0.9, 0.0, 0.0])],
+            ["alpha", "beta"],
+        )
+        # Queries are embedded with the new model
+        generate_embedding("gamma")
+        self.assertEqual(
+            mock_client.return_value.embed.call_args.kwargs["model"], "tiny-embed"
+        )
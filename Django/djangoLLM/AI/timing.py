@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+logger = logging.getLogger(__name__)
+
+# Per-request stage timings. Service functions wrap their stages (PDF parsing,
+# embedding, retrieval, generation, ...) in span(); TimingMiddleware collects
+# the spans of each request into a Server-Timing header, an optional "timings"
+# block in JSON responses (?timings=true) and one JSON log line on the
+# "AI.timing" logger. Repeated or parallel spans of one stage are summed.
+
+
+class Timings:
+    """
+    Milliseconds and call counts per stage of one request, in the order the
+    stages were first entered. Thread-safe.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans = {}  # name -> [milliseconds, count]
+
+    def add(self, name: str, milliseconds: float):
+        with self._lock:
+            entry = self._spans.setdefault(name, [0.0, 0])
+            entry[0] += milliseconds
+            entry[1] += 1
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def as_dict(self) -> dict:
+        """
+        {stage: milliseconds} plus the time since the request started as total.
+        """
+        with self._lock:
+            spans = {name: round(ms, 1) for name, (ms, _) in self._spans.items()}
+        return {**spans, "total": round(self.total_ms(), 1)}
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {name: count for name, (_, count) in self._spans.items()}
+
+    def header(self) -> str:
+        """
+        Server-Timing header value.
+        """
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
+
+
+_current = ContextVar("timings", default=None)
+
+
+def current_timings() -> Timings | None:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times the block as stage name of the current request; does nothing outside
+    of a request.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - start) * 1000)
+
+
+def in_request_context(fn):
+    """
+    Wraps fn to run in a copy of the caller's context, so spans of work handed
+    to a thread pool count towards the request.
+    """
+    context = copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def _wants_timings(request) -> bool:
+    value = request.GET.get("timings") or request.headers.get("X-Timings", "")
+    return value.lower() in ("1", "true", "yes")
+
+
+class TimingMiddleware:
+    """
+    Collects the spans of each request; see the comment at the top.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        timings = self._start()
+        return self._finish(request, self.get_response(request), timings)
+
+    async def _acall(self, request):
+        timings = self._start()
+        return self._finish(request, await self.get_response(request), timings)
+
+    def _start(self) -> Timings:
+        # Not reset when the response is returned: a streamed response is
+        # generated afterwards, in the same context. Each request (thread or
+        # ASGI task) sets its own.
+        timings = Timings()
+        _current.set(timings)
+        return timings
+
+    def _finish(self, request, response, timings: Timings):
+        response["Server-Timing"] = timings.header()
+        if response.streaming:
+            # Spans of the generation end with the stream
+            response.streaming_content = self._log_after_stream(
+                request, response, timings
+            )
+            return response
+        if _wants_timings(request) and response.get("Content-Type", "").startswith(
+            "application/json"
+        ):
+            data = json.loads(response.content)
+            if isinstance(data, dict):
+                data["timings"] = timings.as_dict()
+                response.content = json.dumps(data)
+        _log(request, response, timings)
+        return response
+
+    def _log_after_stream(self, request, response, timings: Timings):
+        content = response.streaming_content
+        if response.is_async:
+
+            async def stream():
+                try:
+                    async for chunk in content:
+                        yield chunk
+                finally:
+                    _log(request, response, timings)
+
+        else:
+
+            def stream():
+                try:
+                    yield from content
+                finally:
+                    _log(request, response, timings)
+
+        return stream()
+
+
+def _log(request, response, timings: Timings):
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    record = {
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "timings_ms": timings.as_dict(),
+        "counts": timings.counts(),
+    }
+    logger.info(json.dumps(record), extra={"timings": record})
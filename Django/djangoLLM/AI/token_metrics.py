@@ -0,0 +1,138 @@
+import os
+import threading
+
+from .metrics import (
+    OLLAMA_COLD_LOADS,
+    OLLAMA_PHASE_SECONDS,
+    OLLAMA_SECONDS,
+    OLLAMA_TOKENS,
+)
+
+# Ollama reports token counts and timings (in nanoseconds) with every
+# response; these are summed per model and task to show where generation time
+# goes: loading the model, prefill (prompt_eval) or decoding (eval).
+# A request whose load_duration reaches this many seconds loaded the model
+# cold; a warm model still reports a few milliseconds.
+OLLAMA_COLD_LOAD_SECONDS = float(os.getenv("OLLAMA_COLD_LOAD_SECONDS", "0.5"))
+
+_NS = 1e9
+
+
+class _Totals:
+    def __init__(self):
+        self.requests = 0
+        self.cold_loads = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.load_seconds = 0.0
+        self.prompt_seconds = 0.0
+        self.output_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def add(self, other: "_Totals"):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> dict:
+        def rate(count, seconds):
+            return round(count / seconds, 1) if seconds else None
+
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "prefill_tokens_per_second": rate(self.prompt_tokens, self.prompt_seconds),
+            "decode_tokens_per_second": rate(self.output_tokens, self.output_seconds),
+            "cold_load_rate": round(self.cold_loads / self.requests, 3),
+            "load_seconds": round(self.load_seconds, 3),
+            "prefill_seconds": round(self.prompt_seconds, 3),
+            "decode_seconds": round(self.output_seconds, 3),
+            "total_seconds": round(self.total_seconds, 3),
+        }
+
+
+class TokenMetrics:
+    """
+    Token counters of Ollama responses, summed per (model, task). Thread-safe.
+    """
+
+    def __init__(self, cold_load_seconds: float = OLLAMA_COLD_LOAD_SECONDS):
+        self.cold_load_seconds = cold_load_seconds
+        self._lock = threading.Lock()
+        self._totals = {}  # (model, task) -> _Totals
+
+    def record(self, model: str, task: str, response):
+        """
+        Adds the counters of one Ollama response: a generate, chat or embed
+        response (dict or ollama response object) or the final frame of a
+        stream. Untasked generations are counted as "generate". The counters
+        are exported to Prometheus too (see metrics.py).
+        """
+
+        def field(name):
+            return response.get(name) or 0
+
+        load = field("load_duration") / _NS
+        prompt_seconds = field("prompt_eval_duration") / _NS
+        if not prompt_seconds and not field("eval_count"):
+            # Embeddings only report the total duration
+            prompt_seconds = max(0.0, field("total_duration") / _NS - load)
+        task = task or "generate"
+        cold = load >= self.cold_load_seconds
+        output_seconds = field("eval_duration") / _NS
+        total_seconds = field("total_duration") / _NS
+        with self._lock:
+            totals = self._totals.setdefault((model, task), _Totals())
+            totals.requests += 1
+            totals.cold_loads += cold
+            totals.prompt_tokens += field("prompt_eval_count")
+            totals.output_tokens += field("eval_count")
+            totals.load_seconds += load
+            totals.prompt_seconds += prompt_seconds
+            totals.output_seconds += output_seconds
+            totals.total_seconds += total_seconds
+
+        OLLAMA_SECONDS.labels(model, task).observe(total_seconds)
+        OLLAMA_TOKENS.labels(model, task, "prompt").inc(field("prompt_eval_count"))
+        OLLAMA_TOKENS.labels(model, task, "output").inc(field("eval_count"))
+        OLLAMA_PHASE_SECONDS.labels(model, task, "load").inc(load)
+        OLLAMA_PHASE_SECONDS.labels(model, task, "prefill").inc(prompt_seconds)
+        OLLAMA_PHASE_SECONDS.labels(model, task, "decode").inc(output_seconds)
+        if cold:
+            OLLAMA_COLD_LOADS.labels(model, task).inc()
+
+    def snapshot(self) -> dict:
+        """
+        Copies of the totals per (model, task).
+        """
+        with self._lock:
+            snapshot = {}
+            for key, totals in self._totals.items():
+                snapshot[key] = _Totals()
+                snapshot[key].add(totals)
+            return snapshot
+
+    def stats(self) -> dict:
+        """
+        Totals, prefill and decode tokens per second and the share of cold
+        model loads, per model and task and per model.
+        """
+        by_model = {}
+        by_task = []
+        for (model, task), totals in sorted(self.snapshot().items()):
+            by_model.setdefault(model, _Totals()).add(totals)
+            by_task.append({"model": model, "task": task, **totals.as_dict()})
+        return {
+            "by_model": [
+                {"model": model, **totals.as_dict()}
+                for model, totals in by_model.items()
+            ],
+            "by_task": by_task,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+token_metrics = TokenMetrics()
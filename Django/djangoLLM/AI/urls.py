@@ -13,20 +13,52 @@ urlpatterns = [
     path("notes/upload-video/", views.VideoUploadView.as_view(), name="upload-video"),
     path("embeddings/create/", views.create_embedding, name="create-embedding"),
     path("embeddings/search/", views.search_embeddings, name="search-embeddings"),
+    path(
+        "embeddings/cache-stats/",
+        views.embedding_cache_stats_view,
+        name="embedding-cache-stats",
+    ),
+    path("backends/stats/", views.backend_stats_view, name="backend-stats"),
     path(
         "study-time/",
         views.StudyTimeListCreate.as_view(),
         name="study-time-list-create",
     ),
     path("generate-quiz/", views.generate_quiz_view, name="generate-quiz"),
+    path(
+        "generate-quiz/structured/",
+        views.structured_quiz_view,
+        name="structured-quiz",
+    ),
+    path("generate-flashcards/", views.flashcards_view, name="generate-flashcards"),
     path("hybrid-query/", views.hybrid_rag_query_view, name="hybrid-rag-query"),
     path("summarize-text/", views.text_summarization_view, name="summarize-text"),
+    path(
+        "chat/sessions/",
+        views.ChatSessionListCreate.as_view(),
+        name="chat-session-list-create",
+    ),
+    path(
+        "chat/sessions/<int:pk>/",
+        views.ChatSessionDetail.as_view(),
+        name="chat-session-detail",
+    ),
+    path(
+        "chat/sessions/<int:pk>/messages/",
+        views.chat_message_view,
+        name="chat-message",
+    ),
     path("ollama-proxy/", views.ollama_proxy_view, name="ollama-proxy"),
     path(
         "documents/",
         views.DocumentListCreateView.as_view(),
         name="document-list-create",
     ),
+    path(
+        "documents/<int:pk>/replace/",
+        views.DocumentReplaceView.as_view(),
+        name="document-replace",
+    ),
     path(
         "documents/delete/<int:pk>/",
         views.DocumentDeleteView.as_view(),
@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import OpClass
+from django.db import connection
+from django.db.models import Func
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from pgvector.django import BitField, HalfVectorField, HnswIndex, IvfflatIndex
+
+# Name of the approximate nearest neighbour index on TextEmbedding.embedding
+VECTOR_INDEX_NAME = "ai_textembedding_embedding_ann"
+
+QUANTIZATIONS = ("none", "halfvec", "binary")
+# Largest values pgvector accepts for hnsw.ef_search and ivfflat.probes
+MAX_EF_SEARCH = 1000
+MAX_PROBES = 32768
+
+
+def get_vector_index_settings() -> dict:
+    """
+    Returns settings.VECTOR_INDEX merged over the defaults.
+    """
+    config = {
+        "TYPE": "hnsw",
+        "QUANTIZATION": "none",
+        "RERANK_FACTOR": 4,
+        "HNSW_M": 16,
+        "HNSW_EF_CONSTRUCTION": 64,
+        "IVFFLAT_LISTS": 100,
+        "EF_SEARCH": 40,
+        "PROBES": 1,
+        "ITERATIVE_SCAN": "relaxed_order",
+    }
+    config.update(getattr(settings, "VECTOR_INDEX", {}))
+    config["TYPE"] = config["TYPE"].lower()
+    config["QUANTIZATION"] = config["QUANTIZATION"].lower()
+    if config["TYPE"] not in ("hnsw", "ivfflat"):
+        raise ValueError(
+            f"VECTOR_INDEX['TYPE'] must be 'hnsw' or 'ivfflat', got {config['TYPE']!r}."
+        )
+    if config["QUANTIZATION"] not in QUANTIZATIONS:
+        raise ValueError(
+            f"VECTOR_INDEX['QUANTIZATION'] must be one of {QUANTIZATIONS}, "
+            f"got {config['QUANTIZATION']!r}."
+        )
+    return config
+
+
+def build_vector_index(dimensions: int = 768, column: str = None, name: str = None):
+    """
+    Builds the pgvector index configured in settings.VECTOR_INDEX.
+
+    With quantization the index is built over an expression of the embedding
+    column (halfvec or binary_quantize) instead of the full-precision vectors,
+    which stay in the table for exact re-ranking.
+
+    column indexes a raw column that is not a model field instead of
+    `embedding`, such as the shadow column filled by `manage.py reembed`.
+    """
+    config = get_vector_index_settings()
+    source = RawSQL(connection.ops.quote_name(column), []) if column else "embedding"
+    if config["QUANTIZATION"] == "halfvec":
+        expression = OpClass(
+            Cast(source, HalfVectorField(dimensions=dimensions)),
+            name="halfvec_cosine_ops",
+        )
+    elif config["QUANTIZATION"] == "binary":
+        expression = OpClass(
+            Cast(
+                Func(source, function="binary_quantize"),
+                BitField(length=dimensions),
+            ),
+            name="bit_hamming_ops",
+        )
+    else:
+        expression = OpClass(source, name="vector_cosine_ops")
+
+    name = name or VECTOR_INDEX_NAME
+    if config["TYPE"] == "ivfflat":
+        return IvfflatIndex(expression, name=name, lists=config["IVFFLAT_LISTS"])
+    return HnswIndex(
+        expression,
+        name=name,
+        m=config["HNSW_M"],
+        ef_construction=config["HNSW_EF_CONSTRUCTION"],
+    )
+
+
+def coarse_distance_sql(dimensions: int = 768) -> tuple[str, int]:
+    """
+    Returns the SQL distance expression matching the configured index, taking the
+    query vector as a single %s parameter, and how many candidates per requested
+    row to fetch with it before re-ranking by exact cosine distance.
+    """
+    config = get_vector_index_settings()
+    if config["QUANTIZATION"] == "halfvec":
+        sql = f"(embedding::halfvec({dimensions})) <=> %s::halfvec({dimensions})"
+    elif config["QUANTIZATION"] == "binary":
+        sql = (
+            f"(binary_quantize(embedding)::bit({dimensions})) "
+            "<~> binary_quantize(%s::vector)"
+        )
+    else:
+        return "embedding <=> %s::vector", 1
+    return sql, max(int(config["RERANK_FACTOR"]), 1)
+
+
+def create_vector_index(schema_editor, model, dimensions: int = None):
+    """
+    Creates the configured ANN index on the model's embedding column.
+    dimensions defaults to the field's; pass the active model's after a reembed.
+    """
+    dimensions = dimensions or model._meta.get_field("embedding").dimensions
+    schema_editor.add_index(model, build_vector_index(dimensions))
+
+
+def drop_vector_index(schema_editor, model):
+    """
+    Drops the ANN index if it exists, whatever its type.
+    """
+    schema_editor.execute(
+        f"DROP INDEX IF EXISTS {schema_editor.quote_name(VECTOR_INDEX_NAME)}"
+    )
+
+
+def apply_search_params(
+    ef_search: int = None, probes: int = None, limit: int = 0, filtered: bool = False
+):
+    """
+    Sets the ANN search parameters for the current transaction with SET LOCAL.
+    Must be called inside transaction.atomic(); values fall back to settings.
+    ef_search is raised to at least limit since HNSW returns at most ef_search rows.
+
+    For filtered searches, iterative index scans (pgvector >= 0.8) keep scanning
+    until enough rows pass the filter instead of returning too few results.
+    """
+    config = get_vector_index_settings()
+    ef_search = max(int(ef_search or config["EF_SEARCH"]), limit)
+    probes = int(probes or config["PROBES"])
+    iterative_scan = config["ITERATIVE_SCAN"] if filtered else None
+    with connection.cursor() as cursor:
+        # SET does not accept bind parameters; the values are coerced to int above
+        cursor.execute(f"SET LOCAL hnsw.ef_search = {ef_search}")
+        cursor.execute(f"SET LOCAL ivfflat.probes = {probes}")
+        if iterative_scan in ("strict_order", "relaxed_order"):
+            cursor.execute(f"SET LOCAL hnsw.iterative_scan = {iterative_scan}")
+            cursor.execute(f"SET LOCAL ivfflat.iterative_scan = {iterative_scan}")
@@ -1,4 +1,5 @@
 from django.shortcuts import render
+from django.db import transaction
 from django.http import StreamingHttpResponse
 from rest_framework import generics, status
 from django.contrib.auth.models import User
@@ -8,31 +9,212 @@ from .serializers import (
     TextEmbeddingSerializer,
     StudyTimeSerializer,
     DocumentSerializer,
+    ChatSessionSerializer,
+    ChatSessionDetailSerializer,
 )
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.decorators import api_view, permission_classes
+from adrf.decorators import api_view as async_api_view
+from adrf.views import APIView as AsyncAPIView
 from rest_framework.response import Response
-from .models import Note, TextEmbedding, StudyTime, Document
+from .models import Note, TextEmbedding, StudyTime, Document, ChatSession
 from .services import (
-    generate_embedding,
+    chunk_hash,
+    get_embedding_version,
     extract_text_from_pdf,
-    summarize_text,
+    SUPPORTED_DOCUMENT_TYPES,
     transcribe_audio,
     extract_audio_from_video,
-    generate_quiz,
-    hybrid_rag_generation,
-    get_ollama_host,
+    retrieve_chunks,
     classify_image,
 )
+from .async_services import (
+    achat,
+    agenerate_embedding,
+    agenerate_embeddings,
+    agenerate_quiz,
+    agenerate_structured,
+    ahybrid_rag_generation,
+    astream_chat,
+    astream_hybrid_rag_generation,
+    astream_quiz,
+    astream_summary,
+    asummarize_text,
+    get_async_http_client,
+)
+from .admission import (
+    PRIORITY_INTERACTIVE,
+    Overloaded,
+    ollama_admission,
+    task_priority,
+)
+from .balancer import ollama_hosts
+from .breaker import circuit_breakers
+from .metrics import observe_huggingface
+from .timing import current_timings
+from .token_metrics import token_metrics
+from .cache import embedding_cache
+from asgiref.sync import sync_to_async
+from .structured import FLASHCARDS, MAX_STRUCTURED_ITEMS, QUIZ, StructuredKind
+from .jobs import enqueue_ingestion
+from .vector_index import MAX_EF_SEARCH, MAX_PROBES
 from rest_framework.parsers import MultiPartParser, FormParser
 import os  # Import os for file handling
 import tempfile  # Import tempfile for temporary file creation
 import traceback  # Import traceback for detailed error logging
-import requests
+import asyncio
+import httpx
 import json
+import time
+
+
+def _request_flag(request, name: str) -> bool:
+    """
+    Reads a boolean flag from the request body or query string.
+    """
+    value = request.data.get(name, request.query_params.get(name, False))
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def _stream_format(request) -> str | None:
+    """
+    Returns "ndjson" or "sse" when the request asks for a streamed response
+    (stream=true or stream=sse), else None.
+    """
+    value = request.data.get("stream", request.query_params.get("stream"))
+    if isinstance(value, str) and value.lower() == "sse":
+        return "sse"
+    return "ndjson" if _request_flag(request, "stream") else None
 
-# Reuse the session to keep connection open
-_proxy_session = requests.Session()
+
+def _search_params(request) -> dict:
+    """
+    Reads the optional ef_search and probes ANN search parameters of the
+    request as ints. Raises ValueError with a message for the client if either
+    is not a number in pgvector's range.
+    """
+    params = {}
+    for name, maximum in (("ef_search", MAX_EF_SEARCH), ("probes", MAX_PROBES)):
+        value = request.data.get(name)
+        if value in (None, ""):
+            params[name] = None
+            continue
+        try:
+            params[name] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a whole number.")
+        if not 1 <= params[name] <= maximum:
+            raise ValueError(f"{name} must be between 1 and {maximum}.")
+    return params
+
+
+def _overloaded_response(err: Overloaded) -> Response:
+    """
+    429 response telling the client when to retry a request admission control
+    turned away.
+    """
+    response = Response(
+        {"error": str(err), "retry_after": err.retry_after},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+    )
+    response["Retry-After"] = str(err.retry_after)
+    return response
+
+
+def _offload(func):
+    """
+    Wraps a blocking call that touches no database for an async view. Under
+    ASGI, sync views and thread-sensitive sync_to_async calls (the ORM) all
+    share one thread per worker; parsing, transcoding or waiting on an outside
+    service there would stall every other request, so these run in the
+    default executor instead.
+    """
+    return sync_to_async(func, thread_sensitive=False)
+
+
+def _save_upload(upload, suffix: str) -> str:
+    """
+    Writes an uploaded file to a temporary file and returns its path.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        for chunk in upload.chunks():
+            temp_file.write(chunk)
+        return temp_file.name
+
+
+def _remove_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def _streaming_response(frames, stream_format: str) -> StreamingHttpResponse:
+    """
+    Streams generation frames (see services.stream_generate) as NDJSON lines or
+    server-sent events. frames may be a sync or an async iterator. The final
+    frame gains the time to the first frame, the total time and the request's
+    stage timings (see timing.py), in milliseconds; a failure ends the stream
+    with an error frame.
+    """
+    start = time.monotonic()
+    first_frame = None
+    stages = current_timings()
+
+    def encode(frame):
+        nonlocal first_frame
+        if first_frame is None:
+            first_frame = time.monotonic()
+        if frame.get("done"):
+            frame["timings"] = {
+                "first_frame_ms": round((first_frame - start) * 1000, 1),
+                "total_ms": round((time.monotonic() - start) * 1000, 1),
+            }
+            if stages is not None:
+                stage_ms = stages.as_dict()
+                del stage_ms["total"]
+                frame["timings"].update(stage_ms)
+        data = json.dumps(frame)
+        if stream_format == "sse":
+            return f"data: {data}\n\n".encode()
+        return data.encode() + b"\n"
+
+    def stream_error(stream_err):
+        print(f"Generation Stream Error: {str(stream_err)}")
+        frame = {"error": str(stream_err)}
+        if isinstance(stream_err, Overloaded):
+            frame["retry_after"] = stream_err.retry_after
+        return encode(frame)
+
+    def stream_generator():
+        try:
+            for frame in frames:
+                yield encode(frame)
+        except Exception as stream_err:
+            yield stream_error(stream_err)
+
+    async def async_stream_generator():
+        try:
+            async for frame in frames:
+                yield encode(frame)
+        except Exception as stream_err:
+            yield stream_error(stream_err)
+
+    response = StreamingHttpResponse(
+        (
+            async_stream_generator()
+            if hasattr(frames, "__aiter__")
+            else stream_generator()
+        ),
+        content_type=(
+            "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+        ),
+    )
+    # Keep proxies such as nginx from buffering the stream
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -95,50 +277,66 @@ class DocumentListCreateView(generics.ListCreateAPIView):
                 {"error": "No file provided."}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        doc = Document.objects.create(
-            user=request.user,
-            filename=file.name,
-            file_type=file.content_type,
-            status="processing",
+        if file.content_type not in SUPPORTED_DOCUMENT_TYPES:
+            return Response(
+                {"error": "Unsupported file type."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Parsing and embedding happen in `manage.py ingestion_worker`
+        with transaction.atomic():
+            doc = Document.objects.create(
+                user=request.user,
+                filename=file.name,
+                file_type=file.content_type,
+                status="processing",
+            )
+            enqueue_ingestion(doc, file.read(), file.content_type)
+
+        serializer = self.get_serializer(doc)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_202_ACCEPTED, headers=headers
         )
 
-        try:
-            text_content = ""
-            if file.content_type == "application/pdf":
-                text_content = extract_text_from_pdf(file)
-            elif file.content_type == "text/plain":
-                text_content = file.read().decode("utf-8")
-            else:
-                doc.status = "failed"
-                doc.save()
-                return Response(
-                    {"error": "Unsupported file type."},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
 
-            # For simplicity, embedding the whole text. A more robust solution would chunk it.
-            embedding = generate_embedding(text_content)
-            TextEmbedding.objects.create(
-                document=doc, text=text_content, embedding=embedding
-            )
+class DocumentReplaceView(generics.UpdateAPIView):
+    """
+    Replaces an indexed document with an edited file. Only chunks whose content
+    changed are re-embedded; see services.index_document.
+    """
 
-            doc.status = "indexed"
-            doc.save()
+    serializer_class = DocumentSerializer
+    permission_classes = [IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def get_queryset(self):
+        return Document.objects.filter(user=self.request.user)
 
-            serializer = self.get_serializer(doc)
-            headers = self.get_success_headers(serializer.data)
+    def update(self, request, *args, **kwargs):
+        doc = self.get_object()
+        file = request.data.get("file")
+        if not file:
             return Response(
-                serializer.data, status=status.HTTP_201_CREATED, headers=headers
+                {"error": "No file provided."}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        except Exception as e:
-            doc.status = "failed"
-            doc.save()
+        if file.content_type not in SUPPORTED_DOCUMENT_TYPES:
             return Response(
-                {"error": f"Failed to process document: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                {"error": "Unsupported file type."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
+        with transaction.atomic():
+            doc.filename = file.name
+            doc.file_type = file.content_type
+            doc.status = "processing"
+            doc.save(update_fields=["filename", "file_type", "status"])
+            enqueue_ingestion(doc, file.read(), file.content_type)
+
+        serializer = self.get_serializer(doc)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
 
 class DocumentDeleteView(generics.DestroyAPIView):
     serializer_class = DocumentSerializer
@@ -148,11 +346,32 @@ class DocumentDeleteView(generics.DestroyAPIView):
         return Document.objects.filter(user=self.request.user)
 
 
-class PdfUploadView(generics.CreateAPIView):
+class ChatSessionListCreate(generics.ListCreateAPIView):
+    serializer_class = ChatSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ChatSession.objects.filter(user=self.request.user).order_by(
+            "-updated_at"
+        )
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class ChatSessionDetail(generics.RetrieveDestroyAPIView):
+    serializer_class = ChatSessionDetailSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ChatSession.objects.filter(user=self.request.user)
+
+
+class PdfUploadView(AsyncAPIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         pdf_file = request.data.get("pdf_file")
 
         if not pdf_file:
@@ -161,20 +380,33 @@ class PdfUploadView(generics.CreateAPIView):
             )
 
         try:
-            extracted_text = extract_text_from_pdf(pdf_file)
-            summary = summarize_text(extracted_text)
-            return Response({"summary": summary}, status=status.HTTP_200_OK)
+            extracted_text = await _offload(extract_text_from_pdf)(pdf_file)
+            use_cache = not _request_flag(request, "no_cache")
+            stream_format = _stream_format(request)
+            if stream_format:
+                ollama_admission.check(task_priority("summarize"))
+                return _streaming_response(
+                    astream_summary(extracted_text, use_cache=use_cache),
+                    stream_format,
+                )
+            summary = await asummarize_text(extracted_text, use_cache=use_cache)
+            return Response(
+                {"summary": summary.text, "cached": summary.cached},
+                status=status.HTTP_200_OK,
+            )
+        except Overloaded as e:
+            return _overloaded_response(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
 
-class AudioUploadView(generics.CreateAPIView):
+class AudioUploadView(AsyncAPIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         audio_file = request.data.get("audio_file")
 
         if not audio_file:
@@ -183,31 +415,32 @@ class AudioUploadView(generics.CreateAPIView):
             )
 
         # Save the audio file temporarily to transcribe
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=".mp3"
-        ) as temp_audio_file:
-            for chunk in audio_file.chunks():
-                temp_audio_file.write(chunk)
-            temp_audio_path = temp_audio_file.name
+        temp_audio_path = await _offload(_save_upload)(audio_file, ".mp3")
 
         try:
-            transcribed_text = transcribe_audio(temp_audio_path)
-            summary = summarize_text(transcribed_text)
-            return Response({"summary": summary}, status=status.HTTP_200_OK)
+            transcribed_text = await _offload(transcribe_audio)(temp_audio_path)
+            summary = await asummarize_text(
+                transcribed_text, use_cache=not _request_flag(request, "no_cache")
+            )
+            return Response(
+                {"summary": summary.text, "cached": summary.cached},
+                status=status.HTTP_200_OK,
+            )
+        except Overloaded as e:
+            return _overloaded_response(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         finally:
-            if os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
+            await _offload(_remove_files)(temp_audio_path)
 
 
-class VideoUploadView(generics.CreateAPIView):
+class VideoUploadView(AsyncAPIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         video_file = request.data.get("video_file")
 
         if not video_file:
@@ -216,63 +449,61 @@ class VideoUploadView(generics.CreateAPIView):
             )
 
         # Save the video file temporarily
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=".mp4"
-        ) as temp_video_file:
-            for chunk in video_file.chunks():
-                temp_video_file.write(chunk)
-            temp_video_path = temp_video_file.name
+        temp_video_path = await _offload(_save_upload)(video_file, ".mp4")
 
         temp_audio_path = None  # Initialize to None
 
         try:
-            temp_audio_path = extract_audio_from_video(temp_video_path)
-            transcribed_text = transcribe_audio(temp_audio_path)
-            summary = summarize_text(transcribed_text)
-            return Response({"summary": summary}, status=status.HTTP_200_OK)
+            temp_audio_path = await _offload(extract_audio_from_video)(temp_video_path)
+            transcribed_text = await _offload(transcribe_audio)(temp_audio_path)
+            summary = await asummarize_text(
+                transcribed_text, use_cache=not _request_flag(request, "no_cache")
+            )
+            return Response(
+                {"summary": summary.text, "cached": summary.cached},
+                status=status.HTTP_200_OK,
+            )
+        except Overloaded as e:
+            return _overloaded_response(e)
         except Exception as e:
             return Response(
                 {"error": f"An error occurred: {str(e)}\n{traceback.format_exc()}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
         finally:
-            if os.path.exists(temp_video_path):
-                os.remove(temp_video_path)
-            if temp_audio_path and os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
+            await _offload(_remove_files)(temp_video_path, temp_audio_path)
 
 
-class ImageClassificationView(generics.CreateAPIView):
+class ImageClassificationView(AsyncAPIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         image_file = request.data.get("image")
         if not image_file:
             return Response(
                 {"error": "No image file provided."}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_image:
-            for chunk in image_file.chunks():
-                temp_image.write(chunk)
-            temp_image_path = temp_image.name
+        temp_image_path = await _offload(_save_upload)(image_file, ".jpg")
 
         try:
-            description = classify_image(temp_image_path)
+            # The vision backends (Hugging Face, Ollama, hedging) are blocking
+            description = await _offload(classify_image)(temp_image_path)
             return Response({"description": description}, status=status.HTTP_200_OK)
+        except Overloaded as e:
+            return _overloaded_response(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         finally:
-            if os.path.exists(temp_image_path):
-                os.remove(temp_image_path)
+            await _offload(_remove_files)(temp_image_path)
 
 
-@api_view(["POST"])
+@async_api_view(["POST"])
 @permission_classes([AllowAny])
-def create_embedding(request):
+async def create_embedding(request):
     text = request.data.get("text")
     if not text:
         return Response(
@@ -280,57 +511,172 @@ def create_embedding(request):
         )
 
     try:
-        embedding = generate_embedding(text)
-        text_embedding = TextEmbedding.objects.create(text=text, embedding=embedding)
+        # Recorded like indexed chunks, so versioned retrieval and reembed see it
+        version = await sync_to_async(get_embedding_version)()
+        embedding = (
+            await agenerate_embeddings(
+                [text], version=version, priority=PRIORITY_INTERACTIVE
+            )
+        )[0]
+        owner = request.user if request.user.is_authenticated else None
+        text_embedding = await TextEmbedding.objects.acreate(
+            text=text,
+            embedding=embedding,
+            owner=owner,
+            content_hash=chunk_hash(text),
+            embedding_model=version.name,
+            embedding_version=version.version,
+        )
         serializer = TextEmbeddingSerializer(text_embedding)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(["POST"])
+@async_api_view(["POST"])
 @permission_classes([AllowAny])
-def search_embeddings(request):
+async def search_embeddings(request):
     query_text = request.data.get("query_text")
     if not query_text:
         return Response(
             {"error": "Query text is required."}, status=status.HTTP_400_BAD_REQUEST
         )
+    try:
+        search_params = _search_params(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        query_embedding = generate_embedding(query_text)
+        query_embedding = await agenerate_embedding(query_text)
 
-        results = (
-            TextEmbedding.objects.order_by(CosineDistance("embedding", query_embedding))
-            .annotate(distance=CosineDistance("embedding", query_embedding))
-            .filter(distance__lt=0.5)[:5]
+        results = await sync_to_async(retrieve_chunks)(
+            query_text,
+            query_embedding,
+            user=request.user,
+            limit=5,
+            mode=request.data.get("mode"),
+            **search_params,
         )
 
         serializer = TextEmbeddingSerializer(results, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(["POST"])
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def embedding_cache_stats_view(request):
+    """
+    Returns the embedding cache hit/miss counters of the serving process.
+    """
+    return Response(embedding_cache.stats(), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def backend_stats_view(request):
+    """
+    Returns the serving process's view of its LLM backends: admission queue,
+    Ollama hosts, circuit breakers and the token throughput of its requests.
+    """
+    return Response(
+        {
+            "admission": ollama_admission.stats(),
+            "ollama_hosts": ollama_hosts.stats(),
+            "circuit_breakers": {
+                name: breaker.stats() for name, breaker in circuit_breakers.items()
+            },
+            "tokens": token_metrics.stats(),
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+@async_api_view(["POST"])
 @permission_classes([IsAuthenticated])
-def generate_quiz_view(request):
+async def generate_quiz_view(request):
+    text = request.data.get("text")
+    if not text:
+        return Response(
+            {"error": "Text is required."}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    use_cache = not _request_flag(request, "no_cache")
+    try:
+        stream_format = _stream_format(request)
+        if stream_format:
+            ollama_admission.check(task_priority("quiz"))
+            return _streaming_response(
+                astream_quiz(text, use_cache=use_cache), stream_format
+            )
+
+        quiz = await agenerate_quiz(text, use_cache=use_cache)
+        return Response(
+            {"quiz": quiz.text, "cached": quiz.cached}, status=status.HTTP_200_OK
+        )
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+async def _structured_response(request, kind: StructuredKind, default_count: int):
     text = request.data.get("text")
     if not text:
         return Response(
             {"error": "Text is required."}, status=status.HTTP_400_BAD_REQUEST
         )
+    try:
+        count = int(request.data.get("count", default_count))
+    except (TypeError, ValueError):
+        return Response(
+            {"error": "count must be a number."}, status=status.HTTP_400_BAD_REQUEST
+        )
+    count = max(1, min(count, MAX_STRUCTURED_ITEMS))
 
     try:
-        quiz = generate_quiz(text)
-        return Response({"quiz": quiz}, status=status.HTTP_200_OK)
+        result = await agenerate_structured(
+            kind,
+            text,
+            count,
+            topic=request.data.get("topic", ""),
+            use_cache=not _request_flag(request, "no_cache"),
+        )
+        return Response(
+            {
+                kind.key: result.as_json(),
+                "cached": result.cached,
+                "complete": result.complete,
+                "generations": result.generations,
+            },
+            status=status.HTTP_200_OK,
+        )
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(["POST"])
+@async_api_view(["POST"])
+@permission_classes([IsAuthenticated])
+async def structured_quiz_view(request):
+    return await _structured_response(request, QUIZ, default_count=5)
+
+
+@async_api_view(["POST"])
+@permission_classes([IsAuthenticated])
+async def flashcards_view(request):
+    return await _structured_response(request, FLASHCARDS, default_count=8)
+
+
+@async_api_view(["POST"])
 @permission_classes([IsAuthenticated])
-def hybrid_rag_query_view(request):
+async def hybrid_rag_query_view(request):
     query = request.data.get("query")
     if not query:
         return Response(
@@ -338,56 +684,150 @@ def hybrid_rag_query_view(request):
         )
 
     try:
-        response = hybrid_rag_generation(query, request.user)
+        search_params = _search_params(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    search_params["mode"] = request.data.get("mode")
+    try:
+        stream_format = _stream_format(request)
+        if stream_format:
+            ollama_admission.check(PRIORITY_INTERACTIVE)
+            return _streaming_response(
+                astream_hybrid_rag_generation(query, request.user, **search_params),
+                stream_format,
+            )
+
+        response = await ahybrid_rag_generation(query, request.user, **search_params)
         return Response({"response": response}, status=status.HTTP_200_OK)
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(["POST"])
+@async_api_view(["POST"])
 @permission_classes([IsAuthenticated])
-def text_summarization_view(request):
+async def text_summarization_view(request):
     text = request.data.get("text")
     if not text:
         return Response(
             {"error": "Text is required."}, status=status.HTTP_400_BAD_REQUEST
         )
+    use_cache = not _request_flag(request, "no_cache")
+    try:
+        stream_format = _stream_format(request)
+        if stream_format:
+            ollama_admission.check(task_priority("summarize"))
+            return _streaming_response(
+                astream_summary(text, use_cache=use_cache), stream_format
+            )
+
+        summary = await asummarize_text(text, use_cache=use_cache)
+        return Response(
+            {"summary": summary.text, "cached": summary.cached},
+            status=status.HTTP_200_OK,
+        )
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(["POST"])
+@permission_classes([IsAuthenticated])
+async def chat_message_view(request, pk):
+    """
+    Answers a message in a chat session. Only the new message is sent; the
+    history is kept on the server (see chat.py).
+    """
+    content = request.data.get("content")
+    if not content:
+        return Response(
+            {"error": "Content is required."}, status=status.HTTP_400_BAD_REQUEST
+        )
+    session = await sync_to_async(
+        ChatSession.objects.filter(pk=pk, user=request.user).first
+    )()
+    if session is None:
+        return Response(
+            {"error": "Chat session not found."}, status=status.HTTP_404_NOT_FOUND
+        )
+
     try:
-        summary = summarize_text(text)
-        return Response({"summary": summary}, status=status.HTTP_200_OK)
+        stream_format = _stream_format(request)
+        if stream_format:
+            ollama_admission.check(PRIORITY_INTERACTIVE)
+            return _streaming_response(astream_chat(session, content), stream_format)
+
+        reply, final = await achat(session, content)
+        return Response(
+            {
+                "reply": reply,
+                "message_id": final["message_id"],
+                "prompt_eval_count": final.get("prompt_eval_count"),
+                "eval_count": final.get("eval_count"),
+            },
+            status=status.HTTP_200_OK,
+        )
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(["POST"])
+def _record_proxy_frame(model: str, line: str):
+    """
+    Records the token counters of a proxied stream's final NDJSON frame;
+    other frames and lines that are not JSON objects are passed over. Only
+    lines that may be the final frame are decoded, not every token.
+    """
+    if '"done":true' not in line:
+        return
+    try:
+        frame = json.loads(line)
+    except ValueError:
+        return
+    if isinstance(frame, dict) and frame.get("done"):
+        token_metrics.record(model, "proxy", frame)
+
+
+@async_api_view(["POST"])
 @permission_classes([IsAuthenticated])
-def ollama_proxy_view(request):
+async def ollama_proxy_view(request):
     """
-    Proxies requests from the frontend to the local Ollama instance.
+    Proxies requests from the frontend to an Ollama host, chosen like those of
+    the service functions (see balancer.HostPool).
     Handles both standard and streaming responses.
     Injects keep_alive to keep models loaded.
     """
-    ollama_url = f"{get_ollama_host()}/api/generate"
     payload = request.data
+    model = payload.get("model")
 
     # Inject keep_alive if not present, to ensure model stays in memory
     if "keep_alive" not in payload:
         payload["keep_alive"] = "30m"
 
     stream = payload.get("stream", False)
+    # Connections are pooled per event loop and shared with other requests
+    client = get_async_http_client()
 
     try:
         if stream:
+            ollama_admission.check(PRIORITY_INTERACTIVE)
 
-            def stream_generator():
+            async def stream_generator():
                 try:
-                    with _proxy_session.post(
-                        ollama_url, json=payload, stream=True, timeout=120
-                    ) as resp:
-                        resp.raise_for_status()
-                        for line in resp.iter_lines():
-                            if line:
-                                yield line + b"\n"
+                    async with ollama_admission.aslot(
+                        PRIORITY_INTERACTIVE
+                    ), ollama_hosts.alease(model) as host:
+                        async with client.stream(
+                            "POST", f"{host.url}/api/generate", json=payload
+                        ) as resp:
+                            resp.raise_for_status()
+                            async for line in resp.aiter_lines():
+                                if line:
+                                    _record_proxy_frame(model, line)
+                                    yield line.encode() + b"\n"
                 except Exception as stream_err:
                     print(f"Ollama Stream Error: {str(stream_err)}")
                     yield json.dumps({"error": str(stream_err)}).encode() + b"\n"
@@ -396,17 +836,25 @@ def ollama_proxy_view(request):
                 stream_generator(), content_type="application/x-ndjson"
             )
         else:
-            resp = _proxy_session.post(ollama_url, json=payload, timeout=120)
-            return Response(resp.json(), status=resp.status_code)
+            async with ollama_admission.aslot(
+                PRIORITY_INTERACTIVE
+            ), ollama_hosts.alease(model) as host:
+                resp = await client.post(f"{host.url}/api/generate", json=payload)
+            data = resp.json()
+            if resp.is_success:
+                token_metrics.record(model, "proxy", data)
+            return Response(data, status=resp.status_code)
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         error_details = traceback.format_exc()
         print(f"Ollama Proxy Error: {str(e)}\n{error_details}")
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(["POST"])
+@async_api_view(["POST"])
 @permission_classes([IsAuthenticated])
-def huggingface_proxy_view(request):
+async def huggingface_proxy_view(request):
     """
     Proxies vision requests to Hugging Face Inference API.
     Uses the modern v1/chat/completions (OpenAI Compatible) API
@@ -458,12 +906,14 @@ def huggingface_proxy_view(request):
             f"[AI] Proxying to HF (Messages API): {model} | Payload size: {payload_size/1024:.1f} KB"
         )
 
-        # Use requests.post directly instead of a global session to avoid pool issues with large payloads
+        # Connections are pooled per event loop and shared with other requests
         # Adding a simple retry loop for network/ssl glitches
+        client = get_async_http_client()
         last_err = None
         for attempt in range(2):
+            start = time.monotonic()
             try:
-                resp = requests.post(
+                resp = await client.post(
                     api_url, headers=headers, json=hf_payload, timeout=90
                 )
 
@@ -477,31 +927,29 @@ def huggingface_proxy_view(request):
                             f"https://api-inference.huggingface.co/models/{model}"
                         )
                         print(f"[AI] Chat API 404, trying legacy endpoint...")
-                        resp = requests.post(
+                        resp = await client.post(
                             legacy_url, headers=headers, json=payload, timeout=90
                         )
 
-                    # If we got a real error, return it
-                    if resp.status_code >= 400:
-                        return Response(
-                            resp.json()
-                            if "application/json"
-                            in resp.headers.get("Content-Type", "")
-                            else {"error": resp.text},
-                            status=resp.status_code,
-                        )
+                observe_huggingface(
+                    model, time.monotonic() - start, ok=resp.status_code < 400
+                )
+                # If we got a real error, return it
+                if resp.status_code >= 400:
+                    return Response(
+                        resp.json()
+                        if "application/json" in resp.headers.get("Content-Type", "")
+                        else {"error": resp.text},
+                        status=resp.status_code,
+                    )
 
                 return Response(resp.json(), status=resp.status_code)
-            except (
-                requests.exceptions.SSLError,
-                requests.exceptions.ConnectionError,
-            ) as net_err:
+            except httpx.NetworkError as net_err:
                 last_err = net_err
+                observe_huggingface(model, time.monotonic() - start, ok=False)
                 print(f"[AI] Network/SSL Error on attempt {attempt+1}: {str(net_err)}")
                 if attempt == 0:
-                    import time
-
-                    time.sleep(1)  # Quick wait before retry
+                    await asyncio.sleep(1)  # Quick wait before retry
                     continue
                 break
 
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "AI",
     "rest_framework",
     "rest_framework_simplejwt",
@@ -61,6 +62,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "AI.metrics.MetricsMiddleware",  # First, so it times the whole request
+    "AI.timing.TimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -88,6 +91,7 @@ TEMPLATES = [
     },
 ]
 WSGI_APPLICATION = "djangoLLM.wsgi.application"
+ASGI_APPLICATION = "djangoLLM.asgi.application"
 
 
 # Database
@@ -111,3 +115,64 @@ CORS_ALLOW_CREDENTIALS = True
 
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# Approximate nearest neighbour index on TextEmbedding.embedding.
+# TYPE is "hnsw" or "ivfflat"; run `manage.py rebuild_vector_index` after changing
+# the type or build parameters. EF_SEARCH / PROBES are the per-query defaults.
+# ITERATIVE_SCAN ("relaxed_order", "strict_order" or "off") is used for per-user
+# searches and needs pgvector >= 0.8.
+# QUANTIZATION builds the index over half-precision ("halfvec", 2x smaller) or
+# binary-quantized ("binary", 32x smaller) vectors; searches fetch
+# RERANK_FACTOR x limit candidates from it and re-rank them exactly. Compare
+# recall with `manage.py benchmark_vector_index`.
+VECTOR_INDEX = {
+    "TYPE": os.getenv("VECTOR_INDEX_TYPE", "hnsw"),
+    "QUANTIZATION": os.getenv("VECTOR_INDEX_QUANTIZATION", "none"),
+    "RERANK_FACTOR": int(os.getenv("VECTOR_INDEX_RERANK_FACTOR", "4")),
+    "HNSW_M": int(os.getenv("VECTOR_INDEX_HNSW_M", "16")),
+    "HNSW_EF_CONSTRUCTION": int(os.getenv("VECTOR_INDEX_HNSW_EF_CONSTRUCTION", "64")),
+    "IVFFLAT_LISTS": int(os.getenv("VECTOR_INDEX_IVFFLAT_LISTS", "100")),
+    "EF_SEARCH": int(os.getenv("VECTOR_SEARCH_EF_SEARCH", "40")),
+    "PROBES": int(os.getenv("VECTOR_SEARCH_PROBES", "1")),
+    "ITERATIVE_SCAN": os.getenv("VECTOR_SEARCH_ITERATIVE_SCAN", "relaxed_order"),
+}
+
+# Embedding model used until `manage.py reembed` activates another one; after
+# that the active model is read from the EmbeddingVersion table. VERSION is a
+# free-form label (e.g. the Ollama digest) stored with every embedding row.
+EMBEDDING_MODEL = {
+    "NAME": os.getenv("EMBEDDING_MODEL", "nomic-embed-text"),
+    "VERSION": os.getenv("EMBEDDING_MODEL_VERSION", ""),
+    "DIMENSIONS": int(os.getenv("EMBEDDING_DIMENSIONS", "768")),
+}
+
+# Admission control in front of Ollama (see AI/admission.py). MAX_CONCURRENCY
+# is the limit of the whole deployment: each of the WORKERS web processes
+# (gunicorn starts WEB_CONCURRENCY of them, see entrypoint.sh) admits
+# MAX_CONCURRENCY // WORKERS requests at once, at least one, so Ollama sees at
+# most MAX_CONCURRENCY from the web tier. Every ingestion worker or management
+# command process gets one such share too. MAX_QUEUE and QUEUE_TIMEOUT apply to
+# each process.
+OLLAMA_ADMISSION = {
+    "MAX_CONCURRENCY": int(os.getenv("OLLAMA_MAX_CONCURRENCY", "6")),
+    "WORKERS": int(os.getenv("WEB_CONCURRENCY", "3")),
+    "MAX_QUEUE": int(os.getenv("OLLAMA_MAX_QUEUE", "32")),
+    "QUEUE_TIMEOUT": float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "30")),
+}
+
+# Status lines of the AI app (e.g. indexed documents) are logged at INFO.
+# Stage timings of every request go to the "AI.timing" logger as one JSON line
+# each (see AI/timing.py); TIMING_LOG_LEVEL=WARNING turns them off.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "AI": {"handlers": ["console"], "level": os.getenv("AI_LOG_LEVEL", "INFO")},
+        "AI.timing": {
+            "handlers": ["console"],
+            "level": os.getenv("TIMING_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
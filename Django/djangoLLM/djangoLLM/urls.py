@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.http import JsonResponse
+from AI.metrics import metrics_view
 
 
 def api_root(request):
@@ -26,7 +27,7 @@ def api_root(request):
         {
             "message": "ALLYMIND AI Backend API",
             "version": "1.0",
-            "endpoints": ["/api/ai/", "/admin/"],
+            "endpoints": ["/api/ai/", "/admin/", "/metrics"],
         }
     )
 
@@ -35,4 +36,5 @@ urlpatterns = [
     path("", api_root),
     path("admin/", admin.site.urls),
     path("api/ai/", include("AI.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -33,6 +33,16 @@ fi
 echo "Collecting static files..."
 python3 manage.py collectstatic --noinput || true
 
-# Start Gunicorn WSGI server
+# Metrics of all workers are aggregated through files in this directory, which
+# must start empty (see AI/metrics.py and gunicorn.conf.py)
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Start Gunicorn with Uvicorn (ASGI) workers: the async LLM views wait on Ollama
+# without holding a thread, so each worker serves many concurrent generations.
+# Each worker admits its share of OLLAMA_MAX_CONCURRENCY (see settings.py), so
+# the worker count is exported for Django as well.
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-3}"
 echo "Starting Gunicorn server..."
-exec gunicorn djangoLLM.wsgi:application --bind 0.0.0.0:8000 --workers 3 --timeout 120
+exec gunicorn djangoLLM.asgi:application -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000 --workers "$WEB_CONCURRENCY" --timeout 120
@@ -0,0 +1,10 @@
+# Loaded by gunicorn from the working directory (see entrypoint.sh)
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    """
+    Drops the live gauges of a worker that exited, so /metrics stops counting
+    its in-flight requests and admission slots.
+    """
+    multiprocess.mark_process_dead(worker.pid)
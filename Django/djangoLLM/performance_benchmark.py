@@ -14,6 +14,8 @@ def benchmark_text_generation(model_name, prompt, iterations=3):
 
     total_tokens = 0
     total_time = 0
+    total_prompt_tokens = 0
+    total_prompt_time = 0
 
     for i in range(iterations):
         start_time = time.time()
@@ -21,17 +23,29 @@ def benchmark_text_generation(model_name, prompt, iterations=3):
         end_time = time.time()
 
         elapsed = end_time - start_time
-        # Estimate tokens (rough approximation: 1 token ≈ 4 characters)
-        tokens = len(response["response"]) // 4
-        tps = tokens / elapsed if elapsed > 0 else 0
+        # Token counts and durations (ns) as reported by Ollama
+        tokens = response["eval_count"] or 0
+        decode_time = (response["eval_duration"] or 0) / 1e9
+        prompt_tokens = response["prompt_eval_count"] or 0
+        prompt_time = (response["prompt_eval_duration"] or 0) / 1e9
+        load_time = (response["load_duration"] or 0) / 1e9
+        tps = tokens / decode_time if decode_time > 0 else 0
 
         total_tokens += tokens
-        total_time += elapsed
-
-        print(f"  Run {i+1}: {tokens} tokens in {elapsed:.2f}s ({tps:.2f} TPS)")
+        total_time += decode_time
+        total_prompt_tokens += prompt_tokens
+        total_prompt_time += prompt_time
+
+        print(
+            f"  Run {i+1}: {tokens} tokens in {elapsed:.2f}s "
+            f"({tps:.2f} TPS decode, {prompt_tokens} prompt tokens, "
+            f"load {load_time:.2f}s)"
+        )
 
     avg_tps = total_tokens / total_time if total_time > 0 else 0
-    print(f"\n  Average: {avg_tps:.2f} tokens/second")
+    prefill_tps = total_prompt_tokens / total_prompt_time if total_prompt_time else 0
+    print(f"\n  Average: {avg_tps:.2f} tokens/second (decode)")
+    print(f"  Prefill: {prefill_tps:.2f} tokens/second")
     return avg_tps
 
 